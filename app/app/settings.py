@@ -48,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'images.metrics.metrics_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -141,6 +142,161 @@ AUTH_USER_MODEL = 'images.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'images.authentication.CachedTokenAuthentication',
     ]
 }
+
+# Token, user, tier and tier sizes of authenticated requests are cached
+# in the default cache, which should be shared by all processes (e.g.
+# Redis) so admin edits invalidate every process.
+
+AUTH_CACHE_TIMEOUT = 300
+
+# Thumbnail worker (python manage.py process_thumbnails)
+
+THUMBNAIL_JOB_MAX_ATTEMPTS = 3
+THUMBNAIL_JOB_TIMEOUT = 300
+
+# Near-duplicate search (images/<id>/similar/): default number of the 64
+# perceptual hash bits that may differ, most images returned and searches
+# allowed per user.
+
+SIMILAR_IMAGES_DISTANCE = 6
+SIMILAR_IMAGES_LIMIT = 100
+SIMILAR_IMAGES_THROTTLE_RATE = '600/minute'
+
+# Streaming uploads (images/uploads/)
+
+FILE_UPLOAD_HANDLERS = [
+    'images.blobs.HashingUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+IMAGE_MAX_UPLOAD_SIZE = 1024 * 1024 * 1024
+IMAGE_MAX_PIXELS = 89478485
+
+# Ceilings of a single decode, in pixels and in bytes of the decoded
+# buffer (4 per pixel for color images), checked before decoding. JPEGs
+# are decoded at a reduced scale when the output is smaller, other
+# images at full size. Larger images get 413 or a failed thumbnail.
+
+IMAGE_DECODE_MAX_PIXELS = IMAGE_MAX_PIXELS
+IMAGE_DECODE_MAX_BYTES = 512 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 64 * 1024
+UPLOAD_HEADER_SIZE = 256 * 1024
+
+# Bulk imports (images/uploads/bulk/) store, insert and queue files in
+# batches. Multipart requests are also bound by DATA_UPLOAD_MAX_NUMBER_FILES,
+# larger imports are sent as archives. Zip archives are spooled to disk
+# before reading, up to BULK_UPLOAD_MAX_SIZE bytes.
+
+BULK_UPLOAD_MAX_FILES = 10000
+BULK_UPLOAD_MAX_SIZE = 4 * 1024 * 1024 * 1024
+BULK_UPLOAD_BATCH_SIZE = 100
+DATA_UPLOAD_MAX_NUMBER_FILES = 1000
+
+# Temporary links: 'database' stores a row per link, 'signed' hands out
+# HMAC signed tokens verified without database access. Revoking signed
+# links needs a cache shared by all processes. Database links are cached
+# until they expire only with Redis, a per process cache would keep
+# serving links deleted by another process.
+
+TEMPORARY_LINK_MODE = os.environ.get('TEMPORARY_LINK_MODE', 'database')
+TEMPORARY_LINK_CACHE = bool(os.environ.get('REDIS_URL'))
+
+# On demand renders (images/<id>/render/)
+
+RENDER_CACHE_DIR = '/vol/web/cache/render'
+RENDER_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+RENDER_HOT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+RENDER_HOT_CACHE_MAX_ITEM_BYTES = 512 * 1024
+
+# Image processing engine. Renders requested by API calls run in a pool
+# of processes with a per job timeout and memory cap, and fail fast with
+# 503 when the pool is saturated. The pool is per web worker process.
+
+IMAGE_ENGINE = {
+    'BACKEND': 'images.engine.ProcessPoolEngine',
+    'OPTIONS': {
+        'max_workers': 2,
+        'max_queued': 4,
+        'timeout': 30,
+        'memory_limit': 2 * 1024 * 1024 * 1024,
+        'retry_after': 5,
+    },
+}
+
+TEST_RUNNER = 'app.test_runner.TestRunner'
+
+# Protected media (images/media/<name>, images/binary/<code>/image) is
+# sent by Django with FileResponse ('django'), or handed to the front
+# proxy with X-Accel-Redirect ('nginx', internal location at
+# MEDIA_SENDFILE_URL aliased to MEDIA_ROOT) or X-Sendfile ('apache').
+# Under ASGI (uvicorn) Django reads FileResponse on the event loop.
+# Binary images are read in a thread instead, but originals and
+# thumbnails served by 'django' block the process while they are sent,
+# so use 'nginx' or 'apache' behind uvicorn.
+
+MEDIA_SENDFILE_BACKEND = os.environ.get('MEDIA_SENDFILE_BACKEND', 'django')
+MEDIA_SENDFILE_URL = '/protected-media/'
+
+# Media storage. Local files are laid out in hash sharded directories.
+# STORAGE_BACKEND=s3 keeps them in an S3 compatible object store instead
+# (needs django-storages and boto3), e.g. minio with AWS_S3_ENDPOINT_URL.
+# Partially received uploads always stay on local disk, in MEDIA_ROOT
+# unless UPLOAD_STAGING_ROOT is set.
+
+if os.environ.get('STORAGE_BACKEND') == 's3':
+    DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
+    AWS_STORAGE_BUCKET_NAME = os.environ.get('AWS_STORAGE_BUCKET_NAME')
+    AWS_S3_ENDPOINT_URL = os.environ.get('AWS_S3_ENDPOINT_URL')
+    AWS_S3_REGION_NAME = os.environ.get('AWS_S3_REGION_NAME')
+    AWS_DEFAULT_ACL = None
+    AWS_QUERYSTRING_EXPIRE = 3600
+
+UPLOAD_STAGING_ROOT = os.environ.get('UPLOAD_STAGING_ROOT')
+
+# Seconds file existence and metadata are cached for, so hot media costs
+# no stat. Files are deleted by other processes (sweep_temp_links), so
+# this needs the default cache to be shared by all processes, it is off
+# without Redis.
+
+STORAGE_METADATA_CACHE_TIMEOUT = 3600 if os.environ.get('REDIS_URL') else 0
+
+# Rate limits. Tiers set upload_rate, render_rate and temp_link_rate,
+# binary image downloads are limited per client address. Hits are
+# counted in COUNTER_BACKENDS: images.counters.DatabaseCounter,
+# RedisCounter (OPTIONS {'url': ...}) or LocMemCounter, which counts per
+# process. Downloads use Redis or process memory, so hot temporary links
+# keep being served without database queries.
+
+REDIS_URL = os.environ.get('REDIS_URL')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': REDIS_URL},
+    }
+    COUNTER_BACKENDS = {
+        'default': {'BACKEND': 'images.counters.RedisCounter', 'OPTIONS': {'url': REDIS_URL}},
+        'downloads': {'BACKEND': 'images.counters.RedisCounter', 'OPTIONS': {'url': REDIS_URL}},
+    }
+else:
+    COUNTER_BACKENDS = {
+        'default': {'BACKEND': 'images.counters.DatabaseCounter'},
+        'downloads': {'BACKEND': 'images.counters.LocMemCounter'},
+    }
+
+BINARY_IMAGE_THROTTLE_RATE = '600/minute'
+
+# Instrumentation. With SERVER_TIMING=1 responses carry a Server-Timing
+# header with the time spent per stage, database queries and cache hits,
+# visible to every client, so it is meant for development. Prometheus
+# metrics are served at /metrics to METRICS_ALLOWED_IPS, matched against
+# REMOTE_ADDR: behind a proxy that is the proxy's address, so don't
+# route /metrics through it. With several worker processes set
+# PROMETHEUS_MULTIPROC_DIR to an empty directory shared by them, so every
+# scrape sees all of them.
+
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '0') == '1'
+METRICS_ALLOWED_IPS = os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')
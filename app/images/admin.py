@@ -18,6 +18,8 @@ class UserAdmin(UserAdmin):
 
 
 admin.site.register(models.Image)
+admin.site.register(models.Blob)
 admin.site.register(models.Tier)
 admin.site.register(models.Size)
+admin.site.register(models.ThumbnailJob)
 # admin.site.register(models.User, UserAdmin)
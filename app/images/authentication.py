@@ -0,0 +1,92 @@
+"""
+Token authentication resolving token, user, tier and tier sizes from
+the cache, so an authenticated request usually needs no database query
+before the view runs.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import prefetch_related_objects
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .metrics import cache_lookup
+from .models import User
+from .thumbnails import get_user_tier
+
+TIERS_VERSION_KEY = 'auth:tiers-version'
+
+
+def token_cache_key(key):
+    return f'auth:token:{key}'
+
+
+def user_cache_key(user_id, version):
+    return f'auth:user:{version}:{user_id}'
+
+
+def bump_tiers_version():
+    """
+    Invalidate every cached user after a tier or size changed. Entries
+    of older versions are never read again and expire on their own.
+    """
+    cache.add(TIERS_VERSION_KEY, 1, None)
+    try:
+        cache.incr(TIERS_VERSION_KEY)
+    except ValueError:
+        cache.set(TIERS_VERSION_KEY, 2, None)
+
+
+def forget_token(key):
+    cache.delete(token_cache_key(key))
+
+
+def forget_user(user_id):
+    cache.delete(user_cache_key(user_id, cache.get(TIERS_VERSION_KEY, 1)))
+
+
+def load_user(user_id):
+    """User with its tier and the tier's sizes loaded, or None."""
+    user = User.objects.select_related('tier').filter(pk=user_id).first()
+    if user is not None:
+        prefetch_related_objects([get_user_tier(user)], 'sizes')
+    return user
+
+
+def resolve_token(key):
+    """
+    User of a token key with tier and sizes attached, or None when the
+    token doesn't exist. A warm cache answers with two cache reads.
+    """
+    cached = cache.get_many([token_cache_key(key), TIERS_VERSION_KEY])
+    user_id = cached.get(token_cache_key(key))
+    version = cached.get(TIERS_VERSION_KEY, 1)
+    cache_lookup('auth', user_id is not None)
+    if user_id is None:
+        user_id = Token.objects.filter(key=key).values_list('user_id', flat=True).first()
+        if user_id is None:
+            return None
+        cache.set(token_cache_key(key), user_id, settings.AUTH_CACHE_TIMEOUT)
+    user = cache.get(user_cache_key(user_id, version))
+    if user is None:
+        user = load_user(user_id)
+        if user is None:
+            return None
+        cache.set(user_cache_key(user_id, version), user, settings.AUTH_CACHE_TIMEOUT)
+    return user
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication backed by resolve_token. Cached entries are
+    dropped by signals when tokens, users, tiers or sizes change.
+    """
+
+    def authenticate_credentials(self, key):
+        user = resolve_token(key)
+        if user is None:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        return (user, Token(key=key, user=user))
@@ -0,0 +1,271 @@
+"""
+Benchmarks of the image pipeline and API hot paths, run by the benchmark
+command against synthetic data.
+"""
+import io
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image as PILImage
+from rest_framework.test import APIClient
+
+from .binary import render_binary_image
+from .blobs import store_uploaded_file
+from .formats import MODERN_FORMATS
+from .links import get_temporary_link, sign_temporary_link
+from .models import Image, Size, TemporaryLinkModel, ThumbnailJob, Tier
+from .processing import render_thumbnails
+from .serializers import ImageSerializer
+from .thumbnails import save_thumbnail
+
+# Metrics compared against a baseline, and whether higher is better.
+METRICS = {
+    'median_ms': False,
+    'p95_ms': False,
+    'queries': False,
+    'ops_per_sec': True,
+}
+
+
+def synthetic_image(width, height, image_format='JPEG'):
+    """
+    Deterministic photo-like test image, gradients at different angles
+    per channel, so encoders have real work to do.
+    """
+    red = PILImage.linear_gradient('L').resize((width, height))
+    green = PILImage.radial_gradient('L').resize((width, height))
+    blue = PILImage.linear_gradient('L').rotate(90).resize((width, height))
+    output = io.BytesIO()
+    PILImage.merge('RGB', (red, green, blue)).save(output, format=image_format, quality=90)
+    return output.getvalue()
+
+
+def measure(func, repeat):
+    """Time repeat calls of func, in milliseconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return {
+        'median_ms': round(statistics.median(times), 3),
+        'p95_ms': round(times[min(len(times) - 1, int(len(times) * 0.95))], 3),
+    }
+
+
+def throughput(func, iterations):
+    """Calls of func per second."""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return {'ops_per_sec': round(iterations / (time.perf_counter() - start), 1)}
+
+
+def measure_request(client, method, url, repeat, data=None, **extra):
+    """
+    Time a request and count the queries of its last run. data may be a
+    callable returning fresh data for every request, e.g. files.
+    """
+    def request():
+        response = getattr(client, method)(url, data() if callable(data) else data, **extra)
+        if response.status_code >= 400:
+            raise RuntimeError(f'{method.upper()} {url} returned {response.status_code}')
+        return response
+
+    result = measure(request, repeat - 1) if repeat > 1 else {}
+    with CaptureQueriesContext(connection) as queries:
+        request()
+    return {**result, 'queries': len(queries)}
+
+
+class Library:
+    """Synthetic user, tier and images the API benchmarks run against."""
+
+    def __init__(self, sizes=(200, 400), original_size=(1600, 1200)):
+        self.tier = Tier.objects.create(name='Benchmark', original=True, temporary_link=True, max_render_px=2000)
+        for size_px in sizes:
+            self.tier.sizes.add(Size.objects.get_or_create(size_px=size_px)[0])
+        self.sizes = list(sizes)
+        self.user = get_user_model().objects.create_user(username='benchmark', password=None, tier=self.tier)
+        self.content = synthetic_image(*original_size)
+        self.blob = store_uploaded_file(ContentFile(self.content, name='benchmark.jpg'))
+        with default_storage.open(self.blob.name, 'rb') as source:
+            thumbnails = render_thumbnails(source, self.sizes)
+        self.thumbnails = {
+            size_px: save_thumbnail(self.blob.name, size_px, thumbnail) for size_px, thumbnail in thumbnails.items()
+        }
+        self.image = self.add_images(1)[0]
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def add_images(self, count):
+        """
+        Add count images sharing the library's original, with rendered
+        thumbnails like a library in steady state.
+        """
+        images = Image.objects.bulk_create(
+            Image(user=self.user, original_image=self.blob.name, blob=self.blob) for _ in range(count))
+        ThumbnailJob.objects.bulk_create(
+            ThumbnailJob(image=image, size_px=size_px, status=ThumbnailJob.Status.DONE,
+                         name=name, formats=','.join(formats))
+            for image in images for size_px, (name, formats) in self.thumbnails.items()
+        )
+        return images
+
+    def resize(self, count):
+        """Grow the library to count images."""
+        current = Image.objects.filter(user=self.user).count()
+        if count > current:
+            self.add_images(count - current)
+
+    def temporary_link(self, threshold=128):
+        expiry_time = timezone.now() + timezone.timedelta(seconds=3600)
+        return TemporaryLinkModel.objects.create(
+            one_time_code=f'benchmark{TemporaryLinkModel.objects.count()}', expiry_time=expiry_time,
+            image=self.image, threshold=threshold)
+
+
+def bench_processing(content, sizes, repeat):
+    """Thumbnail decode and resize per size, encode per size and format, and binary conversion."""
+    results = {}
+    formats = ['JPEG', 'PNG'] + [fmt.upper() for fmt in MODERN_FORMATS]
+    for size_px in sizes:
+        results[f'render.{size_px}'] = measure(lambda: render_thumbnails(io.BytesIO(content), [size_px]), repeat)
+        thumbnail = render_thumbnails(io.BytesIO(content), [size_px])[size_px]
+        for image_format in formats:
+            results[f'encode.{image_format.lower()}.{size_px}'] = measure(
+                lambda: thumbnail.save(io.BytesIO(), format=image_format, quality=85), repeat)
+
+    results['binary'] = measure(lambda: render_binary_image(io.BytesIO(content), 128), repeat)
+    return results
+
+
+def bench_list(library, library_sizes, repeat):
+    """List endpoint latency and queries by library size, and the serializer alone."""
+    results = {}
+    url = reverse('images:image-list')
+    factory = RequestFactory()
+    for count in library_sizes:
+        library.resize(count)
+        results[f'list.{count}'] = measure_request(library.client, 'get', url, repeat, {'page_size': 100})
+
+        request = factory.get(url)
+        request.user = library.user
+        images = list(Image.objects.filter(user=library.user).prefetch_related('thumbnail_jobs')[:100])
+        context = {'request': request, 'sizes': library.sizes}
+        results[f'serializer.{count}'] = measure(lambda: ImageSerializer(images, many=True, context=context).data,
+                                                 repeat)
+    return results
+
+
+def bench_endpoints(library, repeat):
+    """Latency and queries of every endpoint on a warm library."""
+    client = library.client
+    image = library.image
+    thumbnail = ThumbnailJob.objects.filter(image=image).first()
+    content = synthetic_image(400, 300)
+
+    def upload_data():
+        upload = io.BytesIO(content)
+        upload.name = 'upload.jpg'
+        return {'original_image': upload}
+
+    link = library.temporary_link()
+    results = {
+        'endpoint.upload': measure_request(client, 'post', reverse('images:image-list'), repeat, upload_data,
+                                           format='multipart'),
+        'endpoint.media': measure_request(client, 'get', reverse('images:media', args=[thumbnail.name]), repeat),
+        'endpoint.render': measure_request(client, 'get', reverse('images:image-render', args=[image.pk]),
+                                           repeat, {'w': 300, 'fmt': 'jpeg'}),
+        'endpoint.temp_link': measure_request(client, 'post', reverse('images:get-temp-link'), repeat,
+                                              {'seconds_to_expire': 300, 'image_id': image.pk, 'threshold': 128}),
+        'endpoint.binary': measure_request(APIClient(), 'get',
+                                           reverse('images:binary-image', args=[link.one_time_code]), repeat),
+    }
+    return results
+
+
+def bench_temporary_links(library, iterations):
+    """
+    Temporary link resolution throughput, database links (with a warm cache
+    when TEMPORARY_LINK_CACHE is on) and signed links.
+    """
+    code = library.temporary_link().one_time_code
+    get_temporary_link(code)
+    token = sign_temporary_link(library.image, timezone.now() + timezone.timedelta(seconds=3600), 128)
+    return {
+        'templink.database': throughput(lambda: get_temporary_link(code), iterations),
+        'templink.signed': throughput(lambda: get_temporary_link(token), iterations),
+    }
+
+
+def run(quick=False, only=None):
+    """
+    Run the benchmarks, in full or quick mode, or only those whose group
+    (processing, list, endpoints, templinks) is in only. Needs an empty
+    database and media storage.
+    """
+    repeat = 3 if quick else 10
+    library = Library(original_size=(800, 600) if quick else (3000, 2000))
+    groups = {
+        'processing': lambda: bench_processing(library.content, library.sizes, repeat),
+        'list': lambda: bench_list(library, (10, 100) if quick else (10, 100, 1000, 5000), repeat),
+        'endpoints': lambda: bench_endpoints(library, repeat),
+        'templinks': lambda: bench_temporary_links(library, 200 if quick else 5000),
+    }
+    results = {}
+    for group, bench in groups.items():
+        if only is None or group in only:
+            results.update(bench())
+    return results
+
+
+def compare(results, baseline, tolerance, metrics=None):
+    """
+    Regressions of results against baseline results in the given metrics,
+    all by default. Timings and throughput may be off by tolerance (0.2
+    being 20%), query counts must not grow at all.
+    """
+    regressions = []
+    for name, base in baseline.items():
+        for metric, higher_is_better in METRICS.items():
+            if metrics is not None and metric not in metrics:
+                continue
+            if metric not in base or metric not in results.get(name, {}):
+                continue
+            value, base_value = results[name][metric], base[metric]
+            if metric == 'queries':
+                regressed = value > base_value
+            elif higher_is_better:
+                regressed = value < base_value * (1 - tolerance)
+            else:
+                regressed = value > base_value * (1 + tolerance)
+            if regressed:
+                regressions.append((name, metric, base_value, value))
+    return regressions
+
+
+def environment():
+    """Versions and settings results depend on."""
+    import django
+    import platform
+    import PIL
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'pillow': PIL.__version__,
+        'database': connection.vendor,
+        'modern_formats': MODERN_FORMATS,
+        'temporary_link_mode': settings.TEMPORARY_LINK_MODE,
+        'temporary_link_cache': settings.TEMPORARY_LINK_CACHE,
+    }
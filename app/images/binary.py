@@ -0,0 +1,116 @@
+import functools
+import os
+import struct
+import zlib
+
+from asgiref.sync import sync_to_async
+from django.core.files.storage import default_storage
+
+from .decoding import check_stored_size, decode_full, get_orientation, iter_strips, open_image, oriented_size
+from .engine import get_engine
+from .metrics import cache_lookup, stage
+from .storage import delete_file, file_metadata, save_file, shard
+
+DEFAULT_THRESHOLD = 128
+# Rows thresholded and compressed at a time
+STRIP_ROWS = 256
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+@functools.lru_cache(maxsize=None)
+def threshold_table(threshold):
+    """256 entry lookup table mapping gray levels below threshold to black."""
+    return (0,) * threshold + (255,) * (256 - threshold)
+
+
+def binary_image_name(original_name, threshold):
+    """
+    Storage name of the binary render of an original image at threshold,
+    sharded by the original's name, which is a content hash or a uuid.
+    """
+    stem = os.path.splitext(os.path.basename(original_name))[0]
+    return shard('binary', stem, f'{stem}-{threshold}.png')
+
+
+def delete_binary_images(original_name):
+    """Delete the binary renders of an original at every threshold."""
+    directory, filename = os.path.split(binary_image_name(original_name, DEFAULT_THRESHOLD))
+    stem = filename.rsplit('-', 1)[0]
+    try:
+        file_names = default_storage.listdir(directory)[1]
+    except FileNotFoundError:
+        file_names = []
+    for file_name in file_names:
+        if file_name.startswith(f'{stem}-') and file_name[len(stem) + 1:-len('.png')].isdigit():
+            delete_file(os.path.join(directory, file_name))
+
+
+def png_chunk(chunk_type, data):
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+
+def render_binary_image(source, threshold):
+    """
+    Threshold source image file into an upright 1-bit PNG, returns its
+    bytes. Binary images are full resolution, so the source is decoded
+    once (JPEGs straight to grayscale) and thresholded, rotated and
+    compressed in strips of STRIP_ROWS rows, without full size copies.
+    """
+    table = threshold_table(threshold)
+    with open_image(source) as image:
+        orientation = get_orientation(image)
+        image = decode_full(image, 'L')
+        width, height = oriented_size(image, orientation)
+        stride = (width + 7) // 8
+        compressor = zlib.compressobj()
+        idat = []
+        for strip in iter_strips(image, orientation, STRIP_ROWS):
+            if strip.mode != 'L':
+                strip = strip.convert('L')
+            # 1-bit rows are packed and padded to bytes like PNG's, each
+            # prefixed with filter type 0.
+            packed = strip.point(table, '1').tobytes()
+            idat.append(compressor.compress(b''.join(
+                b'\0' + packed[offset:offset + stride] for offset in range(0, len(packed), stride))))
+        idat.append(compressor.flush())
+    header = struct.pack('>IIBBBBB', width, height, 1, 0, 0, 0, 0)
+    return PNG_SIGNATURE + png_chunk(b'IHDR', header) + png_chunk(b'IDAT', b''.join(idat)) + png_chunk(b'IEND', b'')
+
+
+def write_binary_image(original_name, threshold, name):
+    """Render the binary image of a stored original to name."""
+    with default_storage.open(original_name, 'rb') as source, stage('decode'):
+        data = render_binary_image(source, threshold)
+    with stage('storage_write'):
+        save_file(name, data)
+
+
+def get_binary_image(image, threshold=DEFAULT_THRESHOLD):
+    """
+    Return storage name of the binary render of image, rendering it with
+    the image engine on cache miss, unless image is too large to decode
+    at full resolution.
+    """
+    name = binary_image_name(image.original_image.name, threshold)
+    exists = file_metadata(name) is not None
+    cache_lookup('binary', exists)
+    if not exists:
+        check_stored_size(image)
+        with stage('binary_render'):
+            get_engine().run(write_binary_image, image.original_image.name, threshold, name)
+    return name
+
+
+async def aget_binary_image(image, threshold=DEFAULT_THRESHOLD):
+    """
+    Async get_binary_image, the existence check runs in a thread and the
+    render is awaited without blocking one.
+    """
+    name = binary_image_name(image.original_image.name, threshold)
+    exists = await sync_to_async(file_metadata, thread_sensitive=False)(name) is not None
+    cache_lookup('binary', exists)
+    if not exists:
+        check_stored_size(image)
+        with stage('binary_render'):
+            await get_engine().arun(write_binary_image, image.original_image.name, threshold, name)
+    return name
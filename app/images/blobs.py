@@ -0,0 +1,170 @@
+import hashlib
+import os
+from collections import Counter, defaultdict
+
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import FileUploadHandler
+from django.db import transaction
+from django.db.models import F
+
+from .binary import delete_binary_images
+from .models import Blob
+from .storage import delete_file, move_file, save_file, shard, staging_storage
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """
+    Computes sha256 of uploaded files while they stream in.
+
+    Data is passed on unchanged to the next handler, digests are kept in
+    request.upload_digests by field name.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.digest = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.digest.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        if not hasattr(self.request, 'upload_digests'):
+            self.request.upload_digests = {}
+        self.request.upload_digests[self.field_name] = self.digest.hexdigest()
+        return None
+
+
+def file_sha256(file):
+    """Compute sha256 of a file, reading it in chunks."""
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def blob_name(sha256, ext):
+    """Content addressed storage name of a blob."""
+    return shard('blobs', sha256, f'{sha256}{ext.lower()}')
+
+
+def acquire_blob(sha256, ext, size):
+    """
+    Take a reference to the blob with the given content hash.
+
+    Returns (blob, created). When created, the caller stores the file
+    under blob.name in the same transaction.
+    """
+    blob, created = Blob.objects.select_for_update().get_or_create(
+        sha256=sha256,
+        defaults={'name': blob_name(sha256, ext), 'size': size},
+    )
+    Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+    return blob, created
+
+
+def store_uploaded_file(file, sha256=None, written=None):
+    """
+    Store uploaded file content addressed, returns its blob. The name of
+    a file written is appended to written, see store_uploaded_files.
+    """
+    sha256 = sha256 or file_sha256(file)
+    with transaction.atomic():
+        blob, created = acquire_blob(sha256, os.path.splitext(file.name)[1], file.size)
+        if created:
+            save_file(blob.name, file)
+            if written is not None:
+                written.append(blob.name)
+    return blob
+
+
+def store_uploaded_files(files, written):
+    """
+    Store many (file, sha256) pairs content addressed, returns their blobs
+    in order. References are taken with a few queries for all files
+    instead of a few per file. Run in a transaction.
+
+    Names of the files written are appended to written, so the caller
+    can delete them when its transaction rolls back.
+    """
+    hashes = [sha256 for _, sha256 in files]
+    existing = set(Blob.objects.select_for_update().filter(sha256__in=hashes).values_list('sha256', flat=True))
+    new = {}
+    for file, sha256 in files:
+        if sha256 not in existing and sha256 not in new:
+            new[sha256] = (file, Blob(sha256=sha256, name=blob_name(sha256, os.path.splitext(file.name)[1]),
+                                      size=file.size))
+    # A blob created concurrently is skipped here, it is already referenced
+    # once that transaction commits, so its file is left to it.
+    Blob.objects.bulk_create([blob for _, blob in new.values()], ignore_conflicts=True)
+    blobs = {blob.sha256: blob for blob in Blob.objects.select_for_update().filter(sha256__in=hashes)}
+    for sha256, (file, _) in new.items():
+        blob = blobs[sha256]
+        if blob.ref_count == 0:
+            save_file(blob.name, file)
+            written.append(blob.name)
+    by_count = defaultdict(list)
+    for sha256, count in Counter(hashes).items():
+        by_count[count].append(blobs[sha256].pk)
+    for count, pks in by_count.items():
+        Blob.objects.filter(pk__in=pks).update(ref_count=F('ref_count') + count)
+    return [blobs[sha256] for sha256 in hashes]
+
+
+def store_received_file(name, sha256, moved=None):
+    """
+    Move a fully received upload in staging storage to its blob, returns
+    the blob. The blob name a file was moved to is appended to moved, so
+    the caller can move it back with restore_file when its transaction
+    rolls back.
+    """
+    with transaction.atomic():
+        blob, created = acquire_blob(sha256, os.path.splitext(name)[1], staging_storage.size(name))
+        if created:
+            move_file(staging_storage, name, blob.name)
+            if moved is not None:
+                moved.append(blob.name)
+    if not created:
+        staging_storage.delete(name)
+    return blob
+
+
+def release_blob(blob_id):
+    """
+    Drop a reference to a blob, deleting it with its thumbnails when unused.
+    """
+    with transaction.atomic():
+        Blob.objects.filter(pk=blob_id).update(ref_count=F('ref_count') - 1)
+        blob = Blob.objects.select_for_update().filter(pk=blob_id, ref_count__lte=0).first()
+        if blob is not None:
+            blob.delete()
+            transaction.on_commit(lambda: delete_released_blob_files(blob))
+
+
+def delete_released_blob_files(blob):
+    """
+    Delete the files of a released blob, unless the same content was
+    stored again meanwhile, its file written under the same name.
+    """
+    if not Blob.objects.filter(sha256=blob.sha256).exists():
+        delete_blob_files(blob.name)
+
+
+def delete_blob_files(name):
+    """
+    Delete a blob file and every thumbnail and binary image rendered from
+    it. Thumbnails are named after their source, so they sit next to the
+    blob.
+    """
+    directory, filename = os.path.split(name)
+    try:
+        file_names = default_storage.listdir(directory)[1]
+    except FileNotFoundError:
+        file_names = []
+    for thumbnail_name in file_names:
+        if thumbnail_name.startswith(f'{filename}.'):
+            delete_file(os.path.join(directory, thumbnail_name))
+    delete_binary_images(name)
+    delete_file(name)
@@ -0,0 +1,212 @@
+"""
+Bulk imports: many images from a multipart request or a zip or tar
+archive, stored, inserted and queued in batches.
+"""
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+import zlib
+from functools import partial
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+from rest_framework.exceptions import APIException, Throttled, ValidationError
+
+from .blobs import file_sha256, store_uploaded_files
+from .exceptions import ImageTooLarge
+from .metrics import stage
+from .models import Image
+from .quotas import reserve_quota
+from .storage import delete_file
+from .thumbnails import queue_images_thumbnails
+from .uploads import check_filename, check_size, image_metadata
+
+ZIP_CONTENT_TYPES = ['application/zip', 'application/x-zip-compressed']
+ZIP_ERRORS = (zipfile.BadZipFile, NotImplementedError, RuntimeError, EOFError, zlib.error)
+TAR_ERRORS = (tarfile.TarError, EOFError, zlib.error, OSError)
+TAR_CONTENT_TYPES = ['application/x-tar', 'application/gzip', 'application/x-gzip', 'application/x-bzip2']
+
+
+def is_archive(content_type):
+    return content_type in ZIP_CONTENT_TYPES + TAR_CONTENT_TYPES
+
+
+def is_skipped(name):
+    """Directories and metadata files archivers add, e.g. __MACOSX/."""
+    parts = name.split('/')
+    return '__MACOSX' in parts or parts[-1].startswith('.')
+
+
+def spool(open_source, name, size, errors=()):
+    """
+    Copy an archive member to a temporary file, checking its name and
+    size first. errors raised while reading mean a corrupt member.
+    """
+    check_filename(name)
+    check_size(size)
+    temp_file = tempfile.TemporaryFile()
+    try:
+        with open_source() as source:
+            shutil.copyfileobj(source, temp_file, settings.UPLOAD_CHUNK_SIZE)
+    except errors:
+        temp_file.close()
+        raise ValidationError({'file': 'Archive member is corrupt.'})
+    file = File(temp_file, name=os.path.basename(name))
+    file.size = size
+    return file
+
+
+def spool_body(stream, body):
+    """
+    Copy a request body to body, rejecting it with 413 once it exceeds
+    BULK_UPLOAD_MAX_SIZE, so a client can't fill the disk.
+    """
+    copied = 0
+    while True:
+        chunk = stream.read(settings.UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        copied += len(chunk)
+        if copied > settings.BULK_UPLOAD_MAX_SIZE:
+            raise ImageTooLarge(f'Archives can have at most {settings.BULK_UPLOAD_MAX_SIZE} bytes.')
+        body.write(chunk)
+
+
+def iter_zip(stream):
+    """
+    Members of a zip archive read from stream. Zip archives are indexed
+    at their end, so the body is spooled to a temporary file first.
+    """
+    with tempfile.TemporaryFile() as body:
+        spool_body(stream, body)
+        try:
+            archive = zipfile.ZipFile(body)
+        except zipfile.BadZipFile:
+            raise ValidationError({'archive': 'Request body is not a valid zip archive.'})
+        with archive:
+            for info in archive.infolist():
+                if info.is_dir() or is_skipped(info.filename):
+                    continue
+                yield info.filename, partial(spool, partial(archive.open, info), info.filename, info.file_size,
+                                             ZIP_ERRORS)
+
+
+def iter_tar(stream):
+    """Members of a (compressed) tar archive, streamed from stream."""
+    try:
+        archive = tarfile.open(fileobj=stream, mode='r|*')
+        with archive:
+            for member in archive:
+                if not member.isfile() or is_skipped(member.name):
+                    continue
+                yield member.name, partial(spool, partial(archive.extractfile, member), member.name, member.size,
+                                           TAR_ERRORS)
+    except TAR_ERRORS:
+        raise ValidationError({'archive': 'Request body is not a valid tar archive.'})
+
+
+def iter_archive(stream, content_type):
+    """(name, open) pairs of the files in an archive, open returns a File."""
+    if content_type in ZIP_CONTENT_TYPES:
+        return iter_zip(stream)
+    return iter_tar(stream)
+
+
+def read_image(file):
+    """
+    Validate an image file from its name and header like resumable uploads
+    do, returns its sha256 and metadata.
+    """
+    check_filename(file.name)
+    check_size(file.size)
+    metadata = image_metadata(file)
+    return file_sha256(file), metadata
+
+
+class BulkImport:
+    """
+    Imports files for user in batches of BULK_UPLOAD_BATCH_SIZE. Every
+    batch is stored and counted against the quota and the upload rate in
+    one transaction, its images inserted with one query and their
+    thumbnails queued with two, so per image overhead is a fraction of
+    single uploads.
+    """
+
+    def __init__(self, user, sizes, charge=None):
+        self.user = user
+        self.sizes = sizes
+        # Counts a number of files against the upload rate, raising
+        # Throttled when they don't fit.
+        self.charge = charge
+        self.throttled = None
+        self.results = []
+        self.images = []
+        self.batch = []
+
+    def add(self, name, open_file):
+        """Validate a file and queue it for the next batch."""
+        if len(self.results) >= settings.BULK_UPLOAD_MAX_FILES:
+            raise ValidationError({'files': f'At most {settings.BULK_UPLOAD_MAX_FILES} files can be imported at once.'})
+        result = {'name': name}
+        self.results.append(result)
+        try:
+            file = open_file()
+        except APIException as error:
+            result.update(status='failed', errors=error.detail)
+            return
+        try:
+            with stage('upload_validate'):
+                sha256, metadata = read_image(file)
+        except APIException as error:
+            file.close()
+            result.update(status='failed', errors=error.detail)
+            return
+        self.batch.append((file, sha256, metadata, result))
+        if len(self.batch) >= settings.BULK_UPLOAD_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """Store the queued batch, all of it or none of it."""
+        batch, self.batch = self.batch, []
+        if not batch:
+            return
+        written = []
+        try:
+            with transaction.atomic():
+                reserve_quota(self.user, sum(file.size for file, _, _, _ in batch), count=len(batch))
+                if self.charge is not None:
+                    self.charge(len(batch))
+                with stage('upload_store'):
+                    blobs = store_uploaded_files([(file, sha256) for file, sha256, _, _ in batch], written)
+                images = Image.objects.bulk_create(
+                    Image(user=self.user, original_image=blob.name, blob=blob, **metadata)
+                    for blob, (_, _, metadata, _) in zip(blobs, batch))
+                with stage('queue_thumbnails'):
+                    queue_images_thumbnails(images, self.sizes)
+        except Exception as error:
+            # The batch rolled back, nothing references the files it wrote.
+            for name in written:
+                delete_file(name)
+            if not isinstance(error, APIException):
+                raise
+            if isinstance(error, Throttled):
+                self.throttled = error
+            for _, _, _, result in batch:
+                result.update(status='failed', errors=error.detail)
+            return
+        finally:
+            for file, _, _, _ in batch:
+                file.close()
+        for image, (_, _, _, result) in zip(images, batch):
+            result.update(status='created', image=image)
+        self.images += images
+
+    def finish(self):
+        """Flush the last batch, returns the results in input order."""
+        self.flush()
+        prefetch_related_objects(self.images, 'thumbnail_jobs')
+        return self.results
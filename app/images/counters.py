@@ -0,0 +1,113 @@
+"""
+Atomic counters over fixed time windows, used for rate limiting.
+"""
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Counter
+
+
+class LocMemCounter:
+    """
+    Counters in process memory. Each process counts on its own, so use
+    it for tests and single process deployments.
+    """
+
+    def __init__(self, **options):
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def hit(self, key, window, amount=1):
+        """
+        Add amount to the counter of key, which resets every window
+        seconds. Returns the count and the seconds until the reset.
+        """
+        now = time.monotonic()
+        with self.lock:
+            count, reset_at = self.counters.get(key, (0, 0))
+            if reset_at <= now:
+                count, reset_at = 0, now + window
+            count += amount
+            self.counters[key] = (count, reset_at)
+        return count, reset_at - now
+
+    def clear(self):
+        with self.lock:
+            self.counters.clear()
+
+
+class DatabaseCounter:
+    """Counters in the Counter table, shared by all processes."""
+
+    def __init__(self, **options):
+        pass
+
+    def hit(self, key, window, amount=1):
+        now = timezone.now()
+        with transaction.atomic():
+            counter, _ = Counter.objects.select_for_update().get_or_create(
+                key=key, defaults={'value': 0, 'expires_at': now + timedelta(seconds=window)})
+            if counter.expires_at <= now:
+                counter.value, counter.expires_at = 0, now + timedelta(seconds=window)
+            counter.value += amount
+            counter.save(update_fields=['value', 'expires_at'])
+        return counter.value, (counter.expires_at - now).total_seconds()
+
+    def clear(self):
+        Counter.objects.all().delete()
+
+
+class RedisCounter:
+    """
+    Counters in Redis, shared by all processes. Needs the redis package,
+    client is used instead of connecting to url when passed, e.g. a fake.
+    """
+
+    def __init__(self, url='redis://localhost:6379/0', prefix='counter:', client=None, **options):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+
+    def hit(self, key, window, amount=1):
+        key = self.prefix + key
+        pipeline = self.client.pipeline()
+        pipeline.set(key, 0, ex=window, nx=True)
+        pipeline.incrby(key, amount)
+        pipeline.pttl(key)
+        _, count, ttl = pipeline.execute()
+        return count, max(ttl, 0) / 1000
+
+    def clear(self):
+        for key in self.client.scan_iter(f'{self.prefix}*'):
+            self.client.delete(key)
+
+
+_counters = {}
+_counters_lock = threading.Lock()
+
+
+def get_counter(alias='default'):
+    """Return the counter backend configured by COUNTER_BACKENDS[alias]."""
+    with _counters_lock:
+        if alias not in _counters:
+            config = settings.COUNTER_BACKENDS[alias]
+            _counters[alias] = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+        return _counters[alias]
+
+
+def reset_counters(setting, **kwargs):
+    if setting == 'COUNTER_BACKENDS':
+        with _counters_lock:
+            _counters.clear()
+
+
+setting_changed.connect(reset_counters)
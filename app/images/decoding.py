@@ -0,0 +1,160 @@
+"""
+Decoding of originals at the cheapest resolution an output needs, within
+the IMAGE_DECODE_MAX_PIXELS and IMAGE_DECODE_MAX_BYTES ceilings, which
+are checked before any pixel is decoded.
+"""
+import math
+from contextlib import contextmanager
+
+from django.conf import settings
+from PIL import Image as PILImage, ImageOps
+
+from .exceptions import ImageTooLarge
+
+EXIF_ORIENTATION = 0x0112
+# EXIF orientations that swap width and height
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+# Transpose making an image of an EXIF orientation upright
+ORIENTATION_TRANSPOSES = {
+    2: PILImage.Transpose.FLIP_LEFT_RIGHT,
+    3: PILImage.Transpose.ROTATE_180,
+    4: PILImage.Transpose.FLIP_TOP_BOTTOM,
+    5: PILImage.Transpose.TRANSPOSE,
+    6: PILImage.Transpose.ROTATE_270,
+    7: PILImage.Transpose.TRANSVERSE,
+    8: PILImage.Transpose.ROTATE_90,
+}
+# Pillow keeps pixels of multi band images in 4 bytes.
+BYTES_PER_PIXEL = {'1': 1, 'L': 1, 'P': 1, 'I;16': 2}
+
+
+@contextmanager
+def open_image(source):
+    """Open an image without decoding it, decompression bombs are too large."""
+    try:
+        image = PILImage.open(source)
+    except PILImage.DecompressionBombError:
+        raise ImageTooLarge('Image has too many pixels.')
+    with image:
+        yield image
+
+
+def get_orientation(image):
+    """
+    EXIF orientation of an opened image. JPEG EXIF is in the header, PNG's
+    is only read if it came before the pixel data, getexif would decode
+    them otherwise.
+    """
+    if image.format == 'JPEG' or 'exif' in image.info:
+        return image.getexif().get(EXIF_ORIENTATION, 1)
+    return 1
+
+
+def oriented_size(image, orientation):
+    """Size of image once orientation is applied."""
+    return (image.height, image.width) if orientation in TRANSPOSED_ORIENTATIONS else image.size
+
+
+def check_decode(image):
+    """
+    Raise ImageTooLarge unless the pixel buffer image decodes into, at
+    its current, possibly drafted, size stays within the ceilings.
+    """
+    pixels = image.width * image.height
+    if pixels > settings.IMAGE_DECODE_MAX_PIXELS:
+        raise ImageTooLarge(f'Images can be decoded with at most {settings.IMAGE_DECODE_MAX_PIXELS} pixels.')
+    if pixels * BYTES_PER_PIXEL.get(image.mode, 4) > settings.IMAGE_DECODE_MAX_BYTES:
+        raise ImageTooLarge(f'Images can be decoded into at most {settings.IMAGE_DECODE_MAX_BYTES} bytes.')
+
+
+def check_stored_size(image):
+    """
+    Reject an Image whose stored dimensions exceed the pixel ceiling, so
+    full resolution processing fails before reaching the engine. Images
+    without stored dimensions are checked when decoded.
+    """
+    if image.width and image.height and image.width * image.height > settings.IMAGE_DECODE_MAX_PIXELS:
+        raise ImageTooLarge(f'Images can be decoded with at most {settings.IMAGE_DECODE_MAX_PIXELS} pixels.')
+
+
+def reducible(image):
+    """
+    Image in a mode reduce averages correctly, palette images expanded to
+    RGB or RGBA, 1-bit to L and 16-bit to 32-bit integers.
+    """
+    if image.mode in ('P', 'PA'):
+        transparent = image.mode == 'PA' or 'transparency' in image.info
+        return image.convert('RGBA' if transparent else 'RGB')
+    if image.mode == '1':
+        return image.convert('L')
+    if image.mode == 'I;16':
+        return image.convert('I')
+    return image
+
+
+def decode_reduced(image, width=None, height=None, fit='cover'):
+    """
+    Decode an opened image at the smallest scale whose upright size still
+    covers width x height with fit 'cover', or either side of it with fit
+    'contain', a missing side being unbounded. JPEGs are decoded at
+    reduced DCT scale with draft, other formats are box reduced by an
+    integer factor once decoded. Returns the upright image.
+    """
+    orientation = get_orientation(image)
+    source_width, source_height = oriented_size(image, orientation)
+    scales = [bound / side for bound, side in ((width, source_width), (height, source_height)) if bound]
+    scale = min(1, max(scales) if fit == 'cover' else min(scales)) if scales else 1
+    if scale < 1:
+        image.draft(image.mode if image.mode in ('RGB', 'L') else None,
+                    (math.ceil(image.width * scale), math.ceil(image.height * scale)))
+    check_decode(image)
+    image.load()
+    if scale < 1:
+        stored_width, stored_height = image.size
+        if orientation in TRANSPOSED_ORIENTATIONS:
+            stored_width, stored_height = stored_height, stored_width
+        factor = int(min(stored_width / (source_width * scale), stored_height / (source_height * scale)))
+        if factor >= 2:
+            image = reducible(image).reduce(factor)
+    return ImageOps.exif_transpose(image)
+
+
+def decode_full(image, mode=None):
+    """
+    Decode an opened image at full resolution, as is, straight into mode
+    when the decoder supports it (JPEG to L).
+    """
+    if mode and image.format == 'JPEG':
+        image.draft(mode, image.size)
+    check_decode(image)
+    image.load()
+    return image
+
+
+def strip_box(size, orientation, top, bottom):
+    """
+    Box of a decoded image of size holding rows top to bottom of its
+    upright version.
+    """
+    width, height = size
+    if orientation in (3, 4):
+        return 0, height - bottom, width, height - top
+    if orientation in (5, 6):
+        return top, 0, bottom, height
+    if orientation in (7, 8):
+        return width - bottom, 0, width - top, height
+    return 0, top, width, bottom
+
+
+def iter_strips(image, orientation, rows):
+    """
+    Upright horizontal strips of at most rows rows of a decoded image of
+    orientation, so an output can be processed without an upright copy of
+    the whole image.
+    """
+    height = oriented_size(image, orientation)[1]
+    for top in range(0, height, rows):
+        strip = image.crop(strip_box(image.size, orientation, top, min(top + rows, height)))
+        if orientation in ORIENTATION_TRANSPOSES:
+            strip = strip.transpose(ORIENTATION_TRANSPOSES[orientation])
+        yield strip
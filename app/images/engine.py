@@ -0,0 +1,163 @@
+import asyncio
+import math
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.utils.module_loading import import_string
+
+from .exceptions import EngineBusy, ImageTooLarge, ProcessingTimeout
+
+
+class InlineEngine:
+    """Run image processing in the calling thread, used by tests."""
+
+    def __init__(self, **options):
+        pass
+
+    def run(self, func, *args):
+        try:
+            return func(*args)
+        except MemoryError:
+            raise ImageTooLarge()
+
+    async def arun(self, func, *args):
+        return await sync_to_async(self.run, thread_sensitive=False)(func, *args)
+
+    def shutdown(self):
+        pass
+
+
+def _init_worker(memory_limit):
+    """Cap the address space of a pool process."""
+    if memory_limit:
+        import resource
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+
+def _raise_timeout(signum, frame):
+    raise TimeoutError()
+
+
+def _run_with_timeout(timeout, func, *args):
+    """Run func in a pool process, interrupting it after timeout seconds."""
+    signal.signal(signal.SIGALRM, _raise_timeout)
+    signal.alarm(math.ceil(timeout))
+    try:
+        return func(*args)
+    finally:
+        signal.alarm(0)
+
+
+class ProcessPoolEngine:
+    """
+    Run image processing in a bounded pool of processes, so a huge image
+    can neither block nor exhaust the memory of a request worker.
+
+    At most max_workers + max_queued jobs are accepted at a time, further
+    jobs fail fast with EngineBusy. Each job is interrupted after timeout
+    seconds and a pool process may use at most memory_limit bytes.
+    """
+
+    def __init__(self, max_workers=2, max_queued=4, timeout=30, memory_limit=0, retry_after=5):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.retry_after = retry_after
+        self.slots = threading.BoundedSemaphore(max_workers + max_queued)
+        self.lock = threading.Lock()
+        self.pool = None
+
+    def get_pool(self):
+        with self.lock:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers, initializer=_init_worker, initargs=(self.memory_limit,))
+            return self.pool
+
+    def reset_pool(self, pool):
+        """Replace a pool whose process died, e.g. killed by the OOM killer."""
+        with self.lock:
+            if self.pool is pool:
+                self.pool = None
+        pool.shutdown(wait=False)
+
+    def submit(self, func, *args):
+        """
+        Submit func to the pool, the job holds its slot until it finishes
+        even if the caller stops waiting for it.
+        """
+        if not self.slots.acquire(blocking=False):
+            raise EngineBusy(wait=self.retry_after)
+        try:
+            pool = self.get_pool()
+            future = pool.submit(_run_with_timeout, self.timeout, func, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda future: self.slots.release())
+        return pool, future
+
+    @contextmanager
+    def map_errors(self, pool, future):
+        try:
+            yield
+        except (TimeoutError, asyncio.TimeoutError):
+            future.cancel()
+            raise ProcessingTimeout()
+        except MemoryError:
+            raise ImageTooLarge()
+        except BrokenProcessPool:
+            self.reset_pool(pool)
+            raise ImageTooLarge()
+
+    # Queued jobs wait for a free process, so results are waited for twice
+    # as long as the job timeout before giving up.
+
+    def run(self, func, *args):
+        pool, future = self.submit(func, *args)
+        with self.map_errors(pool, future):
+            return future.result(timeout=self.timeout * 2)
+
+    async def arun(self, func, *args):
+        """Like run, but waits for the result without blocking a thread."""
+        pool, future = self.submit(func, *args)
+        with self.map_errors(pool, future):
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout * 2)
+
+    def shutdown(self):
+        with self.lock:
+            if self.pool is not None:
+                self.pool.shutdown(wait=False)
+                self.pool = None
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """Return the image processing engine configured by IMAGE_ENGINE."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            config = settings.IMAGE_ENGINE
+            _engine = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+        return _engine
+
+
+def reset_engine(setting, **kwargs):
+    global _engine
+    if setting == 'IMAGE_ENGINE':
+        with _engine_lock:
+            if _engine is not None:
+                _engine.shutdown()
+            _engine = None
+
+
+setting_changed.connect(reset_engine)
@@ -0,0 +1,30 @@
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class ImageTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Image is too large.'
+    default_code = 'image_too_large'
+
+
+class ImageNotAnalysed(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Image has not been processed yet, try again once its thumbnails are ready.'
+    default_code = 'image_not_analysed'
+
+
+class EngineBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Image processing is busy, try again later.'
+    default_code = 'engine_busy'
+
+    def __init__(self, detail=None, code=None, wait=None):
+        super().__init__(detail, code)
+        self.wait = wait
+
+
+class ProcessingTimeout(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Image processing took too long.'
+    default_code = 'processing_timeout'
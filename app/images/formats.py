@@ -0,0 +1,60 @@
+import os
+
+from PIL import Image as PILImage, features
+
+try:
+    import pillow_avif  # noqa: F401, registers AVIF with Pillow
+except ImportError:
+    pass
+
+PILImage.init()
+
+# Formats offered to clients that accept them, best first.
+MODERN_FORMATS = [
+    fmt for fmt, supported in (
+        ('avif', 'AVIF' in PILImage.SAVE),
+        ('webp', features.check('webp')),
+    ) if supported
+]
+CONTENT_TYPES = {
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'webp': 'image/webp',
+    'avif': 'image/avif',
+}
+
+
+def accepted_types(accept):
+    """Media types from an Accept header with a non-zero quality."""
+    types = set()
+    for media_range in accept.split(','):
+        media_type, *params = [part.strip() for part in media_range.split(';')]
+        quality = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if media_type and quality > 0:
+            types.add(media_type.lower())
+    return types
+
+
+def negotiate_format(request):
+    """
+    Best modern image format the client explicitly accepts, or None.
+
+    Wildcards like image/* don't count, since older browsers send them
+    without being able to decode WebP or AVIF.
+    """
+    types = accepted_types(request.headers.get('Accept', ''))
+    for fmt in MODERN_FORMATS:
+        if CONTENT_TYPES[fmt] in types:
+            return fmt
+    return None
+
+
+def variant_name(name, fmt):
+    """Storage name of the fmt variant of a rendered thumbnail."""
+    return f'{os.path.splitext(name)[0]}.{fmt}'
@@ -0,0 +1,161 @@
+import hashlib
+from datetime import datetime, timezone as dt_timezone
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.utils import timezone
+
+from .metrics import cache_lookup
+from .models import Image, TemporaryLinkModel
+
+SIGNED_LINK_SALT = 'images.temporary-link'
+# Longest lifetime of a temporary link (see TemporaryLinkSerializer), signed
+# links of deleted images are denied for as long.
+MAX_LINK_SECONDS = 30000
+
+
+def link_cache_key(one_time_code):
+    return f'templink:{one_time_code}'
+
+
+def is_signed_link(code):
+    return ':' in code
+
+
+def name_digest(name):
+    """Short digest binding a signed link to its original, without revealing its name."""
+    return hashlib.sha256(name.encode()).hexdigest()[:16]
+
+
+def sign_temporary_link(image, expiry_time, threshold):
+    """
+    Signed temporary link token carrying everything needed to serve it
+    but the original's storage name, which is looked up by image id.
+    """
+    payload = {
+        'i': image.pk,
+        'h': name_digest(image.original_image.name),
+        'e': int(expiry_time.timestamp()),
+        't': threshold,
+    }
+    return signing.dumps(payload, salt=SIGNED_LINK_SALT, compress=True)
+
+
+def signed_link_image_key(image_id, digest):
+    return f'templink-image:{image_id}:{digest}'
+
+
+def load_signed_link(token):
+    """
+    Verify a signed link token, returns an unsaved TemporaryLinkModel or
+    None when the token is invalid, revoked or its image was deleted.
+
+    The original's name is looked up by image id and cached, so hot links
+    are served without queries.
+    """
+    try:
+        payload = signing.loads(token, salt=SIGNED_LINK_SALT)
+    except signing.BadSignature:
+        return None
+    image_id, digest = payload['i'], payload.get('h')
+    denied_keys = [revoked_cache_key(token), deleted_image_cache_key(image_id, digest)]
+    image_key = signed_link_image_key(image_id, digest)
+    cached = cache.get_many(denied_keys + [image_key])
+    if any(key in cached for key in denied_keys):
+        return None
+    name = cached.get(image_key)
+    if name is None:
+        name = Image.objects.filter(pk=image_id).values_list('original_image', flat=True).first()
+        if name is None or name_digest(name) != digest:
+            return None
+        cache.set(image_key, name, MAX_LINK_SECONDS)
+    return TemporaryLinkModel(
+        one_time_code=token,
+        expiry_time=datetime.fromtimestamp(payload['e'], tz=dt_timezone.utc),
+        threshold=payload['t'],
+        image=Image(pk=image_id, original_image=name),
+    )
+
+
+def revoked_cache_key(token):
+    return f'templink-revoked:{token.rsplit(":", 1)[-1]}'
+
+
+def deleted_image_cache_key(image_id, digest):
+    # Keyed by the original too, SQLite may reuse the id of a deleted row.
+    return f'templink-deleted-image:{image_id}:{digest}'
+
+
+def deny_image_links(image):
+    """
+    Deny signed links of a deleted image until they have all expired, like
+    revoked links they need a cache shared by all processes.
+    """
+    digest = name_digest(image.original_image.name)
+    cache.set(deleted_image_cache_key(image.pk, digest), True, MAX_LINK_SECONDS)
+    cache.delete(signed_link_image_key(image.pk, digest))
+
+
+def get_temporary_link(one_time_code):
+    """
+    Resolve a temporary link by its code, or None if it doesn't exist.
+
+    Signed links are verified in memory. With TEMPORARY_LINK_CACHE
+    database links are cached for their remaining lifetime, so hot links
+    are served without queries.
+    """
+    if is_signed_link(one_time_code):
+        return load_signed_link(one_time_code)
+    if not settings.TEMPORARY_LINK_CACHE:
+        return TemporaryLinkModel.objects.select_related('image').filter(one_time_code=one_time_code).first()
+    key = link_cache_key(one_time_code)
+    temp_link = cache.get(key)
+    cache_lookup('temporary_link', temp_link is not None)
+    if temp_link is None:
+        try:
+            temp_link = TemporaryLinkModel.objects.select_related('image').get(one_time_code=one_time_code)
+        except TemporaryLinkModel.DoesNotExist:
+            return None
+        timeout = (temp_link.expiry_time - timezone.now()).total_seconds()
+        if timeout > 0:
+            cache.set(key, temp_link, timeout)
+    return temp_link
+
+
+async def aget_temporary_link(one_time_code):
+    """
+    Async get_temporary_link, database links are queried with the async ORM.
+    """
+    if is_signed_link(one_time_code):
+        return await sync_to_async(load_signed_link)(one_time_code)
+    if not settings.TEMPORARY_LINK_CACHE:
+        return await TemporaryLinkModel.objects.select_related('image').filter(one_time_code=one_time_code).afirst()
+    key = link_cache_key(one_time_code)
+    temp_link = await cache.aget(key)
+    cache_lookup('temporary_link', temp_link is not None)
+    if temp_link is None:
+        try:
+            temp_link = await TemporaryLinkModel.objects.select_related('image').aget(one_time_code=one_time_code)
+        except TemporaryLinkModel.DoesNotExist:
+            return None
+        timeout = (temp_link.expiry_time - timezone.now()).total_seconds()
+        if timeout > 0:
+            await cache.aset(key, temp_link, timeout)
+    return temp_link
+
+
+def delete_temporary_link(temp_link):
+    """
+    Delete a temporary link, its cache entry is evicted on post_delete.
+
+    Signed links have no row, they are added to the deny-list until they
+    expire instead.
+    """
+    if is_signed_link(temp_link.one_time_code):
+        timeout = (temp_link.expiry_time - timezone.now()).total_seconds()
+        if timeout > 0:
+            cache.set(revoked_cache_key(temp_link.one_time_code), True, timeout)
+        return
+    temp_link.delete()
@@ -0,0 +1,95 @@
+"""
+Django command to benchmark image processing and API hot paths.
+"""
+import json
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from images import benchmarks
+
+GROUPS = ['processing', 'list', 'endpoints', 'templinks']
+
+
+class Command(BaseCommand):
+    """Django command running benchmarks against synthetic data."""
+
+    help = ('Benchmark thumbnail renders, binary conversion, list latency by library size, '
+            'query counts per endpoint and temporary link resolution, optionally comparing '
+            'the results with a baseline.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--quick', action='store_true',
+                            help='Smaller images and libraries and fewer repeats.')
+        parser.add_argument('--only', help=f'Comma separated groups to run, of {", ".join(GROUPS)}.')
+        parser.add_argument('--output', help='File the results are written to as JSON.')
+        parser.add_argument('--baseline', help='JSON results of an earlier run to compare with.')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed slowdown against the baseline, 0.25 being 25%%.')
+        parser.add_argument('--metrics', default=','.join(benchmarks.METRICS),
+                            help='Comma separated metrics compared with the baseline, e.g. queries, '
+                                 'which don\'t depend on the machine.')
+        parser.add_argument('--use-current-database', action='store_true',
+                            help='Run in the current database, which must be empty, instead of '
+                                 'a test database created for the run.')
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        only = None
+        if options['only']:
+            only = set(options['only'].split(','))
+            if only - set(GROUPS):
+                raise CommandError(f'Unknown groups: {", ".join(sorted(only - set(GROUPS)))}.')
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as baseline_file:
+                baseline = json.load(baseline_file)['results']
+
+        results = self.run(options['quick'], only, options['use_current_database'])
+        report = {'environment': benchmarks.environment(), 'quick': options['quick'], 'results': results}
+        for name, result in results.items():
+            self.stdout.write(f'{name:<32} ' + '  '.join(f'{key} {value}' for key, value in result.items()))
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                json.dump(report, output_file, indent=2, sort_keys=True)
+            self.stdout.write(f'Results written to {options["output"]}.')
+
+        if baseline is not None:
+            regressions = benchmarks.compare(results, baseline, options['tolerance'], options['metrics'].split(','))
+            for name, metric, base_value, value in regressions:
+                self.stdout.write(self.style.ERROR(f'{name} {metric}: {base_value} -> {value}'))
+            if regressions:
+                raise CommandError(f'{len(regressions)} regressions against {options["baseline"]}.')
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline.'))
+
+    def run(self, quick, only, use_current_database):
+        """
+        Run benchmarks with media in a temporary directory, images rendered
+        in process and in memory caches and counters, in a test database
+        unless use_current_database.
+        """
+        old_name = None
+        if not use_current_database:
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with tempfile.TemporaryDirectory() as media_root, override_settings(
+                    DEBUG=False,
+                    ALLOWED_HOSTS=['testserver'],
+                    MEDIA_ROOT=media_root,
+                    RENDER_CACHE_DIR=os.path.join(media_root, 'cache'),
+                    UPLOAD_STAGING_ROOT=None,
+                    DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+                    MEDIA_SENDFILE_BACKEND='django',
+                    IMAGE_ENGINE={'BACKEND': 'images.engine.InlineEngine'},
+                    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                        'LOCATION': 'benchmark'}},
+                    COUNTER_BACKENDS={'default': {'BACKEND': 'images.counters.LocMemCounter'},
+                                      'downloads': {'BACKEND': 'images.counters.LocMemCounter'}},
+                    BINARY_IMAGE_THROTTLE_RATE=None):
+                return benchmarks.run(quick, only)
+        finally:
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
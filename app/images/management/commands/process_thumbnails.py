@@ -0,0 +1,58 @@
+"""
+Django command to render queued thumbnails.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from images.thumbnails import claim_jobs, group_jobs, render_jobs
+
+
+def _render(jobs):
+    """Render jobs of an image in a pool thread."""
+    close_old_connections()
+    try:
+        return render_jobs(jobs)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    """Django command running the thumbnail worker pool."""
+
+    help = 'Render queued thumbnails in a pool of worker threads.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=20)
+        parser.add_argument('--sleep', type=float, default=1.0,
+                            help='Seconds to wait when the queue is empty.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty.')
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        workers = options['workers']
+        pool = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        rendered = 0
+        try:
+            while True:
+                jobs = claim_jobs(options['batch_size'])
+                if not jobs:
+                    if options['once']:
+                        break
+                    time.sleep(options['sleep'])
+                    continue
+                if pool:
+                    list(pool.map(_render, group_jobs(jobs)))
+                else:
+                    for image_jobs in group_jobs(jobs):
+                        render_jobs(image_jobs)
+                rendered += len(jobs)
+        finally:
+            if pool:
+                pool.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {rendered} thumbnail jobs.'))
@@ -0,0 +1,43 @@
+"""
+Django command to delete expired temporary links.
+"""
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from images.binary import binary_image_name
+from images.models import TemporaryLinkModel
+from images.storage import delete_file
+
+
+class Command(BaseCommand):
+    """Django command deleting expired temporary links in batches."""
+
+    help = 'Delete expired temporary links and binary images no link uses anymore.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        now = timezone.now()
+        expired = TemporaryLinkModel.objects.filter(expiry_time__lt=now).order_by('expiry_time')
+        deleted = 0
+        binary_images = set()
+        while True:
+            batch = list(expired.values_list('pk', 'image__original_image', 'threshold')[:options['batch_size']])
+            if not batch:
+                break
+            TemporaryLinkModel.objects.filter(pk__in=[pk for pk, *_ in batch]).delete()
+            deleted += len(batch)
+            binary_images.update((name, threshold) for _, name, threshold in batch if name)
+
+        for original_name, threshold in binary_images:
+            in_use = TemporaryLinkModel.objects.filter(
+                image__original_image=original_name,
+                threshold=threshold,
+                expiry_time__gte=now,
+            ).exists()
+            if not in_use:
+                delete_file(binary_image_name(original_name, threshold))
+
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired temporary links.'))
@@ -0,0 +1,181 @@
+"""
+Django command to bring thumbnails in line with current tier sizes.
+"""
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+
+from images.models import Image, ThumbnailJob, Tier
+from images.storage import delete_file
+from images.thumbnails import claim_jobs, group_jobs, queue_thumbnails, record_render, render_image, thumbnail_files
+
+
+def _init_worker():
+    """Make Django usable in pool processes that weren't forked."""
+    django.setup()
+
+
+class Command(BaseCommand):
+    """Django command rendering missing and deleting orphaned thumbnails."""
+
+    help = ('Render thumbnails missing for the tier sizes of image owners and delete '
+            'thumbnails of sizes their tier no longer has.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Images loaded at a time.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Render processes, 1 renders in this process.')
+        parser.add_argument('--max-renders-per-second', type=float, default=0,
+                            help='Images rendered per second, 0 for no limit.')
+        parser.add_argument('--checkpoint',
+                            help='File keeping the last reconciled image id, to resume from.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report what would change.')
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        self.dry_run = options['dry_run']
+        rate = options['max_renders_per_second']
+        self.render_interval = 1 / rate if rate else 0
+        self.next_render = 0
+        self.stats = Counter()
+        self.sizes_by_tier = {}
+        basic_tier = Tier.objects.filter(name='Basic').first()
+        self.basic_tier_id = basic_tier.pk if basic_tier else None
+
+        checkpoint = options['checkpoint']
+        last_id = self.read_checkpoint(checkpoint)
+        if last_id:
+            self.stdout.write(f'Resuming after image {last_id}.')
+
+        workers = options['workers']
+        self.pool = None
+        if workers > 1 and not self.dry_run:
+            self.pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+        try:
+            while True:
+                images = list(
+                    Image.objects.filter(pk__gt=last_id)
+                    .order_by('pk')
+                    .select_related('user')
+                    .prefetch_related('thumbnail_jobs')[:options['batch_size']]
+                )
+                if not images:
+                    break
+                self.reconcile(images)
+                last_id = images[-1].pk
+                if checkpoint and not self.dry_run:
+                    self.write_checkpoint(checkpoint, last_id)
+        finally:
+            if self.pool:
+                self.pool.shutdown()
+
+        if checkpoint and not self.dry_run and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        summary = ', '.join(f'{key}: {value}' for key, value in sorted(self.stats.items()))
+        prefix = 'Dry run, would have changed' if self.dry_run else 'Reconciled'
+        self.stdout.write(self.style.SUCCESS(f'{prefix} thumbnails. {summary or "nothing to do"}'))
+
+    def tier_sizes(self, user):
+        """Thumbnail sizes of user's tier, cached for the run."""
+        tier_id = user.tier_id or self.basic_tier_id
+        if tier_id not in self.sizes_by_tier:
+            self.sizes_by_tier[tier_id] = set(
+                Tier.sizes.through.objects.filter(tier_id=tier_id).values_list('size__size_px', flat=True)
+            )
+        return self.sizes_by_tier[tier_id]
+
+    def reconcile(self, images):
+        """Reconcile thumbnails of a batch of images."""
+        missing = {}
+        orphans = []
+        failed = []
+        for image in images:
+            self.stats['images'] += 1
+            sizes = self.tier_sizes(image.user)
+            jobs = {job.size_px: job for job in image.thumbnail_jobs.all()}
+            orphans += [job for size_px, job in jobs.items() if size_px not in sizes]
+            failed += [job for job in jobs.values()
+                       if job.size_px in sizes and job.status == ThumbnailJob.Status.FAILED]
+            image_missing = [size_px for size_px in sizes if size_px not in jobs]
+            if image_missing:
+                missing[image] = image_missing
+
+        self.stats['missing'] += sum(len(sizes) for sizes in missing.values())
+        self.stats['failed'] += len(failed)
+        self.stats['orphaned'] += len(orphans)
+        if self.dry_run:
+            return
+
+        self.delete_orphans(orphans)
+        for image, sizes in missing.items():
+            queue_thumbnails(image, sizes)
+        ThumbnailJob.objects.filter(pk__in=[job.pk for job in failed]).update(
+            status=ThumbnailJob.Status.PENDING, attempts=0)
+        self.render([image.pk for image in images])
+
+    def delete_orphans(self, orphans):
+        """Delete jobs of sizes no longer in the tier and their unused files."""
+        if not orphans:
+            return
+        ThumbnailJob.objects.filter(pk__in=[job.pk for job in orphans]).delete()
+        names = {job.name: job.formats for job in orphans if job.name}
+        in_use = set(ThumbnailJob.objects.filter(name__in=names).values_list('name', flat=True))
+        for name, formats in names.items():
+            if name not in in_use:
+                for file_name in thumbnail_files(name, formats):
+                    delete_file(file_name)
+                    self.stats['deleted files'] += 1
+
+    def throttle(self):
+        """Sleep to keep renders under the rate limit."""
+        now = time.monotonic()
+        if self.next_render > now:
+            time.sleep(self.next_render - now)
+        self.next_render = max(now, self.next_render) + self.render_interval
+
+    def render(self, image_ids):
+        """Render pending jobs of the batch, one decode per image."""
+        while True:
+            jobs = claim_jobs(100, image_ids=image_ids)
+            if not jobs:
+                break
+            pending = []
+            for image_jobs in group_jobs(jobs):
+                self.throttle()
+                args = (image_jobs[0].image.original_image.name, [job.size_px for job in image_jobs])
+                if self.pool:
+                    pending.append((image_jobs, self.pool.submit(render_image, *args)))
+                else:
+                    self.record(image_jobs, render_image, *args)
+            for image_jobs, future in pending:
+                self.record(image_jobs, future.result)
+
+    def record(self, jobs, render, *args):
+        """Record the outcome of calling render for jobs of an image."""
+        try:
+            rendered = render(*args)
+        except Exception as error:
+            record_render(jobs, error=error)
+            self.stats['render errors'] += len(jobs)
+        else:
+            record_render(jobs, rendered)
+            self.stats['rendered'] += len(jobs)
+
+    @staticmethod
+    def read_checkpoint(path):
+        if path and os.path.exists(path):
+            with open(path) as checkpoint_file:
+                return int(checkpoint_file.read().strip() or 0)
+        return 0
+
+    @staticmethod
+    def write_checkpoint(path, last_id):
+        with open(f'{path}.tmp', 'w') as checkpoint_file:
+            checkpoint_file.write(str(last_id))
+        os.replace(f'{path}.tmp', path)
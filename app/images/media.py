@@ -0,0 +1,151 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseRedirect
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from .storage import file_metadata, forget_file, is_local
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+IMMUTABLE_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'private, no-cache'
+
+
+def media_url(request, name):
+    """Absolute url of the protected media view serving name."""
+    return request.build_absolute_uri(reverse('images:media', args=[name]))
+
+
+def file_etag(metadata):
+    """Strong ETag from size and modification time, like nginx's."""
+    modified = int(metadata['modified'].timestamp() * 1000000)
+    return quote_etag(f'{metadata["size"]:x}-{modified:x}')
+
+
+def parse_range(header, size):
+    """
+    (start, end) of a single byte range request, end inclusive, or None
+    to serve the whole file. Raises ValueError when not satisfiable.
+    """
+    match = RANGE_RE.match(header or '')
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if not start:
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+class RangeFile:
+    """Read up to length bytes of file from its current position."""
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def file_response(request, path, etag, content_type, buffered=False):
+    """
+    Stream a file with FileResponse, which the WSGI server sends with
+    sendfile where it can, answering a single byte range with 206.
+
+    With buffered the file is read into an HttpResponse right away, for
+    callers running this in a thread under ASGI: Django 4.1's ASGI
+    handler iterates FileResponse on the event loop.
+    """
+    file = open(path, 'rb')
+    size = os.fstat(file.fileno()).st_size
+    if 'HTTP_IF_RANGE' in request.META and request.META['HTTP_IF_RANGE'] != etag:
+        byte_range = None
+    else:
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        except ValueError:
+            file.close()
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+    response_class = read_response if buffered else FileResponse
+    if byte_range is None:
+        return response_class(file, content_type=content_type)
+    start, end = byte_range
+    file.seek(start)
+    response = response_class(RangeFile(file, end - start + 1), content_type=content_type, status=206)
+    response['Content-Length'] = end - start + 1
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
+
+
+def read_response(file, **kwargs):
+    """HttpResponse with the content of file, closing it."""
+    try:
+        return HttpResponse(file.read(), **kwargs)
+    finally:
+        file.close()
+
+
+def serve_file(request, name, cache_control_header=None, buffered=False):
+    """
+    Serve a stored file after access was checked, answering conditional
+    requests with 304. Local files are sent by the front proxy with
+    X-Accel-Redirect (nginx) or X-Sendfile (apache) depending on
+    MEDIA_SENDFILE_BACKEND, otherwise by Django. Files in an object
+    store are redirected to with a signed url.
+
+    buffered reads the file in the calling thread, see file_response.
+    Responses revalidate unless cache_control_header says otherwise, e.g.
+    IMMUTABLE_CACHE_CONTROL for blob originals, which are named after the
+    hash of their content. Thumbnails next to them are rendered again
+    under the same name when their size or format changes.
+    """
+    if not is_local():
+        response = HttpResponseRedirect(default_storage.url(name))
+        response['Cache-Control'] = REVALIDATE_CACHE_CONTROL
+        return response
+    metadata = file_metadata(name)
+    if metadata is None:
+        raise Http404()
+    etag = file_etag(metadata)
+    last_modified = int(metadata['modified'].timestamp())
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        path = default_storage.path(name)
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        backend = settings.MEDIA_SENDFILE_BACKEND
+        if backend == 'nginx':
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = settings.MEDIA_SENDFILE_URL + quote(name)
+        elif backend == 'apache':
+            response = HttpResponse(content_type=content_type)
+            response['X-Sendfile'] = path
+        else:
+            try:
+                response = file_response(request, path, etag, content_type, buffered)
+            except FileNotFoundError:
+                forget_file(name)
+                raise Http404()
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = cache_control_header or REVALIDATE_CACHE_CONTROL
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -0,0 +1,160 @@
+"""
+Instrumentation of hot paths: time spent per stage, database queries and
+cache hit ratios, reported per request in the Server-Timing header and
+as Prometheus metrics at /metrics.
+"""
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.utils.decorators import sync_and_async_middleware
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess,
+)
+
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'Request duration by view.', ['method', 'view'])
+REQUESTS = Counter(
+    'http_requests', 'Requests by view and status.', ['method', 'view', 'status'])
+STAGE_DURATION = Histogram(
+    'image_stage_duration_seconds', 'Time spent in a stage, per request or per call outside requests.',
+    ['stage', 'view'])
+DB_QUERIES = Histogram(
+    'db_queries_per_request', 'Database queries per request.', ['view'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, float('inf')))
+CACHE_LOOKUPS = Counter(
+    'image_cache_lookups', 'Cache lookups by cache and result.', ['cache', 'result'])
+
+_timings = ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    """Stage durations, queries and cache lookups of one request."""
+
+    def __init__(self):
+        self.stages = {}
+        self.queries = 0
+        self.caches = {}
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0) + seconds
+
+    def count_lookup(self, cache, hit):
+        hits, misses = self.caches.get(cache, (0, 0))
+        self.caches[cache] = (hits + 1, misses) if hit else (hits, misses + 1)
+
+    def server_timing(self, total):
+        """Server-Timing header value, durations in milliseconds."""
+        metrics = [f'total;dur={total * 1000:.1f}']
+        for name, seconds in self.stages.items():
+            description = f';desc="{self.queries} queries"' if name == 'db' else ''
+            metrics.append(f'{name};dur={seconds * 1000:.1f}{description}')
+        for cache, (hits, misses) in self.caches.items():
+            metrics.append(f'cache-{cache};desc="{hits}/{hits + misses} hits"')
+        return ', '.join(metrics)
+
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block as stage name of the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        timings = _timings.get()
+        if timings is None:
+            STAGE_DURATION.labels(name, '').observe(seconds)
+        else:
+            timings.add(name, seconds)
+
+
+def cache_lookup(cache, hit):
+    """Count a hit or miss of cache."""
+    CACHE_LOOKUPS.labels(cache, 'hit' if hit else 'miss').inc()
+    timings = _timings.get()
+    if timings is not None:
+        timings.count_lookup(cache, hit)
+
+
+def time_query(execute, sql, params, many, context):
+    """Database execute wrapper adding queries to the 'db' stage."""
+    timings = _timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.queries += 1
+        timings.add('db', time.perf_counter() - start)
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """
+    Wrap queries of every connection, async views run queries in other
+    threads, whose connections a per request execute_wrapper would miss.
+    """
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+connection_created.connect(install_query_timer)
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else 'unmatched'
+
+
+def record_request(request, response, timings, start):
+    total = time.perf_counter() - start
+    view = view_name(request)
+    REQUEST_DURATION.labels(request.method, view).observe(total)
+    REQUESTS.labels(request.method, view, response.status_code).inc()
+    DB_QUERIES.labels(view).observe(timings.queries)
+    for name, seconds in timings.stages.items():
+        STAGE_DURATION.labels(name, view).observe(seconds)
+    if settings.SERVER_TIMING:
+        response['Server-Timing'] = timings.server_timing(total)
+    return response
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """Instrument every request, under WSGI and ASGI."""
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            timings, start = RequestTimings(), time.perf_counter()
+            token = _timings.set(timings)
+            try:
+                response = await get_response(request)
+            finally:
+                _timings.reset(token)
+            return record_request(request, response, timings, start)
+    else:
+        def middleware(request):
+            timings, start = RequestTimings(), time.perf_counter()
+            token = _timings.set(timings)
+            try:
+                response = get_response(request)
+            finally:
+                _timings.reset(token)
+            return record_request(request, response, timings, start)
+    return middleware
+
+
+def export():
+    """
+    Metrics in the Prometheus text format, of all processes when they
+    write to PROMETHEUS_MULTIPROC_DIR, otherwise of this process.
+    """
+    registry = REGISTRY
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,17 @@
+# Generated by Django 4.1.13 on 2026-10-18 12:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0002_thumbnailjob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['user', 'id'], name='images_imag_user_id_0df70b_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.13 on 2026-10-18 12:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0005_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='temporarylinkmodel',
+            name='threshold',
+            field=models.PositiveSmallIntegerField(default=128),
+        ),
+    ]
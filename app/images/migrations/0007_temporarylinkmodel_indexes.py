@@ -0,0 +1,23 @@
+# Generated by Django 4.1.13 on 2026-10-18 12:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0006_temporarylinkmodel_threshold'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='temporarylinkmodel',
+            name='expiry_time',
+            field=models.DateTimeField(blank=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='temporarylinkmodel',
+            name='one_time_code',
+            field=models.CharField(max_length=20, unique=True),
+        ),
+    ]
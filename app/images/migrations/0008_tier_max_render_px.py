@@ -0,0 +1,18 @@
+# Generated by Django 4.1.13 on 2026-10-18 12:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0007_temporarylinkmodel_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tier',
+            name='max_render_px',
+            field=models.PositiveIntegerField(default=0, help_text='Largest on demand render side, 0 disables it.'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.13 on 2026-10-18 12:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0008_tier_max_render_px'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thumbnailjob',
+            name='formats',
+            field=models.CharField(blank=True, help_text='Comma separated extra formats rendered.', max_length=50),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 4.1.13 on 2026-10-18 13:10
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import Coalesce
+
+
+def count_usage(apps, schema_editor):
+    User = apps.get_model('images', 'User')
+    users = User.objects.annotate(
+        images_count=Count('images'),
+        images_bytes=Coalesce(Sum('images__blob__size'), 0, output_field=models.BigIntegerField()),
+    ).filter(images_count__gt=0)
+    for user in users.iterator():
+        User.objects.filter(pk=user.pk).update(image_count=user.images_count, stored_bytes=user.images_bytes)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0009_thumbnailjob_formats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Counter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=200, unique=True)),
+                ('value', models.BigIntegerField(default=0)),
+                ('expires_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='tier',
+            name='max_images',
+            field=models.PositiveIntegerField(default=0, help_text='Images a user may keep, 0 for no limit.'),
+        ),
+        migrations.AddField(
+            model_name='tier',
+            name='max_storage_bytes',
+            field=models.PositiveBigIntegerField(default=0, help_text='Bytes of originals a user may keep, 0 for no limit.'),
+        ),
+        migrations.AddField(
+            model_name='tier',
+            name='render_rate',
+            field=models.CharField(blank=True, help_text='On demand renders allowed, e.g. 600/hour.', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='tier',
+            name='temp_link_rate',
+            field=models.CharField(blank=True, help_text='Temporary links allowed, e.g. 100/day.', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='tier',
+            name='upload_rate',
+            field=models.CharField(blank=True, help_text='Uploads allowed, e.g. 100/hour, empty for no limit.', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='image_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='stored_bytes',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(count_usage, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.1.13 on 2026-10-18 14:14
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0013_image_dhash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tier',
+            name='render_rate',
+            field=models.CharField(blank=True, help_text='On demand renders allowed, e.g. 600/hour.', max_length=20, validators=[django.core.validators.RegexValidator('^\\d+/[smhd][a-z]*$', 'Enter a rate like 100/hour.')]),
+        ),
+        migrations.AlterField(
+            model_name='tier',
+            name='temp_link_rate',
+            field=models.CharField(blank=True, help_text='Temporary links allowed, e.g. 100/day.', max_length=20, validators=[django.core.validators.RegexValidator('^\\d+/[smhd][a-z]*$', 'Enter a rate like 100/hour.')]),
+        ),
+        migrations.AlterField(
+            model_name='tier',
+            name='upload_rate',
+            field=models.CharField(blank=True, help_text='Uploads allowed, e.g. 100/hour, empty for no limit.', max_length=20, validators=[django.core.validators.RegexValidator('^\\d+/[smhd][a-z]*$', 'Enter a rate like 100/hour.')]),
+        ),
+    ]
@@ -1,16 +1,22 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.core.validators import RegexValidator
 import os
 import uuid
 from django.conf import settings
 
 
 def image_file_path(instance, filename):
-    """Generate file path for new image."""
+    """Generate file path for new image, sharded by its random name."""
     ext = os.path.splitext(filename)[1]
-    filename = f'{uuid.uuid4()}{ext}'
+    key = uuid.uuid4().hex
+    filename = f'{key}{ext}'
 
-    return os.path.join('uploads', filename)
+    return os.path.join('uploads', key[:2], key[2:4], filename)
+
+
+# Rates as parsed by DRF throttles: requests per s(econd), m(inute), h(our) or d(ay)
+validate_rate = RegexValidator(r'^\d+/[smhd][a-z]*$', 'Enter a rate like 100/hour.')
 
 
 class Size(models.Model):
@@ -25,6 +31,16 @@ class Tier(models.Model):
     sizes = models.ManyToManyField(Size, related_name='tiers', blank=True)
     original = models.BooleanField(default=False)
     temporary_link = models.BooleanField(default=False, null=True)
+    max_render_px = models.PositiveIntegerField(default=0, help_text='Largest on demand render side, 0 disables it.')
+    upload_rate = models.CharField(max_length=20, blank=True, validators=[validate_rate],
+                                   help_text='Uploads allowed, e.g. 100/hour, empty for no limit.')
+    render_rate = models.CharField(max_length=20, blank=True, validators=[validate_rate],
+                                   help_text='On demand renders allowed, e.g. 600/hour.')
+    temp_link_rate = models.CharField(max_length=20, blank=True, validators=[validate_rate],
+                                      help_text='Temporary links allowed, e.g. 100/day.')
+    max_images = models.PositiveIntegerField(default=0, help_text='Images a user may keep, 0 for no limit.')
+    max_storage_bytes = models.PositiveBigIntegerField(default=0,
+                                                       help_text='Bytes of originals a user may keep, 0 for no limit.')
 
     def __str__(self):
         return self.name
@@ -32,18 +48,106 @@ class Tier(models.Model):
 
 class User(AbstractUser):
     tier = models.ForeignKey(Tier, on_delete=models.deletion.SET_NULL, related_name='users', null=True)
+    image_count = models.PositiveIntegerField(default=0)
+    stored_bytes = models.PositiveBigIntegerField(default=0)
 
     def __str__(self):
         return self.username
 
 
+class Blob(models.Model):
+    """Original image file shared by all images with the same content."""
+    sha256 = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    ref_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return self.sha256
+
+
 class Image(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.deletion.CASCADE, related_name='images')
     original_image = models.ImageField(upload_to=image_file_path)
+    blob = models.ForeignKey(Blob, on_delete=models.deletion.PROTECT, related_name='images', null=True, blank=True)
+    placeholder = models.TextField(blank=True)
+    dominant_color = models.CharField(max_length=7, blank=True)
+    # Read from the header at upload, width and height with the EXIF
+    # orientation applied. Empty for images uploaded before.
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    format = models.CharField(max_length=10, blank=True)
+    file_size = models.BigIntegerField(null=True, blank=True)
+    orientation = models.PositiveSmallIntegerField(default=1)
+    mode = models.CharField(max_length=10, blank=True)
+    # 64 bit difference hash of the pixels in four 16 bit chunks, indexed
+    # for near-duplicate search (see images.similarity). Null until the
+    # thumbnails are rendered.
+    dhash_0 = models.PositiveIntegerField(null=True, blank=True)
+    dhash_1 = models.PositiveIntegerField(null=True, blank=True)
+    dhash_2 = models.PositiveIntegerField(null=True, blank=True)
+    dhash_3 = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id']),
+            models.Index(fields=['user', 'format']),
+            models.Index(fields=['user', 'width', 'height']),
+            models.Index(fields=['user', 'dhash_0']),
+            models.Index(fields=['user', 'dhash_1']),
+            models.Index(fields=['user', 'dhash_2']),
+            models.Index(fields=['user', 'dhash_3']),
+        ]
+
+
+class ImageUpload(models.Model):
+    """Resumable upload of an original image, streamed in chunks."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.deletion.CASCADE, related_name='uploads')
+    name = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    validated = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
 
 
 class TemporaryLinkModel(models.Model):
-    one_time_code = models.CharField(max_length=20)
-    expiry_time = models.DateTimeField(blank=True)
+    one_time_code = models.CharField(max_length=20, unique=True)
+    expiry_time = models.DateTimeField(blank=True, db_index=True)
     image = models.ForeignKey(Image, on_delete=models.deletion.CASCADE, null=True, related_name='templinks')
-
+    threshold = models.PositiveSmallIntegerField(default=128)
+
+
+class ThumbnailJob(models.Model):
+    """Queued render of a single thumbnail size for an image."""
+
+    class Status(models.TextChoices):
+        PENDING = 'pending'
+        RUNNING = 'running'
+        DONE = 'done'
+        FAILED = 'failed'
+
+    image = models.ForeignKey(Image, on_delete=models.deletion.CASCADE, related_name='thumbnail_jobs')
+    size_px = models.IntegerField()
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    name = models.CharField(max_length=255, blank=True)
+    formats = models.CharField(max_length=50, blank=True, help_text='Comma separated extra formats rendered.')
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['image', 'size_px'], name='unique_thumbnail_job'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'id']),
+        ]
+
+
+class Counter(models.Model):
+    """Rate limit counter of DatabaseCounter."""
+    key = models.CharField(max_length=200, unique=True)
+    value = models.BigIntegerField(default=0)
+    expires_at = models.DateTimeField()
@@ -1,7 +1,9 @@
 from rest_framework import permissions
 
+from .thumbnails import get_user_tier
+
 
 class TempLinkUser(permissions.BasePermission):
 
     def has_permission(self, request, view):
-        return bool(request.user.tier.temporary_link)
+        return bool(get_user_tier(request.user).temporary_link)
@@ -0,0 +1,88 @@
+import base64
+import io
+
+from PIL import Image as PILImage
+
+from .decoding import decode_reduced, open_image
+
+PLACEHOLDER_SIZE = 32
+PLACEHOLDER_QUALITY = 40
+DOMINANT_COLORS = 8
+# dHash compares neighbouring pixels of a (HASH_SIZE + 1) x HASH_SIZE grey image
+HASH_SIZE = 8
+
+
+def is_transparent(image):
+    return image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def decode_for_height(image, height):
+    """
+    Decode image at the smallest scale whose height, once EXIF orientation
+    is applied, still covers height (see decode_reduced), in RGB, RGBA or L.
+    """
+    image = decode_reduced(image, height=height)
+    if is_transparent(image):
+        return image.convert('RGBA')
+    if image.mode not in ('RGB', 'L'):
+        return image.convert('RGB')
+    return image
+
+
+def render_thumbnails(source, sizes):
+    """
+    Render height bounded thumbnails for all sizes from one decode of source.
+
+    The source is decoded at the scale needed for the largest size, then
+    each smaller thumbnail is downscaled from the previous one. Images are
+    never upscaled. Returns {size_px: PIL image}.
+    """
+    with open_image(source) as image:
+        current = decode_for_height(image, max(sizes))
+    thumbnails = {}
+    for size_px in sorted(sizes, reverse=True):
+        if current.height > size_px:
+            width = max(1, round(current.width * size_px / current.height))
+            current = current.resize((width, size_px), PILImage.LANCZOS)
+        thumbnails[size_px] = current
+    return thumbnails
+
+
+def make_placeholder(thumbnail, size=PLACEHOLDER_SIZE):
+    """
+    Low quality placeholder of a rendered thumbnail, a data uri of a tiny
+    JPEG (PNG when transparent) at most size pixels wide or high, and its
+    dominant color as #rrggbb. Works from the smallest thumbnail, so it
+    costs no extra decode.
+    """
+    small = thumbnail.copy()
+    small.thumbnail((size, size), PILImage.BILINEAR)
+    transparent = is_transparent(small)
+    output = io.BytesIO()
+    if transparent:
+        small.save(output, format='PNG', optimize=True)
+    else:
+        small.convert('RGB').save(output, format='JPEG', quality=PLACEHOLDER_QUALITY)
+    media_type = 'image/png' if transparent else 'image/jpeg'
+    placeholder = f'data:{media_type};base64,{base64.b64encode(output.getvalue()).decode()}'
+
+    palette = small.convert('RGB').quantize(colors=DOMINANT_COLORS)
+    _, index = max(palette.getcolors())
+    red, green, blue = palette.getpalette()[index * 3:index * 3 + 3]
+    return placeholder, f'#{red:02x}{green:02x}{blue:02x}'
+
+
+def difference_hash(thumbnail, size=HASH_SIZE):
+    """
+    Perceptual difference hash of a rendered thumbnail, a size * size bit
+    integer with a bit set where a pixel is brighter than its right
+    neighbour. Re-encoded or resized copies hash within a few bits.
+    """
+    grey = thumbnail.convert('L').resize((size + 1, size), PILImage.LANCZOS)
+    pixels = list(grey.getdata())
+    value = 0
+    for row in range(size):
+        for column in range(size):
+            left = pixels[row * (size + 1) + column]
+            value = (value << 1) | (left > pixels[row * (size + 1) + column + 1])
+    return value
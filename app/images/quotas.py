@@ -0,0 +1,51 @@
+from django.db.models import F
+from django.db.models.functions import Greatest
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .models import User
+from .thumbnails import get_user_tier
+
+
+class QuotaExceeded(APIException):
+    status_code = status.HTTP_403_FORBIDDEN
+    default_detail = 'Storage quota of your tier exceeded.'
+    default_code = 'quota_exceeded'
+
+
+def quota_filter(tier, count, size):
+    """Lookups of users who have room for count more images of size bytes."""
+    lookups = {}
+    if tier.max_images:
+        lookups['image_count__lte'] = tier.max_images - count
+    if tier.max_storage_bytes:
+        lookups['stored_bytes__lte'] = tier.max_storage_bytes - size
+    return lookups
+
+
+def check_quota(user, size, count=1):
+    """Raise QuotaExceeded if user has no room for count images of size bytes."""
+    lookups = quota_filter(get_user_tier(user), count, size)
+    if lookups and not User.objects.filter(pk=user.pk, **lookups).exists():
+        raise QuotaExceeded()
+
+
+def reserve_quota(user, size, count=1):
+    """
+    Count count images of size bytes against the quota of user, raising
+    QuotaExceeded if they don't fit. The check and the increment are one
+    conditional update, so concurrent uploads can't overshoot the quota.
+    """
+    lookups = quota_filter(get_user_tier(user), count, size)
+    updated = User.objects.filter(pk=user.pk, **lookups).update(
+        image_count=F('image_count') + count, stored_bytes=F('stored_bytes') + size)
+    if not updated:
+        raise QuotaExceeded()
+
+
+def release_quota(user_id, size, count=1):
+    """Stop counting count deleted images of size bytes against the quota."""
+    User.objects.filter(pk=user_id).update(
+        image_count=Greatest(F('image_count') - count, 0),
+        stored_bytes=Greatest(F('stored_bytes') - size, 0),
+    )
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class RenderCache:
+    """
+    Disk cache of rendered images bounded by total bytes, with least
+    recently used entries evicted first, in front of which sits a small
+    in-process cache of hot entries.
+
+    Recency on disk is the file modification time, touched on every hit,
+    so processes sharing the directory agree on what to evict.
+    """
+
+    def __init__(self, directory, max_bytes, hot_max_bytes=0, hot_max_item_bytes=0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hot_max_bytes = hot_max_bytes
+        self.hot_max_item_bytes = hot_max_item_bytes
+        self.hot = OrderedDict()
+        self.hot_bytes = 0
+        self.disk_bytes = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def make_key(*parts):
+        return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """Return cached bytes for key, or None."""
+        with self.lock:
+            data = self.hot.get(key)
+            if data is not None:
+                self.hot.move_to_end(key)
+                return data
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as cache_file:
+                data = cache_file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        self.set_hot(key, data)
+        return data
+
+    def set(self, key, data):
+        """Store bytes under key, evicting old entries when over budget."""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                temp_file.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        self.set_hot(key, data)
+        with self.lock:
+            if self.disk_bytes is None:
+                self.disk_bytes = self.scan_size()
+            else:
+                self.disk_bytes += len(data)
+            if self.disk_bytes > self.max_bytes:
+                self.evict()
+
+    def set_hot(self, key, data):
+        if len(data) > self.hot_max_item_bytes:
+            return
+        with self.lock:
+            if key in self.hot:
+                self.hot_bytes -= len(self.hot.pop(key))
+            self.hot[key] = data
+            self.hot_bytes += len(data)
+            while self.hot_bytes > self.hot_max_bytes:
+                _, evicted = self.hot.popitem(last=False)
+                self.hot_bytes -= len(evicted)
+
+    def entries(self):
+        for shard in os.scandir(self.directory):
+            if shard.is_dir():
+                for entry in os.scandir(shard.path):
+                    if entry.is_file():
+                        yield entry
+
+    def scan_size(self):
+        if not os.path.isdir(self.directory):
+            return 0
+        return sum(entry.stat().st_size for entry in self.entries())
+
+    def evict(self):
+        """
+        Delete least recently used files until the cache is below 90% of
+        its budget. Sizes are re-read from disk, since other processes
+        write to the same directory.
+        """
+        entries = []
+        for entry in self.entries():
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self.disk_bytes = total
+
+
+render_cache = RenderCache(
+    settings.RENDER_CACHE_DIR,
+    settings.RENDER_CACHE_MAX_BYTES,
+    settings.RENDER_HOT_CACHE_MAX_BYTES,
+    settings.RENDER_HOT_CACHE_MAX_ITEM_BYTES,
+)
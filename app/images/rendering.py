@@ -0,0 +1,64 @@
+import io
+
+from django.core.files.storage import default_storage
+from PIL import Image as PILImage, ImageOps
+
+from .decoding import check_stored_size, decode_reduced, get_orientation, open_image, oriented_size
+from .engine import get_engine
+from .formats import CONTENT_TYPES, MODERN_FORMATS
+from .metrics import cache_lookup, stage
+from .render_cache import render_cache
+
+RENDER_FORMATS = ['jpeg', 'png'] + MODERN_FORMATS
+RENDER_FITS = ['contain', 'cover']
+
+
+def render_transform(source, width=None, height=None, fit='contain', fmt='jpeg', quality=85):
+    """
+    Render source image into a width x height box, returns encoded bytes.
+
+    With fit 'contain' the image is scaled down to fit into the box, with
+    'cover' it is scaled and cropped to fill it. A missing side follows
+    the aspect ratio of the source. The EXIF orientation is applied.
+    """
+    with open_image(source) as image:
+        source_width, source_height = oriented_size(image, get_orientation(image))
+        width = width or max(1, round(source_width * height / source_height))
+        height = height or max(1, round(source_height * width / source_width))
+        image = decode_reduced(image, width, height, fit)
+        if fit == 'cover':
+            image = ImageOps.fit(image, (width, height), PILImage.LANCZOS)
+        else:
+            image.thumbnail((width, height), PILImage.LANCZOS)
+        image_format = fmt.upper()
+        if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        output = io.BytesIO()
+        image.save(output, format=image_format, quality=quality)
+    return output.getvalue()
+
+
+def render_file(name, width=None, height=None, fit='contain', fmt='jpeg', quality=85):
+    """Render the stored image name, see render_transform."""
+    with default_storage.open(name, 'rb') as source:
+        return render_transform(source, width, height, fit, fmt, quality)
+
+
+def get_render(image, w=None, h=None, fit='contain', fmt='jpeg', q=85):
+    """
+    Rendered image bytes and content type, from the render cache if
+    possible, otherwise rendered by the image engine. Formats JPEG can't
+    be drafted are decoded at full resolution, so their stored size is
+    checked first.
+    """
+    name = image.original_image.name
+    key = render_cache.make_key(name, w, h, fit, fmt, q)
+    data = render_cache.get(key)
+    cache_lookup('render', data is not None)
+    if data is None:
+        if image.format != 'JPEG':
+            check_stored_size(image)
+        with stage('render'):
+            data = get_engine().run(render_file, name, w, h, fit, fmt, q)
+        render_cache.set(key, data)
+    return data, CONTENT_TYPES[fmt]
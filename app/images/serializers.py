@@ -1,13 +1,19 @@
 from rest_framework import serializers
-from .models import Image, TemporaryLinkModel, Tier
-from easy_thumbnails.files import get_thumbnailer
+from .binary import DEFAULT_THRESHOLD
+from .links import sign_temporary_link
+from .formats import variant_name
+from .media import media_url
+from .metrics import cache_lookup, stage
+from .rendering import RENDER_FITS, RENDER_FORMATS
+from .models import Image, ImageUpload, TemporaryLinkModel, ThumbnailJob, image_file_path
+from .thumbnails import get_tier_sizes, get_user_tier
+from .uploads import check_filename, check_size
 import random
 import string
 from django.utils import timezone
 from django.core.exceptions import ObjectDoesNotExist
-from PIL import Image as PILImage
-import os
 from django.conf import settings
+from django.urls import reverse
 
 
 def randomstring(stringlength=20):
@@ -21,42 +27,122 @@ class ImageSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Image
-        fields = ['id', 'original_image', 'thumbnails']
+        fields = ['id', 'original_image', 'thumbnails', 'placeholder', 'dominant_color',
+                  'width', 'height', 'format', 'file_size', 'orientation', 'mode']
+        read_only_fields = ['placeholder', 'dominant_color', 'width', 'height', 'format', 'file_size',
+                            'orientation', 'mode']
         extra_kwargs = {'original_image': {'write_only': True}, 'id': {'read_only': True}}
 
     def get_thumbnails(self, obj):
         """
-        Generating thumbnails based on user's tier sizes.
+        Thumbnail urls and render state for user's tier sizes.
         """
         request = self.context['request']
-        if not request.user.tier:
-            request.user.tier = Tier.objects.get(name='Basic')
-        user_tier_sizes = [str(size.size_px) for size in request.user.tier.sizes.all()]  # List of user's tier sizes
-        thumbnailer = get_thumbnailer(obj.original_image)
-        thumbnails_response = {}
-        for size in user_tier_sizes:
-            thumbnails_response[size] =\
-                request.build_absolute_uri(thumbnailer.get_thumbnail({'size': (0, int(size))}).url)
+        sizes = self.context.get('sizes')
+        if sizes is None:
+            sizes = get_tier_sizes(request.user)
+        fmt = self.context.get('thumbnail_format')
+        with stage('thumbnails'):
+            jobs = {job.size_px: job for job in obj.thumbnail_jobs.all()}
+            thumbnails_response = {}
+            for size_px in sizes:
+                job = jobs.get(size_px)
+                url, state = None, 'pending'
+                if job and job.status == ThumbnailJob.Status.DONE:
+                    name = variant_name(job.name, fmt) if fmt in job.formats.split(',') else job.name
+                    url, state = media_url(request, name), 'ready'
+                elif job and job.status == ThumbnailJob.Status.FAILED:
+                    state = 'failed'
+                cache_lookup('thumbnail', state == 'ready')
+                thumbnails_response[str(size_px)] = {'url': url, 'status': state}
         return thumbnails_response
 
+    def to_representation(self, instance):
+        """
+        Original image is linked through the protected media view, the
+        placeholder is null until the image is processed.
+        """
+        data = super().to_representation(instance)
+        if data.get('original_image'):
+            data['original_image'] = media_url(self.context['request'], instance.original_image.name)
+        data['placeholder'] = data['placeholder'] or None
+        data['dominant_color'] = data['dominant_color'] or None
+        return data
+
     def get_extra_kwargs(self):
         """
         Check if user's tier have original image display.
         """
         extra_kwargs = super().get_extra_kwargs()
-        if self.context['request'].user.tier.original:
+        if get_user_tier(self.context['request'].user).original:
             extra_kwargs.pop('original_image')
         return extra_kwargs
 
 
+class RenderSerializer(serializers.Serializer):
+    w = serializers.IntegerField(min_value=1, required=False)
+    h = serializers.IntegerField(min_value=1, required=False)
+    fit = serializers.ChoiceField(choices=RENDER_FITS, default='contain')
+    fmt = serializers.ChoiceField(choices=RENDER_FORMATS, required=False)
+    q = serializers.IntegerField(min_value=1, max_value=95, default=85)
+
+    def validate(self, attrs):
+        """
+        Validates render size against user's tier limit.
+        """
+        if not attrs.get('w') and not attrs.get('h'):
+            raise serializers.ValidationError('Specify w, h or both.')
+        max_render_px = self.context['max_render_px']
+        if max(attrs.get('w', 0), attrs.get('h', 0)) > max_render_px:
+            raise serializers.ValidationError(f'Your tier allows renders up to {max_render_px}px.')
+        return attrs
+
+
+class ImageUploadSerializer(serializers.ModelSerializer):
+    filename = serializers.CharField(write_only=True)
+    size = serializers.IntegerField(min_value=1)
+    upload_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ImageUpload
+        fields = ['id', 'filename', 'size', 'offset', 'upload_url']
+        read_only_fields = ['id', 'offset']
+
+    def validate_filename(self, value):
+        check_filename(value)
+        return value
+
+    def validate_size(self, value):
+        check_size(value)
+        return value
+
+    def create(self, validated_data):
+        """
+        Starts upload session with the final storage name of the image.
+        """
+        filename = validated_data.pop('filename')
+        return ImageUpload.objects.create(
+            user=self.context['request'].user,
+            name=image_file_path(None, filename),
+            **validated_data
+        )
+
+    def get_upload_url(self, obj):
+        """
+        Method field for url the chunks are sent to.
+        """
+        return self.context['request'].build_absolute_uri(reverse('images:image-upload-detail', args=[obj.pk]))
+
+
 class TemporaryLinkSerializer(serializers.ModelSerializer):
     seconds_to_expire = serializers.IntegerField(write_only=True)
     image_id = serializers.IntegerField(write_only=True)
+    threshold = serializers.IntegerField(write_only=True, min_value=1, max_value=255, default=DEFAULT_THRESHOLD)
     temp_link = serializers.SerializerMethodField()
 
     class Meta:
         model = TemporaryLinkModel
-        fields = ['seconds_to_expire', 'image_id', 'temp_link']
+        fields = ['seconds_to_expire', 'image_id', 'threshold', 'temp_link']
 
     def validate(self, attrs):
         """
@@ -81,11 +167,19 @@ class TemporaryLinkSerializer(serializers.ModelSerializer):
             image = Image.objects.get(pk=image_id)
         except ObjectDoesNotExist:
             raise serializers.ValidationError({'image_id': 'Image does not exists'})
-        if image.user == self.context['request'].user:
+        if image.user_id == self.context['request'].user.pk:
+            if settings.TEMPORARY_LINK_MODE == 'signed':
+                return TemporaryLinkModel(
+                    expiry_time=expiring_date,
+                    one_time_code=sign_temporary_link(image, expiring_date, validated_data['threshold']),
+                    image=image,
+                    threshold=validated_data['threshold'],
+                )
             temp_link = TemporaryLinkModel.objects.create(
                 expiry_time=expiring_date,
                 one_time_code=the_string,
-                image=image
+                image=image,
+                threshold=validated_data['threshold'],
             )
             return temp_link
         else:
@@ -98,28 +192,3 @@ class TemporaryLinkSerializer(serializers.ModelSerializer):
         the_string = obj.one_time_code
         return self.context['request'].build_absolute_uri(f'/images/binary/{the_string}')
 
-
-class BinaryImageSerializer(serializers.Serializer):
-    binary_image = serializers.SerializerMethodField()
-
-    def get_binary_image(self, obj):
-        """
-        Method field for binary image display.
-        """
-
-        filename = obj.image.original_image.name.split('/')[-1]
-        binary_filename = f"binary-{filename}"
-        if os.path.isfile(os.path.join(settings.MEDIA_ROOT, 'uploads', binary_filename)):
-            return self.context['request'].build_absolute_uri(f"{settings.MEDIA_URL}uploads/{binary_filename}")
-        if obj.expiry_time < timezone.now():
-            obj.delete()
-            os.remove(os.path.join(settings.MEDIA_ROOT, 'uploads', binary_filename))
-            raise serializers.ValidationError({'access_code': 'Link expired'})
-        with PILImage.open(obj.image.original_image) as image:
-            gray_image = image.convert('L')
-            binary_image = gray_image.point(lambda x: 0 if x < 128 else 255, '1')
-            path = os.path.join(settings.MEDIA_ROOT, 'uploads', binary_filename)
-            binary_image.save(path)
-        return self.context['request'].build_absolute_uri(f"{settings.MEDIA_URL}uploads/{binary_filename}")
-
-
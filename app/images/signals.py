@@ -0,0 +1,63 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import bump_tiers_version, forget_token, forget_user
+from .binary import delete_binary_images
+from .blobs import release_blob
+from .links import deny_image_links, link_cache_key
+from .models import Blob, Image, Size, TemporaryLinkModel, Tier, User
+from .quotas import release_quota
+
+
+@receiver(post_delete, sender=Image)
+def release_image_storage(sender, instance, **kwargs):
+    """
+    Stop counting the deleted image against its owner's quota and drop its
+    reference to its original file. The blob's size is read first, as
+    dropping the last reference deletes the blob.
+    """
+    if instance.blob_id:
+        size = Blob.objects.filter(pk=instance.blob_id).values_list('size', flat=True).first() or 0
+        release_quota(instance.user_id, size)
+        release_blob(instance.blob_id)
+    else:
+        release_quota(instance.user_id, 0)
+        # Images stored before blobs own their binary renders.
+        name = instance.original_image.name
+        transaction.on_commit(lambda: delete_binary_images(name))
+
+
+@receiver(post_delete, sender=Image)
+def deny_signed_links(sender, instance, **kwargs):
+    """Signed links have no row to cascade, deny those of the deleted image."""
+    deny_image_links(instance)
+
+
+@receiver(post_delete, sender=TemporaryLinkModel)
+def forget_cached_link(sender, instance, **kwargs):
+    """Evict links deleted with their image, or swept, from the link cache."""
+    cache.delete(link_cache_key(instance.one_time_code))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    forget_user(instance.pk)
+
+
+@receiver(post_delete, sender=Token)
+def forget_cached_token(sender, instance, **kwargs):
+    forget_token(instance.key)
+
+
+@receiver(post_save, sender=Tier)
+@receiver(post_delete, sender=Tier)
+@receiver(post_save, sender=Size)
+@receiver(post_delete, sender=Size)
+@receiver(m2m_changed, sender=Tier.sizes.through)
+def forget_cached_tiers(sender, **kwargs):
+    """Cached users carry their tier and sizes, drop them all."""
+    bump_tiers_version()
@@ -0,0 +1,72 @@
+"""
+Near-duplicate search by multi-index hashing of difference hashes.
+
+A 64 bit hash is stored as HASH_CHUNKS chunks of CHUNK_BITS bits, each in
+an indexed column. Two hashes within distance d of each other have, by
+the pigeonhole principle, at least one chunk within d // HASH_CHUNKS bits,
+so candidates are looked up by index on every chunk value that close and
+only they are compared in full. Hashes are stored with the thumbnails,
+so the index grows with every upload and is never rebuilt.
+"""
+from functools import lru_cache
+from itertools import combinations
+
+from django.db.models import Q
+
+HASH_CHUNKS = 4
+CHUNK_BITS = 16
+CHUNK_FIELDS = [f'dhash_{index}' for index in range(HASH_CHUNKS)]
+# Chunk values looked up grow combinatorially with the distance, 548 in
+# all at the maximum.
+MAX_DISTANCE = 3 * HASH_CHUNKS - 1
+
+
+def split_hash(value):
+    """Image fields of a hash, {dhash_0: highest chunk, ...}."""
+    mask = (1 << CHUNK_BITS) - 1
+    return {
+        field: (value >> (CHUNK_BITS * (HASH_CHUNKS - 1 - index))) & mask
+        for index, field in enumerate(CHUNK_FIELDS)
+    }
+
+
+def join_hash(image):
+    """Hash of an image from its chunk fields, None when not analysed yet."""
+    chunks = [getattr(image, field) for field in CHUNK_FIELDS]
+    if None in chunks:
+        return None
+    value = 0
+    for chunk in chunks:
+        value = (value << CHUNK_BITS) | chunk
+    return value
+
+
+@lru_cache(maxsize=None)
+def bit_flips(radius):
+    """Masks of every combination of at most radius chunk bits."""
+    masks = []
+    for count in range(radius + 1):
+        for bits in combinations(range(CHUNK_BITS), count):
+            masks.append(sum(1 << bit for bit in bits))
+    return masks
+
+
+def find_similar(image, queryset, max_distance):
+    """
+    Images of queryset, other than image, whose hash is within
+    max_distance bits of image's, as [(distance, image)] closest first.
+    """
+    value = join_hash(image)
+    if value is None:
+        return []
+    radius = max_distance // HASH_CHUNKS
+    condition = Q()
+    for field, chunk in split_hash(value).items():
+        condition |= Q(**{f'{field}__in': [chunk ^ mask for mask in bit_flips(radius)]})
+    matches = []
+    for candidate in queryset.filter(condition).exclude(pk=image.pk):
+        distance = bin(value ^ join_hash(candidate)).count('1')
+        if distance <= max_distance:
+            matches.append((distance, candidate))
+    matches.sort(key=lambda match: (match[0], -match[1].pk))
+    return matches
@@ -0,0 +1,144 @@
+"""
+Storage helpers working with any Django storage backend, the local file
+system or an S3 compatible object store (see DEFAULT_FILE_STORAGE).
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.utils.functional import LazyObject
+
+from .metrics import cache_lookup
+
+
+class StagingStorage(LazyObject):
+    """
+    Local storage for partially received uploads, which are appended to
+    in place. Defaults to MEDIA_ROOT, so finished uploads are renamed
+    into local media storage instead of copied.
+    """
+
+    def _setup(self):
+        self._wrapped = FileSystemStorage(location=settings.UPLOAD_STAGING_ROOT)
+
+
+staging_storage = StagingStorage()
+
+
+def shard(directory, key, filename):
+    """
+    Name of filename under two levels of directories taken from key, so
+    no directory grows past a few thousand entries.
+    """
+    return os.path.join(directory, key[:2], key[2:4], filename)
+
+
+def is_local(storage=default_storage):
+    try:
+        storage.path('')
+    except NotImplementedError:
+        return False
+    return True
+
+
+def metadata_cache_key(name):
+    return f'storage-meta:{hashlib.sha1(name.encode()).hexdigest()}'
+
+
+def stat_file(name):
+    try:
+        return {'size': default_storage.size(name), 'modified': default_storage.get_modified_time(name)}
+    except (FileNotFoundError, OSError):
+        return None
+
+
+def file_metadata(name):
+    """
+    Size and modification time of a stored file, or None if it doesn't
+    exist. Existing files are cached for STORAGE_METADATA_CACHE_TIMEOUT
+    seconds, 0 disabling it, so hot files cost no stat or object store
+    request.
+    """
+    if not settings.STORAGE_METADATA_CACHE_TIMEOUT:
+        return stat_file(name)
+    key = metadata_cache_key(name)
+    metadata = cache.get(key)
+    cache_lookup('storage_metadata', metadata is not None)
+    if metadata is None:
+        metadata = stat_file(name)
+        if metadata is None:
+            return None
+        cache.set(key, metadata, settings.STORAGE_METADATA_CACHE_TIMEOUT)
+    return metadata
+
+
+def forget_file(name):
+    """Drop cached metadata of a file that changed outside these helpers."""
+    cache.delete(metadata_cache_key(name))
+
+
+def save_file(name, content):
+    """
+    Store content (bytes or a File) under name, replacing any existing
+    file. Local files are written to a temporary file and renamed, so
+    readers never see a partially written file. Object stores replace
+    objects atomically; the backend must overwrite (django-storages
+    does by default).
+    """
+    if not isinstance(content, File):
+        content = ContentFile(content)
+    if is_local():
+        path = default_storage.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                for chunk in content.chunks():
+                    temp_file.write(chunk)
+            if settings.FILE_UPLOAD_PERMISSIONS is not None:
+                os.chmod(temp_path, settings.FILE_UPLOAD_PERMISSIONS)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+    else:
+        default_storage.save(name, content)
+    forget_file(name)
+    return name
+
+
+def move_file(source_storage, source_name, name):
+    """Move a file from source_storage into media storage under name."""
+    if is_local() and is_local(source_storage):
+        path = default_storage.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.move(source_storage.path(source_name), path)
+        forget_file(name)
+    else:
+        with source_storage.open(source_name, 'rb') as source:
+            save_file(name, File(source, name=os.path.basename(name)))
+        source_storage.delete(source_name)
+    return name
+
+
+def restore_file(name, target_storage, target_name):
+    """Move a media file back to target_storage, undoing move_file."""
+    if is_local() and is_local(target_storage):
+        shutil.move(default_storage.path(name), target_storage.path(target_name))
+    else:
+        with default_storage.open(name, 'rb') as source:
+            target_storage.save(target_name, source)
+        default_storage.delete(name)
+    forget_file(name)
+    return target_name
+
+
+def delete_file(name):
+    default_storage.delete(name)
+    forget_file(name)
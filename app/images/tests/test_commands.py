@@ -1,10 +1,24 @@
+import json
+import os
+import tempfile
+from datetime import timedelta
+from io import BytesIO, StringIO
 from unittest.mock import patch
 
 from psycopg2 import OperationalError as Psycopg2OpError
 
-from django.core.management import call_command
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
 from django.db.utils import OperationalError
-from django.test import SimpleTestCase
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from PIL import Image as PIL_Image
+
+from images.benchmarks import compare
+from images.binary import binary_image_name
+from images.models import Image, Size, TemporaryLinkModel, ThumbnailJob, Tier
 
 
 @patch('images.management.commands.wait_for_db.Command.check')
@@ -29,3 +43,119 @@ class CommandTests(SimpleTestCase):
 
         self.assertEqual(patched_check.call_count, 6)
         patched_check.assert_called_with(databases=['default'])
+
+
+class SweepTempLinksTests(TestCase):
+    """Test sweeping expired temporary links."""
+
+    def test_sweep_expired_links(self):
+        """Test expired links and their unused binary images are deleted."""
+        user = get_user_model().objects.create_user(username='Test Name', password='test-user-password123')
+        image = Image.objects.create(user=user, original_image='uploads/photo.jpg')
+        now = timezone.now()
+        expired = [
+            TemporaryLinkModel(one_time_code=f'expired{i}', expiry_time=now - timedelta(seconds=1), image=image)
+            for i in range(3)
+        ]
+        TemporaryLinkModel.objects.bulk_create(expired)
+        live = TemporaryLinkModel.objects.create(
+            one_time_code='live', expiry_time=now + timedelta(seconds=300), image=image, threshold=64)
+
+        with patch('images.management.commands.sweep_temp_links.delete_file') as patched_delete:
+            call_command('sweep_temp_links', '--batch-size', '2', stdout=StringIO())
+
+        self.assertEqual(list(TemporaryLinkModel.objects.all()), [live])
+        patched_delete.assert_called_once_with(binary_image_name('uploads/photo.jpg', 128))
+
+
+class ThumbnailsReconcileTests(TestCase):
+    """Test reconciling thumbnails with tier sizes."""
+
+    def setUp(self):
+        tier = Tier.objects.create(name='Premium')
+        for size_px in (200, 400):
+            tier.sizes.add(Size.objects.create(size_px=size_px))
+        user = get_user_model().objects.create_user(
+            username='Test Name', password='test-user-password123', tier=tier)
+        buffer = BytesIO()
+        PIL_Image.new('RGB', (500, 500)).save(buffer, format='JPEG')
+        name = default_storage.save('uploads/reconcile.jpg', ContentFile(buffer.getvalue()))
+        self.addCleanup(default_storage.delete, name)
+        self.image = Image.objects.create(user=user, original_image=name)
+        ThumbnailJob.objects.create(image=self.image, size_px=200, status=ThumbnailJob.Status.FAILED)
+        orphan_name = default_storage.save(f'{name}.0x800_q85.jpg', ContentFile(b'thumbnail'))
+        self.addCleanup(default_storage.delete, orphan_name)
+        self.orphan = ThumbnailJob.objects.create(
+            image=self.image, size_px=800, status=ThumbnailJob.Status.DONE, name=orphan_name)
+
+    def test_reconcile(self):
+        """Test missing and failed sizes are rendered and orphaned ones deleted."""
+        call_command('thumbnails_reconcile', '--workers', '1', stdout=StringIO())
+
+        jobs = {job.size_px: job for job in self.image.thumbnail_jobs.all()}
+        self.assertEqual(set(jobs), {200, 400})
+        for job in jobs.values():
+            self.addCleanup(default_storage.delete, job.name)
+            self.assertEqual(job.status, ThumbnailJob.Status.DONE)
+            self.assertTrue(default_storage.exists(job.name))
+        self.assertFalse(default_storage.exists(self.orphan.name))
+
+    def test_reconcile_dry_run(self):
+        """Test dry run only reports changes."""
+        out = StringIO()
+
+        call_command('thumbnails_reconcile', '--dry-run', stdout=out)
+
+        self.assertIn('failed: 1, images: 1, missing: 1, orphaned: 1', out.getvalue())
+        self.assertEqual(self.image.thumbnail_jobs.count(), 2)
+        self.assertTrue(default_storage.exists(self.orphan.name))
+
+    def test_reconcile_resumes_from_checkpoint(self):
+        """Test images up to the checkpoint are skipped and the checkpoint removed."""
+        with tempfile.NamedTemporaryFile('w', delete=False) as checkpoint:
+            checkpoint.write(str(self.image.pk))
+
+        call_command('thumbnails_reconcile', '--workers', '1', '--checkpoint', checkpoint.name,
+                     stdout=StringIO())
+
+        self.assertEqual(self.image.thumbnail_jobs.count(), 2)
+        self.assertFalse(os.path.exists(checkpoint.name))
+
+
+class BenchmarkTests(TestCase):
+    """Test benchmark command."""
+
+    def setUp(self):
+        self.output = os.path.join(tempfile.mkdtemp(), 'results.json')
+
+    def benchmark(self, *args):
+        call_command('benchmark', '--quick', '--only', 'list,templinks', '--use-current-database',
+                     '--output', self.output, *args, stdout=StringIO())
+        with open(self.output) as output_file:
+            return json.load(output_file)
+
+    def test_writes_results(self):
+        """Test results are written as JSON with query counts."""
+        report = self.benchmark()
+
+        self.assertIn('django', report['environment'])
+        self.assertEqual(report['results']['list.10']['queries'], report['results']['list.100']['queries'])
+        self.assertIn('median_ms', report['results']['serializer.100'])
+        self.assertIn('ops_per_sec', report['results']['templink.signed'])
+
+    def test_baseline_regression(self):
+        """Test growing query counts fail the comparison with the baseline."""
+        baseline = os.path.join(tempfile.mkdtemp(), 'baseline.json')
+        with open(baseline, 'w') as baseline_file:
+            json.dump({'results': {'list.10': {'queries': 1, 'median_ms': 1000000}}}, baseline_file)
+
+        with self.assertRaisesMessage(CommandError, '1 regressions'):
+            self.benchmark('--baseline', baseline)
+
+    def test_compare_metrics(self):
+        """Test timings regress past the tolerance and only compared metrics count."""
+        baseline = {'list.10': {'queries': 3, 'median_ms': 10}, 'templink.signed': {'ops_per_sec': 1000}}
+        results = {'list.10': {'queries': 3, 'median_ms': 12}, 'templink.signed': {'ops_per_sec': 700}}
+
+        self.assertEqual(compare(results, baseline, 0.25), [('templink.signed', 'ops_per_sec', 1000, 700)])
+        self.assertEqual(compare(results, baseline, 0.1, ['median_ms']), [('list.10', 'median_ms', 10, 12)])
@@ -0,0 +1,58 @@
+from datetime import timedelta
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from images.counters import DatabaseCounter, LocMemCounter, RedisCounter
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class CounterTestsMixin:
+    """Tests every counter backend has to pass."""
+
+    def test_hit_counts_within_window(self):
+        self.assertEqual(self.counter.hit('key', 60)[0], 1)
+        self.assertEqual(self.counter.hit('key', 60, amount=2)[0], 3)
+        self.assertEqual(self.counter.hit('other', 60)[0], 1)
+
+    def test_hit_returns_seconds_until_reset(self):
+        _, reset_in = self.counter.hit('key', 60)
+        self.assertGreater(reset_in, 50)
+        self.assertLessEqual(reset_in, 60)
+
+
+class LocMemCounterTests(CounterTestsMixin, SimpleTestCase):
+
+    def setUp(self):
+        self.counter = LocMemCounter()
+
+    def test_window_resets(self):
+        with patch('images.counters.time.monotonic', return_value=1000):
+            self.counter.hit('key', 60)
+        with patch('images.counters.time.monotonic', return_value=1061):
+            self.assertEqual(self.counter.hit('key', 60)[0], 1)
+
+
+class DatabaseCounterTests(CounterTestsMixin, TestCase):
+
+    def setUp(self):
+        self.counter = DatabaseCounter()
+
+    def test_window_resets(self):
+        self.counter.hit('key', 60)
+        later = timezone.now() + timedelta(seconds=61)
+        with patch('images.counters.timezone.now', return_value=later):
+            self.assertEqual(self.counter.hit('key', 60)[0], 1)
+
+
+@skipUnless(fakeredis, 'fakeredis is needed for Redis counter tests')
+class RedisCounterTests(CounterTestsMixin, SimpleTestCase):
+
+    def setUp(self):
+        self.counter = RedisCounter(client=fakeredis.FakeRedis())
@@ -0,0 +1,94 @@
+from io import BytesIO
+
+from django.test import SimpleTestCase, override_settings
+from PIL import Image as PIL_Image, ImageOps
+
+from images.binary import STRIP_ROWS, render_binary_image, threshold_table
+from images.decoding import decode_full, decode_reduced, iter_strips, open_image
+from images.exceptions import ImageTooLarge
+
+
+def encode(image, image_format='JPEG', orientation=None):
+    buffer = BytesIO()
+    exif = image.getexif()
+    if orientation:
+        exif[0x0112] = orientation
+    image.save(buffer, format=image_format, exif=exif)
+    buffer.seek(0)
+    return buffer
+
+
+def photo(size):
+    return PIL_Image.merge('RGB', [PIL_Image.linear_gradient('L').resize(size),
+                                   PIL_Image.radial_gradient('L').resize(size),
+                                   PIL_Image.linear_gradient('L').rotate(90).resize(size)])
+
+
+class DecodeReducedTests(SimpleTestCase):
+    """Test decoding at the cheapest resolution covering the output."""
+
+    def test_jpeg_drafted(self):
+        """Test JPEGs are decoded at reduced DCT scale, upright."""
+        with open_image(encode(photo((4000, 3000)), orientation=6)) as image:
+            decoded = decode_reduced(image, height=600)
+
+        self.assertEqual(decoded.size, (750, 1000))
+
+    def test_png_reduced(self):
+        """Test other formats are box reduced by an integer factor."""
+        with open_image(encode(photo((2000, 1000)), 'PNG')) as image:
+            decoded = decode_reduced(image, 300, 300, fit='contain')
+
+        self.assertEqual(decoded.size, (334, 167))
+
+    @override_settings(IMAGE_DECODE_MAX_PIXELS=1000 * 1000)
+    def test_pixel_ceiling(self):
+        """Test the ceiling applies to the drafted size, before decoding."""
+        with open_image(encode(photo((2000, 2000)))) as image:
+            self.assertEqual(decode_reduced(image, height=400).size, (500, 500))
+        with open_image(encode(photo((2000, 2000)))) as image, self.assertRaises(ImageTooLarge):
+            decode_reduced(image, height=1500)
+        with open_image(encode(photo((2000, 2000)), 'PNG')) as image, self.assertRaises(ImageTooLarge):
+            decode_reduced(image, height=400)
+
+    @override_settings(IMAGE_DECODE_MAX_BYTES=3 * 1000 * 1000)
+    def test_memory_ceiling(self):
+        """Test color buffers count 4 bytes per pixel, JPEGs decode to grayscale in one."""
+        with open_image(encode(photo((1000, 1000)))) as image, self.assertRaises(ImageTooLarge):
+            decode_full(image)
+        with open_image(encode(photo((1000, 1000)))) as image:
+            self.assertEqual(decode_full(image, 'L').mode, 'L')
+
+
+class StripTests(SimpleTestCase):
+    """Test full resolution processing in strips."""
+
+    def test_strips_upright(self):
+        """Test strips of every orientation make up the upright image."""
+        for orientation in range(1, 9):
+            image = photo((70, 45))
+            exif = PIL_Image.Exif()
+            exif[0x0112] = orientation
+            image.info['exif'] = exif.tobytes()
+            upright = ImageOps.exif_transpose(image)
+            joined = PIL_Image.new('RGB', upright.size)
+            top = 0
+            for strip in iter_strips(image, orientation, 16):
+                self.assertEqual(strip.width, upright.width)
+                joined.paste(strip, (0, top))
+                top += strip.height
+            self.assertEqual(top, upright.height)
+            self.assertEqual(joined.tobytes(), upright.tobytes(), orientation)
+
+    def test_binary_png(self):
+        """Test the strip encoded PNG matches thresholding the upright image."""
+        image = photo((STRIP_ROWS + 45, STRIP_ROWS * 2 + 7))
+        for source, image_format, orientation in ((image, 'JPEG', 8), (image.convert('RGBA'), 'PNG', None)):
+            data = render_binary_image(encode(source, image_format, orientation), 100)
+
+            with PIL_Image.open(encode(source, image_format, orientation)) as original:
+                expected = ImageOps.exif_transpose(original).convert('L').point(threshold_table(100), '1')
+            with PIL_Image.open(BytesIO(data)) as binary_image:
+                self.assertEqual(binary_image.mode, '1')
+                self.assertEqual(binary_image.size, expected.size)
+                self.assertEqual(binary_image.tobytes(), expected.tobytes())
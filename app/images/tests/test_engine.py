@@ -0,0 +1,50 @@
+import os
+import time
+
+from django.test import SimpleTestCase
+
+from images.engine import InlineEngine, ProcessPoolEngine
+from images.exceptions import EngineBusy, ImageTooLarge, ProcessingTimeout
+
+
+def allocate(size):
+    return len(bytearray(size))
+
+
+class InlineEngineTests(SimpleTestCase):
+    """Test running image processing in process."""
+
+    def test_run(self):
+        self.assertEqual(InlineEngine().run(os.getpid), os.getpid())
+
+
+class ProcessPoolEngineTests(SimpleTestCase):
+    """Test running image processing in a process pool."""
+
+    def setUp(self):
+        self.engine = ProcessPoolEngine(max_workers=1, max_queued=0, timeout=1,
+                                        memory_limit=512 * 1024 * 1024, retry_after=7)
+        self.addCleanup(self.engine.shutdown)
+
+    def test_run_in_other_process(self):
+        self.assertNotEqual(self.engine.run(os.getpid), os.getpid())
+
+    def test_busy(self):
+        self.engine.slots.acquire()
+
+        with self.assertRaises(EngineBusy) as context:
+            self.engine.run(os.getpid)
+
+        self.assertEqual(context.exception.wait, 7)
+
+    def test_timeout(self):
+        with self.assertRaises(ProcessingTimeout):
+            self.engine.run(time.sleep, 5)
+
+        self.assertEqual(self.engine.run(allocate, 10), 10)
+
+    def test_memory_limit(self):
+        with self.assertRaises(ImageTooLarge):
+            self.engine.run(allocate, 1024 * 1024 * 1024)
+
+        self.assertEqual(self.engine.run(allocate, 10), 10)
@@ -2,14 +2,36 @@ from rest_framework.test import APITestCase
 from django.urls import reverse
 from rest_framework import status
 from django.contrib.auth import get_user_model
-from images.models import Tier, Size, Image
+from images.models import Tier, Size, Image, ImageUpload, ThumbnailJob, Blob, TemporaryLinkModel
+import hashlib
+import os
 import tempfile
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
 from django.core.files import File
 import base64
+from io import BytesIO, StringIO
 from PIL import Image as PIL_Image
 from unittest.mock import patch
 from django.utils import timezone
 from datetime import timedelta
+from django.core.management import call_command
+from django.test import override_settings
+from django.core.files.storage import default_storage
+from images.binary import get_binary_image
+from images.blobs import blob_name
+from images.exceptions import EngineBusy, ImageTooLarge
+from images.links import SIGNED_LINK_SALT, link_cache_key
+from images.similarity import split_hash
+from images.storage import staging_storage
+from images.uploads import receive_chunk
+from asgiref.sync import sync_to_async
+from rest_framework.authtoken.models import Token
+from django.db import DatabaseError, connection
+from django.test.utils import CaptureQueriesContext
+import tarfile
+import zipfile
 
 
 class UserAuthTestCases(APITestCase):
@@ -96,6 +118,25 @@ class BasicUser(APITestCase):
         self.assertFalse(bool(res.data['thumbnails']))  # Checks if no other thumbnails
         self.assertNotIn('original_image', res.data)  # Checks if original_image is not in response
 
+    def test_thumbnails_rendered_by_worker(self):
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as image_file:
+            img = PIL_Image.new('RGB', (500, 500))
+            img.save(image_file, format='JPEG')
+            image_file.seek(0)
+            payload = {'original_image': image_file}
+            res = self.client.post(reverse('images:image-list'), payload, format='multipart')
+        self.assertEqual(res.data['thumbnails']['200'], {'url': None, 'status': 'pending'})
+        self.assertIsNone(res.data['placeholder'])
+
+        call_command('process_thumbnails', '--once', '--workers', '1', stdout=StringIO())
+
+        res = self.client.get(reverse('images:image-list'))
+        thumbnail = res.data['results'][0]['thumbnails']['200']
+        self.assertEqual(thumbnail['status'], 'ready')
+        self.assertIn('http://', thumbnail['url'])
+        self.assertTrue(res.data['results'][0]['placeholder'].startswith('data:image/jpeg;base64,'))
+        self.assertEqual(res.data['results'][0]['dominant_color'], '#000000')
+
     def test_get_temp_link_permission(self):
         with tempfile.NamedTemporaryFile(suffix='.jpg') as image_file:
             img = PIL_Image.new('RGB', (500, 500))
@@ -264,6 +305,37 @@ class BinaryImageTestCase(APITestCase):
         binaru_image_url = binary_image_res.data['binary_image']
         self.assertIn('http://', binaru_image_url)  # Checks if binary image url is valid
 
+    @override_settings(TEMPORARY_LINK_CACHE=True)
+    def test_get_binary_image_cached_link(self):
+        """
+        Checks repeated hits on a link are served without database queries
+        """
+        self.client.get(self.temp_link)
+        with self.assertNumQueries(0):
+            binary_image_res = self.client.get(self.temp_link)
+        self.assertEqual(binary_image_res.status_code, status.HTTP_200_OK)
+
+    def test_link_not_cached_without_shared_cache(self):
+        """
+        Checks links aren't cached per process, where deleting them elsewhere wouldn't evict them
+        """
+        self.client.get(self.temp_link)
+        code = TemporaryLinkModel.objects.get().one_time_code
+        self.assertIsNone(cache.get(link_cache_key(code)))
+        TemporaryLinkModel.objects.all()._raw_delete(TemporaryLinkModel.objects.db)
+        self.assertEqual(self.client.get(self.temp_link).status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(TEMPORARY_LINK_CACHE=True)
+    def test_cached_link_of_deleted_original(self):
+        """
+        Checks a cached link whose original is gone gets 404
+        """
+        self.client.get(self.temp_link)
+        image = Image.objects.get()
+        default_storage.delete(get_binary_image(image))
+        default_storage.delete(image.original_image.name)
+        self.assertEqual(self.client.get(self.temp_link).status_code, status.HTTP_404_NOT_FOUND)
+
     def test_get_binary_image_wrong_link(self):
         """
         Checks getting binary image wrong link
@@ -272,11 +344,1152 @@ class BinaryImageTestCase(APITestCase):
         self.assertEqual(binary_image_res.status_code, status.HTTP_404_NOT_FOUND)
 
     @patch('django.utils.timezone.now', return_value=timezone.now() + timedelta(seconds=500))
-    @patch('images.serializers.os.remove')
-    def test_get_binary_image_expired_link(self, mock_remove, mock_now):
+    def test_get_binary_image_expired_link(self, mock_now):
         """
         Checks getting binary image expired link
         """
         binary_image_res = self.client.get(self.temp_link)
         self.assertEqual(binary_image_res.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_get_binary_image_expired_link_cached(self):
+        """
+        Checks expired link is rejected even when its binary image is cached
+        """
+        self.assertEqual(self.client.get(self.temp_link).status_code, status.HTTP_200_OK)
+        with patch('django.utils.timezone.now', return_value=timezone.now() + timedelta(seconds=500)):
+            binary_image_res = self.client.get(self.temp_link)
+        self.assertEqual(binary_image_res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_binary_image_threshold(self):
+        """
+        Checks binary render is a 1-bit image thresholded with the link's threshold
+        """
+        with tempfile.NamedTemporaryFile(suffix='.png') as image_file:
+            img = PIL_Image.new('L', (2, 1))
+            img.putdata([99, 100])
+            img.save(image_file, format='PNG')
+            image_file.seek(0)
+            image = Image.objects.create(original_image=File(image_file), user=self.user)
+        binary_name = get_binary_image(image, threshold=100)
+        with PIL_Image.open(default_storage.path(binary_name)) as binary_image:
+            self.assertEqual(binary_image.mode, '1')
+            self.assertEqual(list(binary_image.getdata()), [0, 255])
+
+    def test_deleted_image_link(self):
+        """
+        Checks links and binary renders go away with their image
+        """
+        res = self.client.get(self.temp_link)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        image = Image.objects.get()
+        binary_name = get_binary_image(image)
+        self.assertTrue(default_storage.exists(binary_name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+
+        self.assertEqual(self.client.get(self.temp_link).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(default_storage.exists(binary_name))
+
+    def test_deleted_blob_binary_images(self):
+        """
+        Checks binary renders of a blob are deleted with it
+        """
+        buffer = BytesIO()
+        PIL_Image.new('RGB', (40, 30)).save(buffer, format='PNG')
+        buffer.name = 'photo.png'
+        buffer.seek(0)
+        res = self.client.post(reverse('images:image-list'), {'original_image': buffer}, format='multipart')
+        image = Image.objects.get(pk=res.data['id'])
+        names = [get_binary_image(image, threshold) for threshold in (100, 128)]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+
+        self.assertFalse(any(default_storage.exists(name) for name in names))
+
+    @override_settings(IMAGE_DECODE_MAX_PIXELS=100 * 100)
+    def test_binary_image_too_large(self):
+        """
+        Checks images above the decode ceiling get 413, from their stored size or when decoded
+        """
+        res = self.client.get(self.temp_link)
+        self.assertEqual(res.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        image = Image.objects.get()
+        image.width, image.height = 500, 500
+        with patch('images.binary.get_engine') as patched_engine, self.assertRaises(ImageTooLarge):
+            get_binary_image(image, threshold=100)
+        patched_engine.assert_not_called()
+
+
+class CachedTokenAuthenticationTestCase(APITestCase):
+
+    def setUp(self) -> None:
+        self.user = get_user_model().objects.create_user(username='Test Name', password='test-user-password123')
+        self.tier = Tier.objects.create(name='Enterprise', original=False, temporary_link=True)
+        self.tier.sizes.add(Size.objects.create(size_px=200))
+        self.user.tier = self.tier
+        self.user.save()
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        Image.objects.create(user=self.user, original_image='uploads/a.jpg')
+
+    def test_warm_request_skips_auth_queries(self):
+        """
+        Checks token, user, tier and sizes come from the cache once resolved
+        """
+        self.client.get(reverse('images:image-list'))
+        # images and prefetched thumbnail jobs
+        with self.assertNumQueries(2):
+            res = self.client.get(reverse('images:image-list'))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(res.data['results'][0]['thumbnails']), ['200'])
+
+    def test_tier_changes_invalidate_cache(self):
+        """
+        Checks edits of the tier and its sizes show up on the next request
+        """
+        self.client.get(reverse('images:image-list'))
+        self.tier.original = True
+        self.tier.save()
+        self.tier.sizes.add(Size.objects.create(size_px=400))
+        res = self.client.get(reverse('images:image-list'))
+        self.assertIn('original_image', res.data['results'][0])
+        self.assertEqual(list(res.data['results'][0]['thumbnails']), ['200', '400'])
+
+    def test_user_changes_invalidate_cache(self):
+        """
+        Checks deactivated users and deleted tokens are rejected right away
+        """
+        self.client.get(reverse('images:image-list'))
+        self.user.is_active = False
+        self.user.save()
+        res = self.client.get(reverse('images:image-list'))
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.user.is_active = True
+        self.user.save()
+        self.client.get(reverse('images:image-list'))
+        self.token.delete()
+        res = self.client.get(reverse('images:image-list'))
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class ImageListQueriesTestCase(APITestCase):
+
+    def setUp(self) -> None:
+        user_details = {
+            'username': 'Test Name',
+            'password': 'test-user-password123',
+        }
+        self.user = get_user_model().objects.create_user(**user_details)
+        self.tier = Tier.objects.create(name='Enterprise', original=True, temporary_link=True)
+        for size_px in (200, 400):
+            self.tier.sizes.add(Size.objects.create(size_px=size_px))
+        self.user.tier = self.tier
+        self.user.save()
+        self.client.force_authenticate(user=self.user)
+
+    def create_images(self, count):
+        images = Image.objects.bulk_create(
+            Image(user=self.user, original_image=f'uploads/{i}.jpg') for i in range(count)
+        )
+        ThumbnailJob.objects.bulk_create(
+            ThumbnailJob(image=image, size_px=200, status=ThumbnailJob.Status.DONE,
+                         name=f'{image.original_image.name}.0x200_q85.jpg')
+            for image in images
+        )
+
+    def test_list_query_count_is_constant(self):
+        """
+        Checks listing images costs the same number of queries for any library size
+        """
+        for count in (1, 10, 100):
+            with self.subTest(count=count):
+                Image.objects.all().delete()
+                self.create_images(count)
+                # tier sizes, images and prefetched thumbnail jobs
+                with self.assertNumQueries(3):
+                    res = self.client.get(reverse('images:image-list'), {'page_size': 100})
+                self.assertEqual(res.status_code, status.HTTP_200_OK)
+                self.assertEqual(len(res.data['results']), count)
+                self.assertEqual(res.data['results'][0]['thumbnails']['200']['status'], 'ready')
+                self.assertEqual(res.data['results'][0]['thumbnails']['400']['status'], 'pending')
+
+    def test_list_cursor_pagination(self):
+        """
+        Checks walking all pages returns every image once, newest first
+        """
+        self.create_images(5)
+        ids = []
+        url = reverse('images:image-list') + '?page_size=2'
+        while url:
+            res = self.client.get(url)
+            self.assertLessEqual(len(res.data['results']), 2)
+            ids += [image['id'] for image in res.data['results']]
+            url = res.data['next']
+        self.assertEqual(ids, sorted(Image.objects.values_list('id', flat=True), reverse=True))
+
+    def test_list_requires_authentication(self):
+        """
+        Checks anonymous listing is rejected with a token challenge
+        """
+        self.client.force_authenticate(user=None)
+        res = self.client.get(reverse('images:image-list'))
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(res['WWW-Authenticate'], 'Token')
+
+    async def test_list_async_client(self):
+        """
+        Checks listing is served asynchronously with token authentication
+        """
+        await sync_to_async(self.create_images)(2)
+        token = await Token.objects.acreate(user=self.user)
+        res = await self.async_client.get(reverse('images:image-list'), AUTHORIZATION=f'Token {token.key}')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.json()['results']), 2)
+
+    def test_list_selected_sizes(self):
+        """
+        Checks ?sizes= limits thumbnails to the requested tier sizes
+        """
+        self.create_images(1)
+        res = self.client.get(reverse('images:image-list'), {'sizes': '400,800'})
+        self.assertEqual(list(res.data['results'][0]['thumbnails']), ['400'])
+
+        res = self.client.get(reverse('images:image-list'), {'sizes': 'big'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ImageUploadTestCase(APITestCase):
+
+    def setUp(self) -> None:
+        user_details = {
+            'username': 'Test Name',
+            'password': 'test-user-password123',
+        }
+        self.user = get_user_model().objects.create_user(**user_details)
+        self.client.force_authenticate(user=self.user)
+        self.tier = Tier.objects.create(name='Basic', original=False, temporary_link=False)
+        self.tier.sizes.add(Size.objects.create(size_px=200))
+        self.user.tier = self.tier
+
+        buffer = BytesIO()
+        PIL_Image.new('RGB', (500, 500)).save(buffer, format='JPEG')
+        self.content = buffer.getvalue()
+
+    def start_upload(self, filename='photo.jpg', size=None):
+        payload = {'filename': filename, 'size': size or len(self.content)}
+        return self.client.post(reverse('images:image-upload'), payload)
+
+    def test_chunked_upload(self):
+        """
+        Checks resumable upload in two chunks creates the image
+        """
+        res = self.start_upload()
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        upload_url = res.data['upload_url']
+        half = len(self.content) // 2
+
+        res = self.client.put(upload_url, self.content[:half], content_type='application/octet-stream',
+                              HTTP_CONTENT_RANGE=f'bytes 0-{half - 1}/{len(self.content)}')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['offset'], half)
+
+        res = self.client.put(upload_url, self.content[:half], content_type='application/octet-stream',
+                              HTTP_CONTENT_RANGE=f'bytes 0-{half - 1}/{len(self.content)}')
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(res.data['offset'], half)
+
+        res = self.client.put(upload_url, self.content[half:], content_type='application/octet-stream',
+                              HTTP_CONTENT_RANGE=f'bytes {half}-{len(self.content) - 1}/{len(self.content)}')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.data['thumbnails']['200']['status'], 'pending')
+        self.assertEqual((res.data['width'], res.data['height'], res.data['format']), (500, 500, 'JPEG'))
+        self.assertEqual(res.data['file_size'], len(self.content))
+        image = Image.objects.get(pk=res.data['id'])
+        with image.original_image.open('rb') as image_file:
+            self.assertEqual(image_file.read(), self.content)
+
+    def test_concurrent_chunk(self):
+        """
+        Checks a chunk received while another one advanced the offset is
+        rejected and leaves no part file behind
+        """
+        res = self.start_upload()
+        upload_url = res.data['upload_url']
+        half = len(self.content) // 2
+        upload = ImageUpload.objects.get()
+
+        def receive_meanwhile(upload, stream):
+            received = receive_chunk(upload, stream)
+            ImageUpload.objects.filter(pk=upload.pk).update(offset=half)
+            return received
+
+        with patch('images.views.receive_chunk', side_effect=receive_meanwhile):
+            res = self.client.put(upload_url, self.content, content_type='application/octet-stream')
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(res.data['offset'], half)
+        directory = os.path.dirname(staging_storage.path(upload.name))
+        self.assertFalse([name for name in os.listdir(directory) if name.endswith('.part')])
+
+    def test_chunked_upload_hash(self):
+        """
+        Checks the blob of a chunked upload is addressed by the whole file's hash
+        """
+        upload_url = self.start_upload().data['upload_url']
+        half = len(self.content) // 2
+        self.client.put(upload_url, self.content[:half], content_type='application/octet-stream')
+        res = self.client.put(upload_url, self.content[half:], content_type='application/octet-stream',
+                              HTTP_CONTENT_RANGE=f'bytes {half}-{len(self.content) - 1}/{len(self.content)}')
+        self.assertEqual(Image.objects.get(pk=res.data['id']).blob.sha256, hashlib.sha256(self.content).hexdigest())
+
+    def test_rolled_back_chunk_can_be_resumed(self):
+        """
+        Checks a last chunk whose transaction rolled back leaves the upload resumable, its file back in staging
+        """
+        upload_url = self.start_upload().data['upload_url']
+        with patch.object(ImageUpload, 'delete', side_effect=DatabaseError), self.assertRaises(DatabaseError):
+            self.client.put(upload_url, self.content, content_type='application/octet-stream')
+        self.assertFalse(Blob.objects.exists())
+        upload = ImageUpload.objects.get()
+        self.assertEqual(upload.offset, 0)
+        self.assertTrue(staging_storage.exists(upload.name))
+
+        res = self.client.put(upload_url, self.content, content_type='application/octet-stream')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+    def test_upload_rejects_non_image(self):
+        res = self.start_upload()
+        res = self.client.put(res.data['upload_url'], b'GIF89a' + bytes(100), content_type='application/octet-stream')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(ImageUpload.objects.exists())
+
+    @override_settings(IMAGE_MAX_PIXELS=1000)
+    def test_upload_rejects_too_many_pixels(self):
+        res = self.start_upload()
+        res = self.client.put(res.data['upload_url'], self.content[:1024], content_type='application/octet-stream')
+        self.assertEqual(res.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertFalse(ImageUpload.objects.exists())
+
+    @override_settings(IMAGE_MAX_UPLOAD_SIZE=1000)
+    def test_upload_rejects_too_large_file(self):
+        res = self.start_upload(size=1001)
+        self.assertEqual(res.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+
+class ImageMetadataTestCase(APITestCase):
+
+    def setUp(self) -> None:
+        self.user = get_user_model().objects.create_user(username='Test Name', password='test-user-password123')
+        self.tier = Tier.objects.create(name='Basic', original=False, temporary_link=False, max_render_px=1000)
+        self.tier.sizes.add(Size.objects.create(size_px=200))
+        self.user.tier = self.tier
+        self.user.save()
+        self.client.force_authenticate(user=self.user)
+
+    def upload(self, size, image_format='JPEG', orientation=None, mode='RGB'):
+        image = PIL_Image.new(mode, size)
+        exif = image.getexif()
+        if orientation:
+            exif[0x0112] = orientation
+        buffer = BytesIO()
+        image.save(buffer, format=image_format, exif=exif)
+        buffer.name = f'photo.{image_format.lower()}'
+        buffer.seek(0)
+        res = self.client.post(reverse('images:image-list'), {'original_image': buffer}, format='multipart')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        return res.data
+
+    def test_metadata_from_header(self):
+        """
+        Checks dimensions are stored upright with the EXIF orientation
+        """
+        data = self.upload((400, 200), orientation=6)
+        self.assertEqual(data['width'], 200)
+        self.assertEqual(data['height'], 400)
+        self.assertEqual(data['orientation'], 6)
+        self.assertEqual((data['format'], data['mode']), ('JPEG', 'RGB'))
+        image = Image.objects.get(pk=data['id'])
+        self.assertEqual(image.file_size, image.blob.size)
+
+        data = self.upload((30, 20), image_format='PNG', mode='RGBA')
+        self.assertEqual((data['width'], data['height'], data['format'], data['mode']), (30, 20, 'PNG', 'RGBA'))
+        self.assertEqual(data['orientation'], 1)
+
+    def test_list_filters(self):
+        self.upload((400, 200))
+        self.upload((30, 20), image_format='PNG')
+        res = self.client.get(reverse('images:image-list'), {'image_format': 'png'})
+        self.assertEqual([image['format'] for image in res.data['results']], ['PNG'])
+        res = self.client.get(reverse('images:image-list'), {'min_width': 100})
+        self.assertEqual([image['width'] for image in res.data['results']], [400])
+        res = self.client.get(reverse('images:image-list'), {'min_height': 'tall'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_render_applies_orientation(self):
+        data = self.upload((400, 200), orientation=6)
+        res = self.client.get(reverse('images:image-render', args=[data['id']]), {'h': 100, 'fmt': 'png'})
+        with PIL_Image.open(BytesIO(res.content)) as rendered:
+            self.assertEqual(rendered.size, (50, 100))
+
+    @override_settings(IMAGE_DECODE_MAX_PIXELS=100 * 100)
+    def test_too_large_to_decode(self):
+        """
+        Checks thumbnails of images above the decode ceiling fail without retries
+        """
+        buffer = BytesIO()
+        PIL_Image.new('RGB', (400, 200)).save(buffer, format='PNG')
+        buffer.name = 'photo.png'
+        buffer.seek(0)
+        res = self.client.post(reverse('images:image-list'), {'original_image': buffer}, format='multipart')
+
+        call_command('process_thumbnails', '--once', '--workers', '1', stdout=StringIO())
+
+        job = ThumbnailJob.objects.get(image=res.data['id'])
+        self.assertEqual((job.status, job.attempts), (ThumbnailJob.Status.FAILED, 1))
+        self.assertIn('decoded', job.error)
+
+
+class SimilarImagesTestCase(APITestCase):
+
+    def setUp(self) -> None:
+        self.user = get_user_model().objects.create_user(username='Test Name', password='test-user-password123')
+        self.tier = Tier.objects.create(name='Basic', original=False, temporary_link=False)
+        self.tier.sizes.add(Size.objects.create(size_px=200))
+        self.user.tier = self.tier
+        self.user.save()
+        self.client.force_authenticate(user=self.user)
+
+    def create(self, value, user=None):
+        return Image.objects.create(user=user or self.user, original_image='uploads/a.jpg', **split_hash(value))
+
+    def similar(self, image, **params):
+        return self.client.get(reverse('images:image-similar', args=[image.pk]), params)
+
+    def test_similar_images(self):
+        """
+        Checks images within the distance are returned closest first
+        """
+        image = self.create(0x0123456789abcdef)
+        close = self.create(0x0123456789abcdee)
+        closer = self.create(0x0123456789abcdef)
+        far = self.create(0x0123456789abcdef ^ 0xf0f)
+        self.create(0x0123456789abcdef, user=get_user_model().objects.create_user(username='Other'))
+
+        res = self.similar(image)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([(match['id'], match['distance']) for match in res.data['results']],
+                         [(closer.pk, 0), (close.pk, 1)])
+        self.assertIn('thumbnails', res.data['results'][0])
+
+        res = self.similar(image, distance=11)
+        self.assertEqual([match['id'] for match in res.data['results']], [closer.pk, close.pk, far.pk])
+
+    def test_far_chunks_found(self):
+        """
+        Checks hashes differing in every chunk are found within the distance
+        """
+        image = self.create(0)
+        match = self.create(0x0001000100010001)
+        res = self.similar(image, distance=4)
+        self.assertEqual([match['id'] for match in res.data['results']], [match.pk])
+        res = self.similar(image, distance=3)
+        self.assertEqual(res.data['results'], [])
+
+    def test_invalid_distance(self):
+        image = self.create(0)
+        self.assertEqual(self.similar(image, distance=12).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.similar(image, distance='far').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_not_processed(self):
+        image = Image.objects.create(user=self.user, original_image='uploads/a.jpg')
+        self.assertEqual(self.similar(image).status_code, status.HTTP_409_CONFLICT)
+
+    def test_indexed_when_thumbnails_render(self):
+        """
+        Checks a re-encoded copy is found once the worker rendered both
+        """
+        photo = PIL_Image.merge('RGB', [PIL_Image.linear_gradient('L').resize((500, 400)),
+                                        PIL_Image.radial_gradient('L').resize((500, 400)),
+                                        PIL_Image.linear_gradient('L').rotate(90).resize((500, 400))])
+        ids = []
+        for quality in (95, 30):
+            buffer = BytesIO()
+            photo.save(buffer, format='JPEG', quality=quality)
+            buffer.name = 'photo.jpg'
+            buffer.seek(0)
+            res = self.client.post(reverse('images:image-list'), {'original_image': buffer}, format='multipart')
+            ids.append(res.data['id'])
+
+        call_command('process_thumbnails', '--once', '--workers', '1', stdout=StringIO())
+
+        res = self.client.get(reverse('images:image-similar', args=[ids[0]]))
+        self.assertEqual([match['id'] for match in res.data['results']], [ids[1]])
+
+
+class DeduplicationTestCase(APITestCase):
+
+    def setUp(self) -> None:
+        self.tier = Tier.objects.create(name='Basic', original=False, temporary_link=False)
+        self.tier.sizes.add(Size.objects.create(size_px=200))
+        self.users = []
+        for username in ('First User', 'Second User'):
+            user = get_user_model().objects.create_user(username=username, password='test-user-password123')
+            user.tier = self.tier
+            self.users.append(user)
+
+        buffer = BytesIO()
+        PIL_Image.new('RGB', (500, 500), color='red').save(buffer, format='JPEG')
+        self.content = buffer.getvalue()
+
+    def upload(self, user):
+        self.client.force_authenticate(user=user)
+        image_file = BytesIO(self.content)
+        image_file.name = 'photo.jpg'
+        res = self.client.post(reverse('images:image-list'), {'original_image': image_file}, format='multipart')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        return Image.objects.get(pk=res.data['id'])
+
+    def test_same_content_shares_blob_and_thumbnails(self):
+        first = self.upload(self.users[0])
+        call_command('process_thumbnails', '--once', '--workers', '1', stdout=StringIO())
+        second = self.upload(self.users[1])
+
+        self.assertEqual(first.blob, second.blob)
+        self.assertEqual(first.original_image.name, second.original_image.name)
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+        job = second.thumbnail_jobs.get()
+        self.assertEqual(job.status, ThumbnailJob.Status.DONE)
+        self.assertEqual(job.name, first.thumbnail_jobs.get().name)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertTrue(first.placeholder)
+        self.assertEqual(second.placeholder, first.placeholder)
+        self.assertEqual(second.dominant_color, first.dominant_color)
+
+    def test_blob_deleted_with_last_image(self):
+        first = self.upload(self.users[0])
+        second = self.upload(self.users[1])
+        path = first.original_image.path
+
+        first.delete()
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(os.path.exists(path))
+
+    def test_blob_stored_again_before_release_commits(self):
+        """
+        Checks a released blob's file is kept when the same content was stored again meanwhile
+        """
+        image = self.upload(self.users[0])
+        blob, path = image.blob, image.original_image.path
+        with self.captureOnCommitCallbacks() as callbacks:
+            image.delete()
+        Blob.objects.create(sha256=blob.sha256, name=blob.name, size=blob.size, ref_count=1)
+        for callback in callbacks:
+            callback()
+        self.assertTrue(os.path.exists(path))
+
+    def test_rolled_back_upload_leaves_no_file(self):
+        name = blob_name(hashlib.sha256(self.content).hexdigest(), '.jpg')
+        default_storage.delete(name)
+        self.client.force_authenticate(user=self.users[0])
+        image_file = BytesIO(self.content)
+        image_file.name = 'photo.jpg'
+        with patch('images.views.queue_thumbnails', side_effect=DatabaseError), self.assertRaises(DatabaseError):
+            self.client.post(reverse('images:image-list'), {'original_image': image_file}, format='multipart')
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(default_storage.exists(name))
+
+
+class BulkUploadTestCase(APITestCase):
+
+    def setUp(self) -> None:
+        self.user = get_user_model().objects.create_user(username='Test Name', password='test-user-password123')
+        self.tier = Tier.objects.create(name='Basic', original=False, temporary_link=False)
+        self.tier.sizes.add(Size.objects.create(size_px=200))
+        self.user.tier = self.tier
+        self.user.save()
+        self.client.force_authenticate(user=self.user)
+
+    def image_content(self, color):
+        buffer = BytesIO()
+        PIL_Image.new('RGB', (50, 50), color=(color, 0, 0)).save(buffer, format='PNG')
+        return buffer.getvalue()
+
+    def image_files(self, count):
+        files = []
+        for i in range(count):
+            image_file = BytesIO(self.image_content(i))
+            image_file.name = f'photo{i}.png'
+            files.append(image_file)
+        return files
+
+    def post_files(self, files):
+        return self.client.post(reverse('images:image-bulk-upload'), {'files': files}, format='multipart')
+
+    def test_multipart_bulk_upload(self):
+        """
+        Checks every file gets a result, invalid ones failing on their own
+        """
+        invalid = BytesIO(b'not an image')
+        invalid.name = 'broken.png'
+        files = self.image_files(2)
+        res = self.post_files([files[0], invalid, files[1]])
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        results = res.data['results']
+        self.assertEqual([result['status'] for result in results], ['created', 'failed', 'created'])
+        self.assertEqual(results[0]['name'], 'photo0.png')
+        self.assertEqual(results[2]['image']['thumbnails']['200']['status'], 'pending')
+        self.assertEqual(Image.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(ThumbnailJob.objects.count(), 2)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.image_count, 2)
+
+    def test_duplicates_share_blob(self):
+        content = self.image_content(0)
+        files = [BytesIO(content), BytesIO(content)]
+        for image_file in files:
+            image_file.name = 'photo.png'
+        res = self.post_files(files)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+
+    @override_settings(BULK_UPLOAD_BATCH_SIZE=10)
+    def test_query_count_per_batch(self):
+        """
+        Checks storing a batch costs the same number of queries for any size
+        """
+        counts = []
+        for count in (2, 10):
+            files = self.image_files(count)
+            with CaptureQueriesContext(connection) as queries:
+                res = self.post_files(files)
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_zip_archive(self):
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            zip_file.writestr('album/photo.png', self.image_content(1))
+            zip_file.writestr('album/notes.txt', b'text')
+            zip_file.writestr('__MACOSX/album/._photo.png', b'')
+        res = self.client.post(reverse('images:image-bulk-upload'), archive.getvalue(),
+                               content_type='application/zip')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([result['name'] for result in res.data['results']], ['album/photo.png', 'album/notes.txt'])
+        self.assertEqual([result['status'] for result in res.data['results']], ['created', 'failed'])
+
+    def test_tar_archive(self):
+        archive = BytesIO()
+        with tarfile.open(fileobj=archive, mode='w:gz') as tar_file:
+            for i in range(3):
+                content = self.image_content(i)
+                info = tarfile.TarInfo(f'photo{i}.png')
+                info.size = len(content)
+                tar_file.addfile(info, BytesIO(content))
+        res = self.client.post(reverse('images:image-bulk-upload'), archive.getvalue(),
+                               content_type='application/gzip')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(res.data['results']), 3)
+        self.assertEqual(Image.objects.filter(user=self.user).count(), 3)
+
+    def test_invalid_archive(self):
+        res = self.client.post(reverse('images:image-bulk-upload'), b'not a zip', content_type='application/zip')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(BULK_UPLOAD_MAX_SIZE=100)
+    def test_archive_too_large(self):
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            for i in range(3):
+                zip_file.writestr(f'photo{i}.png', self.image_content(i))
+        res = self.client.post(reverse('images:image-bulk-upload'), archive.getvalue(),
+                               content_type='application/zip')
+        self.assertEqual(res.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertFalse(Image.objects.exists())
+
+    @override_settings(BULK_UPLOAD_BATCH_SIZE=2)
+    def test_quota_fails_whole_batch(self):
+        self.tier.max_images = 3
+        self.tier.save()
+        res = self.post_files(self.image_files(4))
+        self.assertEqual([result['status'] for result in res.data['results']],
+                         ['created', 'created', 'failed', 'failed'])
+        self.assertEqual(res.data['results'][2]['errors'].code, 'quota_exceeded')
+        self.assertEqual(Image.objects.count(), 2)
+
+    @override_settings(BULK_UPLOAD_BATCH_SIZE=2)
+    def test_upload_rate_counts_files(self):
+        """
+        Checks every imported file counts against the upload rate, batches over it failing with 429
+        """
+        self.tier.upload_rate = '3/hour'
+        self.tier.save()
+        res = self.post_files(self.image_files(4))
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([result['status'] for result in res.data['results']],
+                         ['created', 'created', 'failed', 'failed'])
+        self.assertEqual(res.data['results'][2]['errors'].code, 'throttled')
+        res = self.post_files(self.image_files(2))
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(self.post_files(self.image_files(1)).status_code, status.HTTP_201_CREATED)
+        res = self.post_files(self.image_files(1))
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', res)
+        self.assertEqual(Image.objects.count(), 3)
+
+    def blob_file_exists(self, content):
+        return default_storage.exists(blob_name(hashlib.sha256(content).hexdigest(), '.png'))
+
+    @override_settings(BULK_UPLOAD_BATCH_SIZE=2)
+    def test_failed_batch_leaves_no_files(self):
+        """
+        Checks files of a batch rolled back by the quota or a later error are not kept
+        """
+        self.tier.max_images = 1
+        self.tier.save()
+        contents = [self.image_content(color) for color in (240, 241)]
+        for content in contents:
+            default_storage.delete(blob_name(hashlib.sha256(content).hexdigest(), '.png'))
+        files = [BytesIO(content) for content in contents]
+        for i, image_file in enumerate(files):
+            image_file.name = f'photo{i}.png'
+        res = self.post_files(files)
+        self.assertEqual([result['status'] for result in res.data['results']], ['failed', 'failed'])
+        self.assertFalse(any(self.blob_file_exists(content) for content in contents))
+
+        self.tier.max_images = 0
+        self.tier.save()
+        for image_file in files:
+            image_file.seek(0)
+        with patch('images.bulk.queue_images_thumbnails', side_effect=EngineBusy()):
+            res = self.post_files(files)
+        self.assertEqual([result['status'] for result in res.data['results']], ['failed', 'failed'])
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(any(self.blob_file_exists(content) for content in contents))
+
+
+@override_settings(TEMPORARY_LINK_MODE='signed')
+class SignedLinkTestCase(APITestCase):
+
+    def setUp(self) -> None:
+        user_details = {
+            'username': 'Test Name',
+            'password': 'test-user-password123',
+        }
+        self.user = get_user_model().objects.create_user(**user_details)
+        self.client.force_authenticate(user=self.user)
+        self.tier = Tier.objects.create(name='Test', original=True, temporary_link=True)
+        self.user.tier = self.tier
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as image_file:
+            img = PIL_Image.new('RGB', (500, 500))
+            img.save(image_file, format='JPEG')
+            image_file.seek(0)
+            self.image = Image.objects.create(original_image=File(image_file), user=self.user)
+        payload = {
+            'seconds_to_expire': 400,
+            'image_id': self.image.id
+        }
+        temp_link_res = self.client.post(reverse('images:get-temp-link'), payload)
+        self.assertEqual(temp_link_res.status_code, status.HTTP_201_CREATED)
+        self.temp_link = temp_link_res.data['temp_link']
+
+    def test_signed_link_needs_no_database(self):
+        self.assertFalse(TemporaryLinkModel.objects.exists())
+        self.client.get(self.temp_link)
+        with self.assertNumQueries(0):
+            binary_image_res = self.client.get(self.temp_link)
+        self.assertEqual(binary_image_res.status_code, status.HTTP_200_OK)
+        self.assertIn('http://', binary_image_res.data['binary_image'])
+
+    def test_signed_link_hides_storage_name(self):
+        token = self.temp_link.rstrip('/').rsplit('/', 1)[-1]
+        payload = signing.loads(token, salt=SIGNED_LINK_SALT)
+        self.assertNotIn(self.image.original_image.name, str(payload))
+        self.assertEqual(payload['i'], self.image.id)
+
+    def test_tampered_signed_link(self):
+        binary_image_res = self.client.get(self.temp_link[:-1] + ('a' if self.temp_link[-1] != 'a' else 'b'))
+        self.assertEqual(binary_image_res.status_code, status.HTTP_404_NOT_FOUND)
+
+    @patch('django.utils.timezone.now', return_value=timezone.now() + timedelta(seconds=500))
+    def test_expired_signed_link(self, mock_now):
+        binary_image_res = self.client.get(self.temp_link)
+        self.assertEqual(binary_image_res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_revoked_signed_link(self):
+        res = self.client.post(reverse('images:revoke-temp-link'), {'temp_link': self.temp_link})
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        binary_image_res = self.client.get(self.temp_link)
+        self.assertEqual(binary_image_res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_deleted_image_signed_link(self):
+        self.assertEqual(self.client.get(self.temp_link).status_code, status.HTTP_200_OK)
+        self.image.delete()
+        binary_image_res = self.client.get(self.temp_link)
+        self.assertEqual(binary_image_res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class RenderImageTestCase(APITestCase):
+
+    def setUp(self) -> None:
+        user_details = {
+            'username': 'Test Name',
+            'password': 'test-user-password123',
+        }
+        self.user = get_user_model().objects.create_user(**user_details)
+        self.client.force_authenticate(user=self.user)
+        self.tier = Tier.objects.create(name='Premium', original=True, temporary_link=False, max_render_px=300)
+        self.user.tier = self.tier
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as image_file:
+            img = PIL_Image.new('RGB', (500, 250))
+            img.save(image_file, format='JPEG')
+            image_file.seek(0)
+            self.image = Image.objects.create(original_image=File(image_file), user=self.user)
+        self.url = reverse('images:image-render', args=[self.image.id])
+
+    def test_render_contain(self):
+        res = self.client.get(self.url, {'w': 200, 'fmt': 'png'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'image/png')
+        with PIL_Image.open(BytesIO(res.content)) as rendered:
+            self.assertEqual(rendered.size, (200, 100))
+
+    def test_render_cover(self):
+        res = self.client.get(self.url, {'w': 100, 'h': 100, 'fit': 'cover'})
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+        with PIL_Image.open(BytesIO(res.content)) as rendered:
+            self.assertEqual(rendered.size, (100, 100))
+
+    def test_render_palette_image(self):
+        """
+        Checks palette PNGs, box reduced before resizing, render in every format
+        """
+        with tempfile.NamedTemporaryFile(suffix='.png') as image_file:
+            img = PIL_Image.new('P', (1000, 800))
+            img.putpalette([0, 0, 0, 200, 40, 40] * 128)
+            img.save(image_file, format='PNG')
+            image_file.seek(0)
+            image = Image.objects.create(original_image=File(image_file), user=self.user)
+        for fmt in ('jpeg', 'png'):
+            res = self.client.get(reverse('images:image-render', args=[image.id]), {'w': 200, 'fmt': fmt})
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            with PIL_Image.open(BytesIO(res.content)) as rendered:
+                self.assertEqual(rendered.size, (200, 160))
+
+    def test_render_extreme_aspect_ratio(self):
+        """
+        Checks a side following the aspect ratio is at least a pixel, for both fits
+        """
+        with tempfile.NamedTemporaryFile(suffix='.png') as image_file:
+            PIL_Image.new('RGB', (1000, 10)).save(image_file, format='PNG')
+            image_file.seek(0)
+            image = Image.objects.create(original_image=File(image_file), user=self.user)
+        for fit in ('contain', 'cover'):
+            res = self.client.get(reverse('images:image-render', args=[image.id]), {'w': 1, 'fit': fit, 'fmt': 'png'})
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            with PIL_Image.open(BytesIO(res.content)) as rendered:
+                self.assertEqual(rendered.size, (1, 1))
+
+    def test_render_cached(self):
+        self.client.get(self.url, {'h': 120})
+        with patch('images.rendering.render_transform') as patched_render:
+            res = self.client.get(self.url, {'h': 120})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        patched_render.assert_not_called()
+
+    def test_render_engine_busy(self):
+        with patch('images.engine.InlineEngine.run', side_effect=EngineBusy(wait=5)):
+            res = self.client.get(self.url, {'h': 130})
+        self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(res['Retry-After'], '5')
+
+    def test_render_over_tier_limit(self):
+        res = self.client.get(self.url, {'w': 301})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_render_not_allowed_for_tier(self):
+        self.tier.max_render_px = 0
+        res = self.client.get(self.url, {'w': 100})
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_render_other_users_image(self):
+        other_user = get_user_model().objects.create_user(username='Other', password='test-user-password123')
+        other_user.tier = self.tier
+        self.client.force_authenticate(user=other_user)
+        res = self.client.get(self.url, {'w': 100})
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class FormatNegotiationTestCase(APITestCase):
+
+    def setUp(self) -> None:
+        user_details = {
+            'username': 'Test Name',
+            'password': 'test-user-password123',
+        }
+        self.user = get_user_model().objects.create_user(**user_details)
+        self.client.force_authenticate(user=self.user)
+        self.tier = Tier.objects.create(name='Premium', original=True, temporary_link=False, max_render_px=300)
+        self.tier.sizes.add(Size.objects.create(size_px=200))
+        self.user.tier = self.tier
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as image_file:
+            img = PIL_Image.new('RGB', (500, 500))
+            img.save(image_file, format='JPEG')
+            image_file.seek(0)
+            payload = {'original_image': image_file}
+            res = self.client.post(reverse('images:image-list'), payload, format='multipart')
+        self.image_id = res.data['id']
+        call_command('process_thumbnails', '--once', '--workers', '1', stdout=StringIO())
+
+    def test_thumbnail_webp_when_accepted(self):
+        res = self.client.get(reverse('images:image-list'), HTTP_ACCEPT='application/json, image/webp')
+        self.assertTrue(res.data['results'][0]['thumbnails']['200']['url'].endswith('.webp'))
+        self.assertIn('Accept', res['Vary'])
+
+        res = self.client.get(reverse('images:image-list'), HTTP_ACCEPT='application/json, image/*')
+        self.assertTrue(res.data['results'][0]['thumbnails']['200']['url'].endswith('.jpg'))
+
+    def test_render_webp_when_accepted(self):
+        url = reverse('images:image-render', args=[self.image_id])
+        res = self.client.get(url, {'w': 100}, HTTP_ACCEPT='image/webp,image/*;q=0.8')
+        self.assertEqual(res['Content-Type'], 'image/webp')
+        self.assertIn('Accept', res['Vary'])
+
+        res = self.client.get(url, {'w': 100}, HTTP_ACCEPT='image/webp;q=0, image/*')
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+
+
+class MediaFileTestCase(APITestCase):
+
+    def setUp(self) -> None:
+        user_details = {
+            'username': 'Test Name',
+            'password': 'test-user-password123',
+        }
+        self.user = get_user_model().objects.create_user(**user_details)
+        self.tier = Tier.objects.create(name='Premium', original=True, temporary_link=True)
+        self.user.tier = self.tier
+        self.user.save()
+        self.client.force_authenticate(user=self.user)
+        original = default_storage.save('blobs/ab/cd/abcd.jpg', BytesIO(b'original'))
+        self.thumbnail = default_storage.save(f'{original}.0x200_q85.jpg', BytesIO(b'0123456789thumbnail'))
+        self.variant = default_storage.save(f'{original}.0x200_q85.webp', BytesIO(b'variant'))
+        for name in (original, self.thumbnail, self.variant):
+            self.addCleanup(default_storage.delete, name)
+        self.image = Image.objects.create(user=self.user, original_image=original)
+        ThumbnailJob.objects.create(image=self.image, size_px=200, status=ThumbnailJob.Status.DONE,
+                                    name=self.thumbnail, formats='webp')
+
+    def get(self, name, **headers):
+        res = self.client.get(reverse('images:media', args=[name]), **headers)
+        self.addCleanup(res.close)
+        return res
+
+    def test_serve_thumbnail(self):
+        res = self.get(self.thumbnail)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(res.streaming_content), b'0123456789thumbnail')
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+        self.assertEqual(res['Cache-Control'], 'private, no-cache')
+        self.assertTrue(res['ETag'].startswith('"'))
+        self.assertIn('Last-Modified', res)
+
+    def test_serve_variant_and_original(self):
+        self.assertEqual(self.get(self.variant).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get(self.image.original_image.name).status_code, status.HTTP_200_OK)
+
+    def test_only_blob_original_immutable(self):
+        """
+        Checks only the content addressed original is cached for good, not the files next to it
+        """
+        self.image.blob = Blob.objects.create(sha256='abcd', name=self.image.original_image.name, size=8)
+        self.image.save()
+        self.assertIn('immutable', self.get(self.image.original_image.name)['Cache-Control'])
+        self.assertEqual(self.get(self.thumbnail)['Cache-Control'], 'private, no-cache')
+        self.assertEqual(self.get(self.variant)['Cache-Control'], 'private, no-cache')
+
+    def test_original_not_allowed_for_tier(self):
+        self.tier.original = False
+        self.tier.save()
+        res = self.get(self.image.original_image.name)
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_other_users_file(self):
+        other_user = get_user_model().objects.create_user(username='Other', password='test-user-password123')
+        self.client.force_authenticate(user=other_user)
+        res = self.get(self.thumbnail)
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_conditional_get(self):
+        etag = self.get(self.thumbnail)['ETag']
+        res = self.get(self.thumbnail, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_range(self):
+        res = self.get(self.thumbnail, HTTP_RANGE='bytes=2-5')
+        self.assertEqual(res.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join(res.streaming_content), b'2345')
+        self.assertEqual(res['Content-Range'], 'bytes 2-5/19')
+
+        res = self.get(self.thumbnail, HTTP_RANGE='bytes=-9')
+        self.assertEqual(b''.join(res.streaming_content), b'thumbnail')
+
+        res = self.get(self.thumbnail, HTTP_RANGE='bytes=100-')
+        self.assertEqual(res.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+
+    def test_stale_if_range_serves_whole_file(self):
+        res = self.get(self.thumbnail, HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    @override_settings(MEDIA_SENDFILE_BACKEND='nginx')
+    def test_x_accel_redirect(self):
+        res = self.get(self.thumbnail)
+        self.assertEqual(res['X-Accel-Redirect'], f'/protected-media/{self.thumbnail}')
+        self.assertEqual(res.content, b'')
+
+    def test_binary_image_file(self):
+        res = self.client.post(reverse('images:get-temp-link'), {'seconds_to_expire': 400, 'image_id': self.image.id})
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as image_file:
+            PIL_Image.new('RGB', (10, 10)).save(image_file, format='JPEG')
+            image_file.seek(0)
+            default_storage.delete(self.image.original_image.name)
+            default_storage.save(self.image.original_image.name, image_file)
+        binary_url = self.client.get(res.data['temp_link']).data['binary_image']
+
+        self.client.force_authenticate(user=None)
+        res = self.client.get(binary_url)
+        self.addCleanup(res.close)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'image/png')
+        self.assertRegex(res['Cache-Control'], r'^private, max-age=(399|400)$')
+        # Read in the view's thread, not streamed by the ASGI handler
+        self.assertFalse(res.streaming)
+        self.assertTrue(res.content.startswith(b'\x89PNG'))
+        res = self.client.get(binary_url, HTTP_RANGE='bytes=1-3')
+        self.assertEqual(res.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(res.content, b'PNG')
+
+
+@override_settings(COUNTER_BACKENDS={
+    'default': {'BACKEND': 'images.counters.LocMemCounter'},
+    'downloads': {'BACKEND': 'images.counters.LocMemCounter'},
+})
+class TierLimitsTestCase(APITestCase):
+
+    def setUp(self) -> None:
+        user_details = {
+            'username': 'Test Name',
+            'password': 'test-user-password123',
+        }
+        self.user = get_user_model().objects.create_user(**user_details)
+        self.tier = Tier.objects.create(name='Basic', original=True, temporary_link=True, max_render_px=300)
+        self.user.tier = self.tier
+        self.user.save()
+        self.client.force_authenticate(user=self.user)
+
+    def upload(self):
+        buffer = BytesIO()
+        PIL_Image.new('RGB', (50, 50), color=(Image.objects.count(), 0, 0)).save(buffer, format='PNG')
+        buffer.name = 'photo.png'
+        buffer.seek(0)
+        return self.client.post(reverse('images:image-list'), {'original_image': buffer}, format='multipart')
+
+    def test_upload_rate(self):
+        self.tier.upload_rate = '1/hour'
+        self.tier.save()
+        self.assertEqual(self.upload().status_code, status.HTTP_201_CREATED)
+        res = self.upload()
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', res)
+
+    def test_render_rate(self):
+        self.tier.render_rate = '1/minute'
+        self.tier.save()
+        self.upload()
+        url = reverse('images:image-render', args=[Image.objects.get().id])
+        self.assertEqual(self.client.get(url, {'w': 20}).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(url, {'w': 20}).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_temp_link_rate(self):
+        self.tier.temp_link_rate = '1/day'
+        self.tier.save()
+        self.upload()
+        payload = {'seconds_to_expire': 400, 'image_id': Image.objects.get().id}
+        self.assertEqual(self.client.post(reverse('images:get-temp-link'), payload).status_code,
+                         status.HTTP_201_CREATED)
+        self.assertEqual(self.client.post(reverse('images:get-temp-link'), payload).status_code,
+                         status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_rates_validated(self):
+        """
+        Checks tier rates must parse as throttle rates, as a typo would fail every request of the tier
+        """
+        for rate in ('', '100/hour', '5/s', '1/day'):
+            Tier(name='Valid', upload_rate=rate, render_rate=rate, temp_link_rate=rate).full_clean()
+        for field in ('upload_rate', 'render_rate', 'temp_link_rate'):
+            with self.assertRaises(ValidationError) as raised:
+                Tier(name='Typo', **{field: '100 per hour'}).full_clean()
+            self.assertIn(field, raised.exception.message_dict)
+
+    @override_settings(SIMILAR_IMAGES_THROTTLE_RATE='1/minute')
+    def test_similar_images_rate(self):
+        """
+        Checks searches have their own rate and don't use up uploads
+        """
+        self.upload()
+        Image.objects.update(dhash_0=0, dhash_1=0, dhash_2=0, dhash_3=0)
+        url = reverse('images:image-similar', args=[Image.objects.get().id])
+        with patch('images.throttling.UploadRateThrottle.allow_request') as patched_upload_throttle:
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        patched_upload_throttle.assert_not_called()
+
+    @override_settings(BINARY_IMAGE_THROTTLE_RATE='1/minute')
+    def test_binary_image_rate(self):
+        self.upload()
+        payload = {'seconds_to_expire': 400, 'image_id': Image.objects.get().id}
+        temp_link = self.client.post(reverse('images:get-temp-link'), payload).data['temp_link']
+        self.assertEqual(self.client.get(temp_link).status_code, status.HTTP_200_OK)
+        res = self.client.get(temp_link)
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', res)
+
+    def test_image_count_quota(self):
+        self.tier.max_images = 1
+        self.tier.save()
+        self.assertEqual(self.upload().status_code, status.HTTP_201_CREATED)
+        res = self.upload()
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(res.data['detail'].code, 'quota_exceeded')
+        self.assertEqual(Image.objects.count(), 1)
+
+        Image.objects.get().delete()
+        self.assertEqual(self.upload().status_code, status.HTTP_201_CREATED)
+
+    def test_storage_quota(self):
+        self.tier.max_storage_bytes = 10
+        self.tier.save()
+        self.assertEqual(self.upload().status_code, status.HTTP_403_FORBIDDEN)
+        res = self.client.post(reverse('images:image-upload'), {'filename': 'photo.jpg', 'size': 11})
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_usage_counted(self):
+        self.upload()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.image_count, 1)
+        self.assertEqual(self.user.stored_bytes, Blob.objects.get().size)
+
+    def test_usage_released_with_last_reference(self):
+        """
+        Checks deleting the image that held the last reference to its blob frees its bytes
+        """
+        self.upload()
+        Image.objects.get().delete()
+        self.assertFalse(Blob.objects.exists())
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.image_count, self.user.stored_bytes), (0, 0))
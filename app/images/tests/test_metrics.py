@@ -0,0 +1,80 @@
+from django.contrib.auth import get_user_model
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from images.metrics import RequestTimings, stage
+from images.models import Image, Size, ThumbnailJob, Tier
+
+
+class MetricsTestCase(APITestCase):
+
+    def setUp(self) -> None:
+        self.user = get_user_model().objects.create_user(username='Test Name', password='test-user-password123')
+        self.tier = Tier.objects.create(name='Basic', original=False, temporary_link=False)
+        for size_px in (200, 400):
+            self.tier.sizes.add(Size.objects.create(size_px=size_px))
+        self.user.tier = self.tier
+        self.user.save()
+        self.client.force_authenticate(user=self.user)
+        image = Image.objects.create(user=self.user, original_image='uploads/a.jpg')
+        ThumbnailJob.objects.create(image=image, size_px=200, status=ThumbnailJob.Status.DONE,
+                                    name='uploads/a.jpg.0x200_q85.jpg')
+
+    @override_settings(SERVER_TIMING=True)
+    def test_server_timing(self):
+        """
+        Checks responses report stage durations, queries and cache hits
+        """
+        res = self.client.get(reverse('images:image-list'))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        metrics = [metric.strip() for metric in res['Server-Timing'].split(',')]
+        self.assertTrue(metrics[0].startswith('total;dur='))
+        self.assertIn('db;dur=', res['Server-Timing'])
+        self.assertIn(';desc="3 queries"', res['Server-Timing'])
+        self.assertIn('thumbnails;dur=', res['Server-Timing'])
+        self.assertIn('cache-thumbnail;desc="1/2 hits"', metrics)
+
+    @override_settings(SERVER_TIMING=True)
+    async def test_server_timing_async(self):
+        """
+        Checks queries run by async views in other threads are counted
+        """
+        token = await Token.objects.acreate(user=self.user)
+        res = await self.async_client.get(reverse('images:image-list'), AUTHORIZATION=f'Token {token.key}')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertRegex(res['Server-Timing'], r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertIn('cache-auth;desc="0/1 hits"', res['Server-Timing'])
+
+    def test_server_timing_off_by_default(self):
+        res = self.client.get(reverse('images:image-list'))
+        self.assertNotIn('Server-Timing', res)
+
+    def test_prometheus_metrics(self):
+        """
+        Checks requests and cache lookups are exported for Prometheus
+        """
+        self.client.get(reverse('images:image-list'))
+        res = self.client.get(reverse('metrics'))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res['Content-Type'].startswith('text/plain'))
+        content = res.content.decode()
+        self.assertIn('http_requests_total{method="GET",status="200",view="images:image-list"}', content)
+        self.assertIn('image_cache_lookups_total{cache="thumbnail",result="hit"}', content)
+        self.assertIn('image_stage_duration_seconds_count{stage="thumbnails",view="images:image-list"}', content)
+
+    def test_metrics_only_for_allowed_ips(self):
+        res = self.client.get(reverse('metrics'), REMOTE_ADDR='203.0.113.5')
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_stage_accumulates(self):
+        timings = RequestTimings()
+        timings.add('encode', 0.001)
+        timings.add('encode', 0.002)
+        timings.count_lookup('render', False)
+        header = timings.server_timing(0.01)
+        self.assertEqual(header, 'total;dur=10.0, encode;dur=3.0, cache-render;desc="0/1 hits"')
+        with stage('outside_request'):
+            pass
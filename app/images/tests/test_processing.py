@@ -0,0 +1,114 @@
+import base64
+from io import BytesIO
+
+from django.test import SimpleTestCase
+from PIL import Image as PIL_Image
+
+from images.processing import difference_hash, make_placeholder, render_thumbnails
+from images.similarity import bit_flips, join_hash, split_hash
+
+
+def jpeg(size, orientation=None):
+    buffer = BytesIO()
+    image = PIL_Image.new('RGB', size)
+    exif = image.getexif()
+    if orientation:
+        exif[0x0112] = orientation
+    image.save(buffer, format='JPEG', exif=exif)
+    buffer.seek(0)
+    return buffer
+
+
+class RenderThumbnailsTests(SimpleTestCase):
+    """Test multi-size thumbnail rendering."""
+
+    def test_all_sizes_from_one_decode(self):
+        """Test every size is rendered bounded by height."""
+        thumbnails = render_thumbnails(jpeg((3000, 2000)), [200, 400, 1000])
+
+        self.assertEqual(thumbnails[1000].size, (1500, 1000))
+        self.assertEqual(thumbnails[400].size, (600, 400))
+        self.assertEqual(thumbnails[200].size, (300, 200))
+
+    def test_no_upscale(self):
+        """Test images smaller than a size keep their size."""
+        thumbnails = render_thumbnails(jpeg((300, 150)), [200, 400])
+
+        self.assertEqual(thumbnails[200].size, (300, 150))
+        self.assertEqual(thumbnails[400].size, (300, 150))
+
+    def test_exif_orientation_applied(self):
+        """Test thumbnails of rotated photos are upright."""
+        thumbnails = render_thumbnails(jpeg((2000, 1000), orientation=6), [400])
+
+        self.assertEqual(thumbnails[400].size, (200, 400))
+
+    def test_palette_and_bilevel_reduced(self):
+        """Test palette and 1-bit PNGs are expanded before being box reduced."""
+        for mode, transparency, expected_mode in (('P', None, 'RGB'), ('P', 0, 'RGBA'), ('1', None, 'L')):
+            image = PIL_Image.new(mode, (1000, 800))
+            if mode == 'P':
+                image.putpalette([0, 0, 0, 200, 40, 40] * 128)
+                image.paste(1, (0, 0, 500, 800))
+            buffer = BytesIO()
+            image.save(buffer, format='PNG', **({'transparency': transparency} if transparency is not None else {}))
+            buffer.seek(0)
+
+            thumbnails = render_thumbnails(buffer, [200])
+
+            self.assertEqual(thumbnails[200].size, (250, 200))
+            self.assertEqual(thumbnails[200].mode, expected_mode)
+            if mode == 'P' and transparency is None:
+                self.assertEqual(thumbnails[200].getpixel((10, 10)), (200, 40, 40))
+
+
+class PlaceholderTests(SimpleTestCase):
+    """Test placeholders computed from rendered thumbnails."""
+
+    def test_placeholder_and_dominant_color(self):
+        """Test the placeholder is a tiny data uri and the color the most common one."""
+        thumbnail = PIL_Image.new('RGB', (300, 200), (20, 120, 220))
+        thumbnail.paste((250, 250, 250), (0, 0, 50, 50))
+
+        placeholder, color = make_placeholder(thumbnail)
+
+        self.assertTrue(placeholder.startswith('data:image/jpeg;base64,'))
+        self.assertLess(len(placeholder), 1500)
+        data = base64.b64decode(placeholder.split(',', 1)[1])
+        self.assertEqual(PIL_Image.open(BytesIO(data)).size, (32, 21))
+        self.assertEqual(color, '#1478dc')
+
+    def test_transparent_placeholder(self):
+        """Test transparent thumbnails keep transparency."""
+        placeholder, _ = make_placeholder(PIL_Image.new('RGBA', (64, 64), (255, 0, 0, 128)))
+
+        self.assertTrue(placeholder.startswith('data:image/png;base64,'))
+
+
+class DifferenceHashTests(SimpleTestCase):
+    """Test perceptual hashes used for near-duplicate search."""
+
+    def photo(self):
+        red = PIL_Image.linear_gradient('L').resize((300, 200))
+        green = PIL_Image.radial_gradient('L').resize((300, 200))
+        return PIL_Image.merge('RGB', (red, green, red.rotate(90)))
+
+    def test_copies_hash_close(self):
+        """Test re-encoded and resized copies differ in a few bits, other images in many."""
+        photo = self.photo()
+        buffer = BytesIO()
+        photo.save(buffer, format='JPEG', quality=20)
+        copy = PIL_Image.open(buffer).resize((150, 100))
+        other = PIL_Image.effect_mandelbrot((300, 200), (-2, -1, 1, 1), 100)
+
+        value = difference_hash(photo)
+        self.assertLessEqual(bin(value ^ difference_hash(copy)).count('1'), 3)
+        self.assertGreater(bin(value ^ difference_hash(other)).count('1'), 20)
+
+    def test_chunks(self):
+        """Test hashes are split into 16 bit chunks and joined back."""
+        chunks = split_hash(0x0123456789abcdef)
+
+        self.assertEqual(chunks, {'dhash_0': 0x0123, 'dhash_1': 0x4567, 'dhash_2': 0x89ab, 'dhash_3': 0xcdef})
+        self.assertEqual(join_hash(type('Image', (), chunks)), 0x0123456789abcdef)
+        self.assertEqual(len(bit_flips(2)), 1 + 16 + 120)
@@ -0,0 +1,46 @@
+import os
+import tempfile
+
+from django.test import SimpleTestCase
+
+from images.render_cache import RenderCache
+
+
+class RenderCacheTests(SimpleTestCase):
+    """Test render cache."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_get_from_disk(self):
+        """Test entries are found on disk by another cache instance."""
+        RenderCache(self.directory.name, max_bytes=1000).set('a' * 40, b'data')
+
+        self.assertEqual(RenderCache(self.directory.name, max_bytes=1000).get('a' * 40), b'data')
+        self.assertIsNone(RenderCache(self.directory.name, max_bytes=1000).get('b' * 40))
+
+    def test_evicts_least_recently_used(self):
+        """Test least recently used entries are evicted when over budget."""
+        cache = RenderCache(self.directory.name, max_bytes=250)
+        keys = [RenderCache.make_key(i) for i in range(3)]
+        for mtime, key in enumerate(keys[:2]):
+            cache.set(key, bytes(100))
+            os.utime(cache.path(key), (mtime, mtime))
+        cache.get(keys[0])  # refreshes first entry
+
+        cache.set(keys[2], bytes(100))
+
+        self.assertIsNotNone(cache.get(keys[0]))
+        self.assertIsNone(cache.get(keys[1]))
+        self.assertIsNotNone(cache.get(keys[2]))
+        self.assertLessEqual(cache.scan_size(), 250)
+
+    def test_hot_cache_bounded(self):
+        """Test in-process cache keeps only the most recent entries within budget."""
+        cache = RenderCache(self.directory.name, max_bytes=1000, hot_max_bytes=200, hot_max_item_bytes=100)
+        for i in range(3):
+            cache.set(str(i) * 40, bytes(100))
+
+        self.assertEqual(list(cache.hot), ['1' * 40, '2' * 40])
+        self.assertEqual(cache.hot_bytes, 200)
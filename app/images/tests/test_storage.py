@@ -0,0 +1,144 @@
+import re
+import tempfile
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from images.binary import binary_image_name
+from images.blobs import blob_name, delete_blob_files
+from images.media import serve_file
+from images.models import image_file_path
+from images.storage import file_metadata, move_file, save_file
+
+try:
+    import boto3
+    import storages  # noqa: F401
+    from moto import mock_s3
+except ImportError:
+    mock_s3 = None
+
+
+class ShardedLayoutTests(SimpleTestCase):
+    """Test files are laid out in sharded directories."""
+
+    def test_upload_name(self):
+        name = image_file_path(None, 'photo.JPG')
+        self.assertRegex(name, r'^uploads/([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{28}\.JPG$')
+
+    def test_blob_and_binary_names(self):
+        sha256 = 'abcdef' + '0' * 58
+        self.assertEqual(blob_name(sha256, '.jpg'), f'blobs/ab/cd/{sha256}.jpg')
+        self.assertEqual(binary_image_name(blob_name(sha256, '.jpg'), 64), f'binary/ab/cd/{sha256}-64.png')
+
+
+class LocalStorageTests(SimpleTestCase):
+    """Test storage helpers on the local file system."""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(default_storage.delete, 'tests/file.txt')
+
+    def test_save_file_replaces(self):
+        save_file('tests/file.txt', b'first')
+        save_file('tests/file.txt', b'second')
+
+        with default_storage.open('tests/file.txt') as file:
+            self.assertEqual(file.read(), b'second')
+
+    @override_settings(STORAGE_METADATA_CACHE_TIMEOUT=3600)
+    def test_metadata_cached(self):
+        save_file('tests/file.txt', b'content')
+        self.assertEqual(file_metadata('tests/file.txt')['size'], 7)
+
+        with patch.object(default_storage, 'size') as patched_size:
+            self.assertEqual(file_metadata('tests/file.txt')['size'], 7)
+        patched_size.assert_not_called()
+
+    @override_settings(STORAGE_METADATA_CACHE_TIMEOUT=3600)
+    def test_metadata_forgotten_on_save(self):
+        save_file('tests/file.txt', b'content')
+        file_metadata('tests/file.txt')
+        save_file('tests/file.txt', b'longer content')
+
+        self.assertEqual(file_metadata('tests/file.txt')['size'], 14)
+
+    @override_settings(STORAGE_METADATA_CACHE_TIMEOUT=0)
+    def test_metadata_not_cached_without_shared_cache(self):
+        """Test files deleted by another process aren't believed to exist."""
+        save_file('tests/file.txt', b'content')
+        file_metadata('tests/file.txt')
+        default_storage.delete('tests/file.txt')
+
+        self.assertIsNone(file_metadata('tests/file.txt'))
+
+    def test_missing_file(self):
+        self.assertIsNone(file_metadata('tests/missing.txt'))
+
+    def test_move_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            staging = FileSystemStorage(location=directory)
+            staging.save('upload.txt', ContentFile(b'uploaded'))
+
+            move_file(staging, 'upload.txt', 'tests/file.txt')
+
+            self.assertFalse(staging.exists('upload.txt'))
+        with default_storage.open('tests/file.txt') as file:
+            self.assertEqual(file.read(), b'uploaded')
+
+
+@skipUnless(mock_s3, 'boto3, django-storages and moto are needed for S3 storage tests')
+@override_settings(
+    DEFAULT_FILE_STORAGE='storages.backends.s3boto3.S3Boto3Storage',
+    AWS_STORAGE_BUCKET_NAME='media',
+    AWS_S3_REGION_NAME='us-east-1',
+    AWS_ACCESS_KEY_ID='testing',
+    AWS_SECRET_ACCESS_KEY='testing',
+)
+class S3StorageTests(SimpleTestCase):
+    """Test storage helpers on an S3 object store."""
+
+    def setUp(self):
+        cache.clear()
+        mock = mock_s3()
+        mock.start()
+        self.addCleanup(mock.stop)
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket='media')
+
+    def test_save_and_metadata(self):
+        save_file('tests/file.txt', b'first')
+        save_file('tests/file.txt', b'second')
+
+        with default_storage.open('tests/file.txt') as file:
+            self.assertEqual(file.read(), b'second')
+        self.assertEqual(file_metadata('tests/file.txt')['size'], 6)
+        self.assertIsNone(file_metadata('tests/missing.txt'))
+
+    def test_move_file_from_staging(self):
+        with tempfile.TemporaryDirectory() as directory:
+            staging = FileSystemStorage(location=directory)
+            staging.save('upload.txt', ContentFile(b'uploaded'))
+
+            move_file(staging, 'upload.txt', 'blobs/ab/cd/abcd.jpg')
+
+            self.assertFalse(staging.exists('upload.txt'))
+        self.assertTrue(default_storage.exists('blobs/ab/cd/abcd.jpg'))
+
+    def test_delete_blob_files(self):
+        for name in ('blobs/ab/cd/abcd.jpg', 'blobs/ab/cd/abcd.jpg.0x200_q85.jpg', 'blobs/ab/cd/abce.jpg'):
+            save_file(name, b'content')
+
+        delete_blob_files('blobs/ab/cd/abcd.jpg')
+
+        self.assertEqual(default_storage.listdir('blobs/ab/cd')[1], ['abce.jpg'])
+
+    def test_serve_file_redirects(self):
+        save_file('blobs/ab/cd/abcd.jpg', b'content')
+
+        response = serve_file(RequestFactory().get('/'), 'blobs/ab/cd/abcd.jpg')
+
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(re.match(r'^https://media\.s3\.amazonaws\.com/blobs/ab/cd/abcd\.jpg\?', response.url))
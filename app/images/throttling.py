@@ -0,0 +1,108 @@
+from django.conf import settings
+from rest_framework.exceptions import Throttled
+from rest_framework.throttling import BaseThrottle, SimpleRateThrottle
+
+from .counters import get_counter
+from .thumbnails import get_user_tier
+
+
+class CounterRateThrottle(BaseThrottle):
+    """
+    Fixed window rate throttle counting requests in the COUNTER_BACKEND,
+    which increments atomically instead of keeping request histories.
+    """
+    scope = None
+    counter = 'default'
+
+    def get_rate(self, request):
+        raise NotImplementedError
+
+    def get_ident_key(self, request):
+        return self.get_ident(request)
+
+    def hit(self, request, amount=1):
+        """
+        Count amount hits of request, returns the count and the number of
+        hits allowed, or None when request isn't rate limited.
+        """
+        rate = self.get_rate(request)
+        if not rate:
+            return None
+        num_requests, duration = SimpleRateThrottle.parse_rate(self, rate)
+        key = f'throttle:{self.scope}:{self.get_ident_key(request)}'
+        count, self.reset_in = get_counter(self.counter).hit(key, duration, amount)
+        return count, num_requests
+
+    def allow_request(self, request, view):
+        hits = self.hit(request)
+        return hits is None or hits[0] <= hits[1]
+
+    def wait(self):
+        return self.reset_in
+
+
+class TierRateThrottle(CounterRateThrottle):
+    """Throttles users with the rate of their tier in the field named scope."""
+
+    def get_rate(self, request):
+        if not request.user.is_authenticated:
+            return None
+        return getattr(get_user_tier(request.user), self.scope)
+
+    def get_ident_key(self, request):
+        return request.user.pk
+
+
+class UploadRateThrottle(TierRateThrottle):
+    scope = 'upload_rate'
+
+
+class BulkUploadRateThrottle(UploadRateThrottle):
+    """
+    Upload rate of bulk imports, which count every imported file with
+    charge. The request itself is only refused once the rate is used up.
+    """
+
+    def allow_request(self, request, view):
+        hits = self.hit(request, 0)
+        return hits is None or hits[0] < hits[1]
+
+    def charge(self, request, count):
+        """
+        Count count files against the rate, raises Throttled without
+        counting them when they don't fit.
+        """
+        hits = self.hit(request, count)
+        if hits is not None and hits[0] > hits[1]:
+            self.hit(request, -count)
+            raise Throttled(self.wait())
+
+
+class RenderRateThrottle(TierRateThrottle):
+    scope = 'render_rate'
+
+
+class TempLinkRateThrottle(TierRateThrottle):
+    scope = 'temp_link_rate'
+
+
+class SimilarImagesRateThrottle(CounterRateThrottle):
+    """Throttles near-duplicate searches by user."""
+    scope = 'similar_images'
+
+    def get_rate(self, request):
+        if not request.user.is_authenticated:
+            return None
+        return settings.SIMILAR_IMAGES_THROTTLE_RATE
+
+    def get_ident_key(self, request):
+        return request.user.pk
+
+
+class BinaryImageRateThrottle(CounterRateThrottle):
+    """Throttles temporary link downloads by client address."""
+    scope = 'binary_image'
+    counter = 'downloads'
+
+    def get_rate(self, request):
+        return settings.BINARY_IMAGE_THROTTLE_RATE
@@ -0,0 +1,233 @@
+import io
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from easy_thumbnails.conf import settings as thumbnail_settings
+from easy_thumbnails.files import get_thumbnailer
+
+from .exceptions import ImageTooLarge
+from .formats import MODERN_FORMATS, variant_name
+from .metrics import stage
+from .models import Image, ThumbnailJob, Tier
+from .processing import difference_hash, is_transparent, make_placeholder, render_thumbnails
+from .similarity import CHUNK_FIELDS, split_hash
+from .storage import save_file
+
+
+# Image fields computed from the pixels while rendering thumbnails, shared
+# by all images of a blob.
+ANALYSIS_FIELDS = ['placeholder', 'dominant_color'] + CHUNK_FIELDS
+
+
+def get_user_tier(user):
+    """Return user's tier, falling back to the Basic tier."""
+    if not user.tier:
+        user.tier = Tier.objects.get(name='Basic')
+    return user.tier
+
+
+def get_tier_sizes(user):
+    """
+    Return user's tier thumbnail sizes in pixels, from the prefetched
+    sizes of a tier resolved by CachedTokenAuthentication when present.
+    """
+    tier = get_user_tier(user)
+    if 'sizes' in getattr(tier, '_prefetched_objects_cache', {}):
+        return sorted(size.size_px for size in tier.sizes.all())
+    return sorted(tier.sizes.values_list('size_px', flat=True))
+
+
+async def aget_user_tier(user):
+    """Async get_user_tier."""
+    if not user.tier_id:
+        user.tier = await Tier.objects.aget(name='Basic')
+    elif not type(user).tier.is_cached(user):
+        user.tier = await Tier.objects.aget(pk=user.tier_id)
+    return user.tier
+
+
+async def aget_tier_sizes(user):
+    """Async get_tier_sizes."""
+    tier = await aget_user_tier(user)
+    if 'sizes' in getattr(tier, '_prefetched_objects_cache', {}):
+        return sorted(size.size_px for size in tier.sizes.all())
+    return sorted([size_px async for size_px in tier.sizes.values_list('size_px', flat=True)])
+
+
+def thumbnail_options(size_px):
+    """Thumbnail options for a thumbnail bounded by height."""
+    return {'size': (0, int(size_px))}
+
+
+def queue_thumbnails(image, sizes):
+    """
+    Queue thumbnail renders of image for every given size.
+
+    Sizes already rendered for another image of the same blob are
+    shared instead of queued again.
+    """
+    return queue_images_thumbnails([image], sizes)
+
+
+def queue_images_thumbnails(images, sizes):
+    """queue_thumbnails for many images with two queries."""
+    blob_ids = {image.blob_id for image in images if image.blob_id}
+    rendered = {}
+    if blob_ids:
+        for job in ThumbnailJob.objects.filter(
+                image__blob__in=blob_ids, size_px__in=sizes, status=ThumbnailJob.Status.DONE
+        ).select_related('image'):
+            rendered[(job.image.blob_id, job.size_px)] = job
+    jobs = []
+    analysed = []
+    for image in images:
+        for size_px in sizes:
+            job = ThumbnailJob(image=image, size_px=size_px)
+            done = rendered.get((image.blob_id, size_px))
+            if done:
+                job.status = ThumbnailJob.Status.DONE
+                job.name = done.name
+                job.formats = done.formats
+                if not image.placeholder and done.image.placeholder:
+                    for field in ANALYSIS_FIELDS:
+                        setattr(image, field, getattr(done.image, field))
+                    analysed.append(image)
+            jobs.append(job)
+    if analysed:
+        Image.objects.bulk_update(analysed, ANALYSIS_FIELDS)
+    return ThumbnailJob.objects.bulk_create(jobs, ignore_conflicts=True)
+
+
+def claim_jobs(limit, image_ids=None):
+    """
+    Mark up to limit pending jobs, of the given images only if image_ids
+    is passed, as running and return them.
+
+    Jobs left running by a crashed worker for longer than
+    THUMBNAIL_JOB_TIMEOUT seconds are claimed again.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.THUMBNAIL_JOB_TIMEOUT)
+    queryset = ThumbnailJob.objects.filter(
+        Q(status=ThumbnailJob.Status.PENDING) |
+        Q(status=ThumbnailJob.Status.RUNNING, updated_at__lt=stale)
+    )
+    if image_ids is not None:
+        queryset = queryset.filter(image_id__in=image_ids)
+    with transaction.atomic():
+        jobs = list(
+            queryset
+            .select_for_update(skip_locked=True, of=('self',))
+            .select_related('image')
+            .order_by('id')[:limit]
+        )
+        ThumbnailJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+            status=ThumbnailJob.Status.RUNNING,
+            attempts=F('attempts') + 1,
+            updated_at=now,
+        )
+    for job in jobs:
+        job.status = ThumbnailJob.Status.RUNNING
+        job.attempts += 1
+    return jobs
+
+
+def group_jobs(jobs):
+    """Group claimed jobs by image, keeping claim order."""
+    groups = {}
+    for job in jobs:
+        groups.setdefault(job.image_id, []).append(job)
+    return list(groups.values())
+
+
+def save_thumbnail(original_name, size_px, thumbnail):
+    """
+    Save thumbnail of an original under its easy_thumbnails name, plus a
+    variant in every modern format Pillow supports. Returns the name and
+    the variant formats.
+    """
+    transparent = is_transparent(thumbnail)
+    name = get_thumbnailer(original_name).get_thumbnail_name(thumbnail_options(size_px), transparent=transparent)
+    formats = [('PNG' if transparent else 'JPEG', name)]
+    formats += [(fmt.upper(), variant_name(name, fmt)) for fmt in MODERN_FORMATS]
+    for image_format, file_name in formats:
+        output = io.BytesIO()
+        with stage('encode'):
+            thumbnail.save(output, format=image_format, quality=thumbnail_settings.THUMBNAIL_QUALITY)
+        with stage('storage_write'):
+            save_file(file_name, output.getvalue())
+    return name, MODERN_FORMATS
+
+
+def thumbnail_files(name, formats):
+    """Storage names of a thumbnail and its format variants."""
+    return [name] + [variant_name(name, fmt) for fmt in formats.split(',') if fmt]
+
+
+def render_image(original_name, sizes):
+    """
+    Render and save thumbnails of an original for all sizes from a single
+    decode, analysing the smallest one for its placeholder, dominant color
+    and perceptual hash. Returns ({size_px: (name,
+    formats)}, {analysis field: value}).
+
+    Doesn't touch the database, so it can run in a worker process.
+    """
+    with default_storage.open(original_name, 'rb') as source, stage('decode'):
+        thumbnails = render_thumbnails(source, sizes)
+    with stage('analyse'):
+        smallest = thumbnails[min(thumbnails)]
+        placeholder, dominant_color = make_placeholder(smallest)
+        analysis = {
+            'placeholder': placeholder,
+            'dominant_color': dominant_color,
+            **split_hash(difference_hash(smallest)),
+        }
+    rendered = {size_px: save_thumbnail(original_name, size_px, thumbnail) for size_px, thumbnail in thumbnails.items()}
+    return rendered, analysis
+
+
+def record_render(jobs, rendered=None, error=None):
+    """
+    Record outcome of rendering jobs of an image, rendered being the
+    result of render_image. The analysis is saved on every image of the
+    blob that has none yet. Images too large to decode aren't retried.
+    """
+    if error is None:
+        rendered, analysis = rendered
+        image = jobs[0].image
+        images = Image.objects.filter(pk=image.pk)
+        if image.blob_id:
+            images = Image.objects.filter(blob=image.blob_id, placeholder='') | images
+        images.update(**analysis)
+    for job in jobs:
+        if error is None:
+            job.name, formats = rendered[job.size_px]
+            job.formats = ','.join(formats)
+            job.status = ThumbnailJob.Status.DONE
+            job.error = ''
+        else:
+            if job.attempts >= settings.THUMBNAIL_JOB_MAX_ATTEMPTS or isinstance(error, ImageTooLarge):
+                job.status = ThumbnailJob.Status.FAILED
+            else:
+                job.status = ThumbnailJob.Status.PENDING
+            job.error = str(error)
+        job.updated_at = timezone.now()
+    ThumbnailJob.objects.bulk_update(jobs, ['status', 'name', 'formats', 'error', 'updated_at'])
+    return jobs
+
+
+def render_jobs(jobs):
+    """
+    Render claimed jobs of one image from a single decode of its original
+    and record the outcome.
+    """
+    try:
+        rendered = render_image(jobs[0].image.original_image.name, [job.size_px for job in jobs])
+    except Exception as error:
+        return record_render(jobs, error=error)
+    return record_render(jobs, rendered)
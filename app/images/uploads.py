@@ -0,0 +1,214 @@
+import hashlib
+import io
+import os
+import shutil
+import uuid
+import warnings
+
+from django.conf import settings
+from django.http import UnreadablePostError
+from PIL import Image as PILImage
+from rest_framework.exceptions import ValidationError
+
+from .blobs import file_sha256, store_received_file
+from .exceptions import ImageTooLarge
+from .media import RangeFile
+from .decoding import get_orientation, oriented_size
+from .models import Image
+from .quotas import reserve_quota
+from .storage import staging_storage
+
+IMAGE_SIGNATURES = {
+    b'\xff\xd8\xff': 'JPEG',
+    b'\x89PNG\r\n\x1a\n': 'PNG',
+}
+ALLOWED_EXTENSIONS = ['.jpg', '.jpeg', '.png']
+
+
+def check_filename(filename):
+    """Validates uploaded file extension."""
+    if os.path.splitext(filename)[1].lower() not in ALLOWED_EXTENSIONS:
+        raise ValidationError({'filename': 'Only PNG and JPG images are supported.'})
+
+
+def check_size(size):
+    """Validates declared upload size in bytes."""
+    if size > settings.IMAGE_MAX_UPLOAD_SIZE:
+        raise ImageTooLarge(f'Images can have at most {settings.IMAGE_MAX_UPLOAD_SIZE} bytes.')
+
+
+def sniff_image(header, complete=False):
+    """
+    Validate an image from the first bytes of its file.
+
+    Returns the image's metadata (see header_metadata) once the header
+    could be parsed, or None if more bytes are needed. Only the header is
+    parsed, the pixel data is never decoded.
+    """
+    for signature, image_format in IMAGE_SIGNATURES.items():
+        if header[:len(signature)] == signature[:len(header)]:
+            break
+    else:
+        raise ValidationError({'file': 'Uploaded file is not a PNG or JPG image.'})
+    if len(header) < len(signature):
+        return None
+
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', PILImage.DecompressionBombWarning)
+            image = PILImage.open(io.BytesIO(header), formats=[image_format])
+    except (PILImage.DecompressionBombError, PILImage.DecompressionBombWarning):
+        raise ImageTooLarge('Image has too many pixels.')
+    except (OSError, SyntaxError):
+        if complete or len(header) >= settings.UPLOAD_HEADER_SIZE:
+            raise ValidationError({'file': 'Uploaded file is not a valid image.'})
+        return None
+
+    width, height = image.size
+    if width * height > settings.IMAGE_MAX_PIXELS:
+        raise ImageTooLarge(f'Images can have at most {settings.IMAGE_MAX_PIXELS} pixels.')
+    return header_metadata(image)
+
+
+def header_metadata(image):
+    """
+    Image fields describing an opened, not decoded, image: its format,
+    color mode, EXIF orientation and size once the orientation is applied.
+    """
+    orientation = get_orientation(image)
+    width, height = oriented_size(image, orientation)
+    return {'width': width, 'height': height, 'format': image.format, 'mode': image.mode, 'orientation': orientation}
+
+
+def image_metadata(file):
+    """
+    Validate an image file from its header, returns its metadata with
+    the size in bytes.
+    """
+    file.seek(0)
+    metadata = sniff_image(file.read(settings.UPLOAD_HEADER_SIZE), complete=True)
+    file.seek(0)
+    return {**metadata, 'file_size': file.size}
+
+
+def content_range_start(content_range, upload):
+    """
+    First byte position from a 'bytes start-end/total' Content-Range header.
+    """
+    if not content_range:
+        return upload.offset
+    try:
+        unit, byte_range = content_range.split(' ', 1)
+        positions, total = byte_range.split('/')
+        start = int(positions.split('-')[0])
+    except ValueError:
+        raise ValidationError({'content_range': 'Use "bytes start-end/total" format.'})
+    if unit != 'bytes' or total not in ('*', str(upload.size)):
+        raise ValidationError({'content_range': 'Range does not match the upload.'})
+    return start
+
+
+def receive_chunk(upload, stream):
+    """
+    Stream request body, meant to continue the upload at upload.offset,
+    into a part file next to the upload file.
+
+    The body is read in UPLOAD_CHUNK_SIZE pieces and written straight to
+    the part file in staging storage, so memory use doesn't depend on file
+    size, and no lock is held while a slow client sends it. The image
+    header is validated as soon as enough bytes arrived.
+
+    Returns (part path, bytes received, whether the header is valid,
+    sha256 of the file if the chunk completes it), for append_chunk.
+    """
+    path = staging_storage.path(upload.name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    part_path = f'{path}.{uuid.uuid4().hex}.part'
+    header = b''
+    validated = upload.validated
+    digest = hashlib.sha256() if upload.offset == 0 else None
+    if not validated and upload.offset:
+        with open(path, 'rb') as file:
+            header = file.read(min(upload.offset, settings.UPLOAD_HEADER_SIZE))
+
+    received = 0
+    try:
+        with open(part_path, 'wb') as part:
+            while stream is not None:
+                try:
+                    chunk = stream.read(settings.UPLOAD_CHUNK_SIZE)
+                except UnreadablePostError:
+                    break  # client went away, keep what was received for resuming
+                if not chunk:
+                    break
+                if upload.offset + received + len(chunk) > upload.size:
+                    raise ValidationError({'file': 'Upload is larger than its declared size.'})
+                if not validated:
+                    header += chunk[:settings.UPLOAD_HEADER_SIZE - len(header)]
+                    validated = sniff_image(header) is not None
+                part.write(chunk)
+                received += len(chunk)
+                if digest:
+                    digest.update(chunk)
+
+        complete = upload.offset + received == upload.size
+        if not validated and complete:
+            sniff_image(header, complete=True)
+            validated = True
+    except BaseException:
+        os.remove(part_path)
+        raise
+    sha256 = None
+    if complete:
+        if digest is None:
+            # Bytes before the offset are committed and never rewritten.
+            with open(path, 'rb') as file, open(part_path, 'rb') as part:
+                digest = hashlib.sha256()
+                for source in (RangeFile(file, upload.offset), part):
+                    for block in iter(lambda: source.read(settings.UPLOAD_CHUNK_SIZE), b''):
+                        digest.update(block)
+        sha256 = digest.hexdigest()
+    return part_path, received, validated, sha256
+
+
+def append_chunk(upload, part_path, received, validated):
+    """
+    Append a part file received by receive_chunk to the upload file at
+    upload.offset and advance the offset. The caller holds the upload
+    row lock and checked the offset is the one the part was received at.
+    """
+    path = staging_storage.path(upload.name)
+    if upload.offset == 0:
+        os.replace(part_path, path)
+    else:
+        with open(path, 'r+b') as file, open(part_path, 'rb') as part:
+            file.seek(upload.offset)
+            file.truncate()
+            shutil.copyfileobj(part, file, settings.UPLOAD_CHUNK_SIZE)
+        os.remove(part_path)
+    upload.offset += received
+    upload.validated = validated
+    upload.save(update_fields=['offset', 'validated'])
+
+
+def discard_upload(upload):
+    """Remove an upload and its partial file."""
+    staging_storage.delete(upload.name)
+    upload.delete()
+
+
+def finish_upload(upload, sha256=None, moved=None):
+    """
+    Turn a completely received upload into an image, reading its
+    metadata from the header again. moved is passed to
+    store_received_file.
+    """
+    with staging_storage.open(upload.name) as file:
+        metadata = image_metadata(file)
+        if sha256 is None:
+            sha256 = file_sha256(file)
+    reserve_quota(upload.user, upload.size)
+    blob = store_received_file(upload.name, sha256, moved)
+    image = Image.objects.create(user=upload.user, original_image=blob.name, blob=blob, **metadata)
+    upload.delete()
+    return image
@@ -9,7 +9,14 @@ router = DefaultRouter()
 router.register('', views.ImageViewSet)
 
 urlpatterns = [
+    path('uploads/', views.ImageUploadCreate.as_view(), name='image-upload'),
+    path('uploads/bulk/', views.ImageBulkUpload.as_view(), name='image-bulk-upload'),
+    path('uploads/<uuid:pk>/', views.ImageUploadChunk.as_view(), name='image-upload-detail'),
+    path('', views.ImageList.as_view(), name='image-list'),
     path('', include(router.urls)),
     path('get-temp-link/', views.TempLinkGenerate.as_view(), name='get-temp-link'),
-    path('binary/<str:access_code>', views.BinaryImage.as_view(), name='binary-image')
+    path('revoke-temp-link/', views.TempLinkRevoke.as_view(), name='revoke-temp-link'),
+    path('binary/<str:access_code>', views.BinaryImage.as_view(), name='binary-image'),
+    path('binary/<str:access_code>/image', views.BinaryImageFile.as_view(), name='binary-image-file'),
+    path('media/<path:name>', views.MediaFile.as_view(), name='media'),
 ]
@@ -1,29 +1,352 @@
+import io
+import os
+from functools import partial
+
+from asgiref.sync import sync_to_async
 from rest_framework import viewsets, mixins, views, status
 from . import serializers
-from .models import Image, TemporaryLinkModel
+from .binary import aget_binary_image
+from .blobs import store_uploaded_file
+from .bulk import BulkImport, is_archive, iter_archive
+from .exceptions import ImageNotAnalysed, ImageTooLarge
+from .links import aget_temporary_link, delete_temporary_link, get_temporary_link
+from .media import IMMUTABLE_CACHE_CONTROL, serve_file
+from .metrics import export, stage
+from .models import Image, ImageUpload, ThumbnailJob
+from .negotiation import IgnoreClientContentNegotiation
+from .pagination import ImageCursorPagination
 from .permissions import TempLinkUser
+from .quotas import check_quota, reserve_quota
+from .formats import negotiate_format
+from .rendering import get_render
+from .similarity import MAX_DISTANCE, find_similar, join_hash
+from .storage import delete_file, restore_file, staging_storage
+from .throttling import (
+    BinaryImageRateThrottle, BulkUploadRateThrottle, RenderRateThrottle, SimilarImagesRateThrottle,
+    TempLinkRateThrottle, UploadRateThrottle,
+)
+from .thumbnails import aget_tier_sizes, get_tier_sizes, get_user_tier, queue_thumbnails, thumbnail_files
+from .uploads import (
+    append_chunk, content_range_start, discard_upload, finish_upload, image_metadata, receive_chunk,
+)
 from rest_framework.response import Response
-from datetime import datetime
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.decorators import action
+from rest_framework.exceptions import (
+    APIException, NotAuthenticated, NotFound, PermissionDenied, Throttled, ValidationError,
+)
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.views import exception_handler
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.decorators import classonlymethod
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+from django.shortcuts import get_object_or_404
+
+
+def get_requested_sizes(request, tier_sizes):
+    """
+    Tier sizes narrowed down by the ?sizes= query parameter.
+    """
+    sizes = request.query_params.get('sizes')
+    if not sizes:
+        return tier_sizes
+    try:
+        requested = {int(size) for size in sizes.split(',')}
+    except ValueError:
+        raise ValidationError({'sizes': 'Sizes must be a comma separated list of integers.'})
+    return [size for size in tier_sizes if size in requested]
+
+
+def filter_images(request, queryset):
+    """
+    Images narrowed down by the ?image_format=, ?min_width= and
+    ?min_height= query parameters. ?format= is taken by DRF's format
+    suffixes.
+    """
+    params = request.query_params
+    if params.get('image_format'):
+        queryset = queryset.filter(format=params['image_format'].upper())
+    for param, lookup in (('min_width', 'width__gte'), ('min_height', 'height__gte')):
+        if params.get(param):
+            try:
+                queryset = queryset.filter(**{lookup: int(params[param])})
+            except ValueError:
+                raise ValidationError({param: 'Must be an integer.'})
+    return queryset
+
+
+class AsyncAPIView(View):
+    """
+    Async counterpart of APIView for hot read endpoints, which DRF can't
+    serve asynchronously. Authenticates with the DRF authentication
+    classes and responds with JSON, API exceptions included.
+    """
+    authentication_required = False
+    throttle_classes = []
+
+    @classonlymethod
+    def as_view(cls, **initkwargs):
+        # Session authentication enforces CSRF itself, like in APIView.
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        authenticators = [auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+        self.request = Request(request, authenticators=authenticators)
+        try:
+            if self.authentication_required:
+                await self.authenticate(authenticators)
+            await self.check_throttles()
+            response = await super().dispatch(self.request, *args, **kwargs)
+        except (APIException, Http404) as error:
+            response = exception_handler(error, {})
+        if isinstance(response, Response):
+            response.accepted_renderer = JSONRenderer()
+            response.accepted_media_type = JSONRenderer.media_type
+            response.renderer_context = {'request': self.request, 'view': self}
+        return response
+
+    async def authenticate(self, authenticators):
+        user = await sync_to_async(lambda: self.request.user)()
+        if not user.is_authenticated:
+            error = NotAuthenticated()
+            if authenticators:
+                error.auth_header = authenticators[0].authenticate_header(self.request)
+            raise error
+
+    async def check_throttles(self):
+        for throttle in [throttle_class() for throttle_class in self.throttle_classes]:
+            if not await sync_to_async(throttle.allow_request)(self.request, self):
+                raise Throttled(throttle.wait())
+
+
+class ImageList(AsyncAPIView):
+    """
+    Lists images of the user asynchronously, uploads are handed to ImageViewSet.
+    """
+    authentication_required = True
+
+    async def get(self, request):
+        tier_sizes = await aget_tier_sizes(request.user)
+        context = {
+            'request': request,
+            'tier_sizes': tier_sizes,
+            'sizes': get_requested_sizes(request, tier_sizes),
+            'thumbnail_format': negotiate_format(request),
+        }
+        queryset = filter_images(request, Image.objects.filter(user=request.user)).prefetch_related('thumbnail_jobs')
+        paginator = ImageCursorPagination()
+        page = await sync_to_async(paginator.paginate_queryset)(queryset, request, self)
+        serializer = serializers.ImageSerializer(page, many=True, context=context)
+        response = paginator.get_paginated_response(serializer.data)
+        patch_vary_headers(response, ['Accept'])
+        return response
+
+    async def post(self, request):
+        create = ImageViewSet.as_view({'post': 'create'})
+        return await sync_to_async(create)(request._request)
 
 
-class ImageViewSet(mixins.ListModelMixin,
-                   mixins.CreateModelMixin,
+class ImageViewSet(mixins.CreateModelMixin,
                    viewsets.GenericViewSet):
 
     queryset = Image.objects.all()
     serializer_class = serializers.ImageSerializer
     permission_classes = [IsAuthenticated]
+    throttle_classes = [UploadRateThrottle]
 
     def get_queryset(self):
         return self.queryset.filter(user=self.request.user)
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['tier_sizes'] = get_tier_sizes(self.request.user)
+        context['sizes'] = get_requested_sizes(self.request, context['tier_sizes'])
+        context['thumbnail_format'] = negotiate_format(self.request)
+        return context
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        patch_vary_headers(response, ['Accept'])
+        return response
+
+    @action(detail=True, url_path='render', url_name='render', throttle_classes=[RenderRateThrottle],
+            content_negotiation_class=IgnoreClientContentNegotiation)
+    def render_image(self, request, pk=None):
+        """
+        Renders image on demand, e.g. ?w=300&h=200&fit=cover&fmt=png&q=80
+        """
+        max_render_px = get_user_tier(request.user).max_render_px
+        if not max_render_px:
+            raise PermissionDenied('Your tier does not allow on demand renders.')
+        params = serializers.RenderSerializer(data=request.query_params, context={'max_render_px': max_render_px})
+        params.is_valid(raise_exception=True)
+        render_params = dict(params.validated_data)
+        render_params.setdefault('fmt', negotiate_format(request) or 'jpeg')
+        data, content_type = get_render(self.get_object(), **render_params)
+        return HttpResponse(data, content_type=content_type)
+
+    @action(detail=True, url_path='similar', url_name='similar', throttle_classes=[SimilarImagesRateThrottle])
+    def similar(self, request, pk=None):
+        """
+        Near-duplicates of the image in the user's library, closest first,
+        e.g. ?distance=4 for at most 4 of the 64 hash bits differing.
+        """
+        distance = request.query_params.get('distance', settings.SIMILAR_IMAGES_DISTANCE)
+        try:
+            distance = int(distance)
+        except ValueError:
+            raise ValidationError({'distance': 'Must be an integer.'})
+        if not 0 <= distance <= MAX_DISTANCE:
+            raise ValidationError({'distance': f'Must be between 0 and {MAX_DISTANCE}.'})
+        image = self.get_object()
+        if join_hash(image) is None:
+            raise ImageNotAnalysed()
+        with stage('similar'):
+            matches = find_similar(image, self.get_queryset(), distance)[:settings.SIMILAR_IMAGES_LIMIT]
+        images = [match for _, match in matches]
+        prefetch_related_objects(images, 'thumbnail_jobs')
+        serializer = self.get_serializer(images, many=True)
+        results = [{**data, 'distance': match[0]} for data, match in zip(serializer.data, matches)]
+        return Response({'results': results})
+
     def perform_create(self, serializer):
-        return serializer.save(user=self.request.user)
+        sha256 = getattr(self.request._request, 'upload_digests', {}).get('original_image')
+        original_image = serializer.validated_data['original_image']
+        metadata = image_metadata(original_image)
+        written = []
+        try:
+            with transaction.atomic():
+                reserve_quota(self.request.user, original_image.size)
+                with stage('upload_store'):
+                    blob = store_uploaded_file(original_image, sha256, written)
+                image = serializer.save(user=self.request.user, original_image=blob.name, blob=blob, **metadata)
+                with stage('queue_thumbnails'):
+                    queue_thumbnails(image, serializer.context['tier_sizes'])
+        except Exception:
+            # Rolled back, nothing references the file written.
+            for name in written:
+                delete_file(name)
+            raise
+        return image
+
+
+class ImageUploadCreate(views.APIView):
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [UploadRateThrottle]
+
+    def post(self, request):
+        serializer = serializers.ImageUploadSerializer(data=request.data, context={'request': request, })
+        serializer.is_valid(raise_exception=True)
+        check_quota(request.user, serializer.validated_data['size'])
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class ImageBulkUpload(views.APIView):
+    """
+    Imports many images at once, sent as multipart files in the files
+    field or as a zip or tar archive request body. Responds with the
+    outcome of every file in order.
+    """
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [BulkUploadRateThrottle]
+
+    def post(self, request):
+        sizes = get_tier_sizes(request.user)
+        bulk = BulkImport(request.user, sizes, partial(BulkUploadRateThrottle().charge, request))
+        if is_archive(request.content_type):
+            for name, open_file in iter_archive(request.stream or io.BytesIO(), request.content_type):
+                bulk.add(name, open_file)
+        else:
+            for file in request.FILES.getlist('files'):
+                bulk.add(file.name, lambda: file)
+        results = bulk.finish()
+        if not results:
+            raise ValidationError({'files': 'No files were sent.'})
+        context = {'request': request, 'sizes': sizes, 'thumbnail_format': negotiate_format(request)}
+        for result in results:
+            if 'image' in result:
+                result['image'] = serializers.ImageSerializer(result['image'], context=context).data
+        created = any(result['status'] == 'created' for result in results)
+        if not created and bulk.throttled is not None:
+            raise bulk.throttled
+        return Response({'results': results},
+                        status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST)
+
+
+class ImageUploadChunk(views.APIView):
+    """
+    Resumable upload. Chunks are sent with PUT as raw bytes, optionally
+    with a Content-Range header, GET returns the offset to resume from.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        upload = get_object_or_404(ImageUpload, pk=pk, user=request.user)
+        serializer = serializers.ImageUploadSerializer(upload, context={'request': request, })
+        return Response(serializer.data)
+
+    def put(self, request, pk):
+        """
+        The chunk is received into a part file without holding locks, the
+        upload row is only locked to check the offset didn't move meanwhile
+        and to advance it.
+        """
+        upload = get_object_or_404(ImageUpload, pk=pk, user=request.user)
+        start = content_range_start(request.headers.get('Content-Range'), upload)
+        if start != upload.offset:
+            return self.offset_conflict(upload)
+        try:
+            with stage('upload_receive'):
+                part_path, received, validated, sha256 = receive_chunk(upload, request.stream)
+        except (ValidationError, ImageTooLarge) as error:
+            discard_upload(upload)
+            return Response(error.detail, status=error.status_code)
+
+        moved = []
+        try:
+            with transaction.atomic():
+                upload = ImageUpload.objects.select_for_update().filter(pk=pk).first()
+                if upload is None or upload.offset != start:
+                    os.remove(part_path)
+                    if upload is None:
+                        raise Http404()
+                    return self.offset_conflict(upload)
+                append_chunk(upload, part_path, received, validated)
+                if upload.offset < upload.size:
+                    serializer = serializers.ImageUploadSerializer(upload, context={'request': request, })
+                    return Response(serializer.data)
+                with stage('upload_store'):
+                    image = finish_upload(upload, sha256, moved)
+        except Exception:
+            # The upload rolled back to its last offset, move its file back so it can be resumed.
+            for name in moved:
+                restore_file(name, staging_storage, upload.name)
+            raise
+
+        sizes = get_tier_sizes(request.user)
+        with stage('queue_thumbnails'):
+            queue_thumbnails(image, sizes)
+        serializer = serializers.ImageSerializer(image, context={'request': request, 'sizes': sizes})
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def offset_conflict(self, upload):
+        return Response({'error': 'Chunk does not start at upload offset', 'offset': upload.offset},
+                        status=status.HTTP_409_CONFLICT)
 
 
 class TempLinkGenerate(views.APIView):
     permission_classes = [IsAuthenticated, TempLinkUser]
+    throttle_classes = [TempLinkRateThrottle]
 
     def get(self, request):
         return Response('Please use post method to create temporary link')
@@ -36,12 +359,94 @@ class TempLinkGenerate(views.APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class BinaryImage(views.APIView):
+class TempLinkRevoke(views.APIView):
+    permission_classes = [IsAuthenticated, TempLinkUser]
+
+    def post(self, request):
+        access_code = str(request.data.get('temp_link', '')).rstrip('/').rsplit('/', 1)[-1]
+        temp_link_obj = get_temporary_link(access_code) if access_code else None
+        if temp_link_obj is None or not Image.objects.filter(pk=temp_link_obj.image.pk, user=request.user).exists():
+            return Response({'error': 'No temporary link found'}, status=status.HTTP_404_NOT_FOUND)
+        delete_temporary_link(temp_link_obj)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 
-    def get(self, request, access_code):
+class MediaFile(views.APIView):
+    """
+    Serves originals and thumbnails to the owner of the image.
+    """
+    permission_classes = [IsAuthenticated]
+    content_negotiation_class = IgnoreClientContentNegotiation
+
+    def get(self, request, name):
+        images = Image.objects.filter(user=request.user)
+        originals = images.filter(original_image=name).values_list('blob__name', flat=True)
+        if originals:
+            if not get_user_tier(request.user).original:
+                raise Http404()
+            return serve_file(request, name, IMMUTABLE_CACHE_CONTROL if originals[0] == name else None)
+        jobs = ThumbnailJob.objects.filter(
+            image__in=images, status=ThumbnailJob.Status.DONE, name__startswith=f'{os.path.splitext(name)[0]}.')
+        if not any(name in thumbnail_files(job.name, job.formats) for job in jobs):
+            raise Http404()
+        return serve_file(request, name)
+
+
+class BinaryImage(AsyncAPIView):
+    """
+    Serves temporary links asynchronously, so slow clients and storage
+    don't hold up a worker.
+    """
+    throttle_classes = [BinaryImageRateThrottle]
+
+    async def get_binary_image(self, access_code):
+        """
+        Storage name of the binary image of a valid link and the seconds
+        until the link expires.
+        """
+        temp_link_obj = await aget_temporary_link(access_code)
+        if temp_link_obj is None:
+            raise NotFound({'error': 'No images found'})
+        lifetime = (temp_link_obj.expiry_time - timezone.now()).total_seconds()
+        if lifetime <= 0:
+            await sync_to_async(delete_temporary_link)(temp_link_obj)
+            raise ValidationError({'access_code': 'Link expired'})
         try:
-            temp_link_obj = TemporaryLinkModel.objects.get(one_time_code=access_code)
-        except TemporaryLinkModel.DoesNotExist:
-            return Response({'error': 'No images found'}, status=status.HTTP_404_NOT_FOUND)
-        serializer = serializers.BinaryImageSerializer(temp_link_obj, context={'request': request, })
-        return Response(serializer.data)
+            name = await aget_binary_image(temp_link_obj.image, temp_link_obj.threshold)
+        except FileNotFoundError:
+            # The image was deleted after the link was resolved
+            raise NotFound({'error': 'No images found'})
+        return name, lifetime
+
+    async def get(self, request, access_code):
+        await self.get_binary_image(access_code)
+        url = request.build_absolute_uri(reverse('images:binary-image-file', args=[access_code]))
+        return Response({'binary_image': url})
+
+
+class BinaryImageFile(BinaryImage):
+    """
+    Serves the binary image of a temporary link, cacheable until the link
+    expires.
+
+    With the 'django' sendfile backend the file is read in a thread,
+    binary images are small enough to be sent from memory.
+    """
+
+    async def get(self, request, access_code):
+        name, lifetime = await self.get_binary_image(access_code)
+        return await sync_to_async(serve_file, thread_sensitive=False)(
+            request, name, f'private, max-age={int(lifetime)}', buffered=True)
+
+
+class Metrics(View):
+    """
+    Prometheus metrics, for scrapers connecting from METRICS_ALLOWED_IPS.
+    Matched against REMOTE_ADDR, so it must not be reached through a proxy.
+    """
+
+    def get(self, request):
+        if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+            raise Http404()
+        data, content_type = export()
+        return HttpResponse(data, content_type=content_type)